@@ -96,9 +96,22 @@ class BgpDrAgentNotifyApi(object):
         self._notification_host_cast(context, 'bgp_speaker_remove_end',
                 {'bgp_speaker': {'id': bgp_speaker_id}}, host)
 
-    def _notification_host_cast(self, context, method, payload, host):
+    def bgp_speaker_vrfs_updated(self, context, bgp_speaker_id, host):
+        """Tell BgpDrAgent about a change to the VRFs of a BGP Speaker.
+
+        Invoked on BGPVRF changes, on BGPVRF router and speaker association
+        changes, and on router interface changes of the associated routers.
+        The BgpDrAgent fetches the VRFs with the next delta of the BGP
+        Speaker.
+        """
+        self._notification_host_cast(context, 'bgp_speaker_vrfs_update_end',
+                {'bgp_speaker': {'id': bgp_speaker_id}}, host, version='1.1')
+
+    def _notification_host_cast(self, context, method, payload, host,
+                                version=None):
         """Send payload to BgpDrAgent in the cast mode"""
-        cctxt = self.client.prepare(topic=self.topic, server=host)
+        kwargs = {'version': version} if version else {}
+        cctxt = self.client.prepare(topic=self.topic, server=host, **kwargs)
         cctxt.cast(context, method, payload=payload)
 
     def _notification_host_call(self, context, method, payload, host):
@@ -32,7 +32,9 @@ class BgpSpeakerRpcCallback(object):
 
     # API version history:
     # 1.0 BGPDRPluginApi BASE_RPC_API_VERSION
-    target = oslo_messaging.Target(version='1.0')
+    # 1.1 Added get_bgp_speakers_delta
+    # 1.2 Added get_bgp_peers_info
+    target = oslo_messaging.Target(version='1.2')
 
     @property
     def plugin(self):
@@ -58,9 +60,34 @@ class BgpSpeakerRpcCallback(object):
                                         ['peer_ip', 'remote_as',
                                          'auth_type', 'password'])
 
+    def get_bgp_peers_info(self, context, bgp_peer_ids):
+        """Return the details of several BgpPeers at once.
+
+        Invoked by the BgpDrAgent to lookup the details of the BGP peers
+        of a BGP Speaker in a single call. Deleted BGP peers are omitted.
+        """
+        if not bgp_peer_ids:
+            return []
+        return self.plugin.get_bgp_peers(context,
+                                         fields=['id', 'peer_ip',
+                                                 'remote_as', 'auth_type',
+                                                 'password'],
+                                         filters={'id': bgp_peer_ids})
+
     def get_bgp_speakers(self, context, host=None, **kwargs):
         """Returns the list of all BgpSpeakers.
 
         Typically invoked by the BgpDrAgent as part of its bootstrap process.
         """
         return self.plugin.get_bgp_speakers_for_agent_host(context, host)
+
+    def get_bgp_speakers_delta(self, context, host=None, generations=None,
+                               **kwargs):
+        """Returns the BgpSpeakers of a host changed since a generation.
+
+        Invoked by the BgpDrAgent on resync. generations maps BgpSpeaker IDs
+        to the last generation seen by the agent; only the routes changed
+        since then are returned for those BgpSpeakers.
+        """
+        return self.plugin.get_bgp_speaker_deltas_for_agent_host(
+                                context, host, generations or {})
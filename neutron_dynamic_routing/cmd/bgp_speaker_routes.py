@@ -0,0 +1,95 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from neutron.common import config as common_config
+from neutron import context
+
+from neutron_dynamic_routing._i18n import _, _LI, _LW
+from neutron_dynamic_routing.db import bgp_db
+
+LOG = logging.getLogger(__name__)
+
+ROUTES_CLI_OPTS = [
+    cfg.StrOpt('bgp-speaker-id',
+               help=_("Only process the BGP speaker with this ID. "
+                      "All BGP speakers are processed by default.")),
+    cfg.BoolOpt('verify-only', default=False,
+                help=_("Report differences between the stored routes and "
+                       "the routes computed from the topology without "
+                       "rewriting the stored routes."))
+]
+
+
+def _get_bgp_speaker_ids(ctx, db):
+    if cfg.CONF.bgp_speaker_id:
+        return [cfg.CONF.bgp_speaker_id]
+    return [speaker['id'] for speaker in db.get_bgp_speakers(ctx)]
+
+
+def _report(bgp_speaker_id, result):
+    for route in result['missing_routes']:
+        LOG.warning(_LW("BGP speaker %(bgp_speaker_id)s: missing route "
+                        "%(destination)s via %(next_hop)s"),
+                    {'bgp_speaker_id': bgp_speaker_id,
+                     'destination': route['destination'],
+                     'next_hop': route['next_hop']})
+    for route in result['stale_routes']:
+        LOG.warning(_LW("BGP speaker %(bgp_speaker_id)s: stale route "
+                        "%(destination)s via %(next_hop)s"),
+                    {'bgp_speaker_id': bgp_speaker_id,
+                     'destination': route['destination'],
+                     'next_hop': route['next_hop']})
+    return not (result['missing_routes'] or result['stale_routes'])
+
+
+def _verify(ctx, db, bgp_speaker_ids):
+    in_sync = True
+    results = db.verify_bgp_speakers_routes(ctx, bgp_speaker_ids)
+    for bgp_speaker_id in bgp_speaker_ids:
+        in_sync = _report(bgp_speaker_id, results[bgp_speaker_id]) and in_sync
+    return in_sync
+
+
+def _rebuild(ctx, db, bgp_speaker_ids):
+    routes = db.rebuild_bgp_speakers_routes(ctx, bgp_speaker_ids)
+    for bgp_speaker_id in bgp_speaker_ids:
+        LOG.info(_LI("BGP speaker %(bgp_speaker_id)s: stored %(count)d "
+                     "routes"),
+                 {'bgp_speaker_id': bgp_speaker_id,
+                  'count': len(routes[bgp_speaker_id])})
+    return True
+
+
+def main():
+    """Rebuild or verify the bgp_speaker_routes table.
+
+    The table is maintained incrementally by the BGP service plugin. This
+    command recomputes its content from the topology, which is needed
+    whenever the table is suspected to have drifted from the topology.
+    """
+    cfg.CONF.register_cli_opts(ROUTES_CLI_OPTS)
+    common_config.init(sys.argv[1:])
+    common_config.setup_logging()
+    ctx = context.get_admin_context()
+    db = bgp_db.BgpDbMixin()
+    handler = _verify if cfg.CONF.verify_only else _rebuild
+    # The routes of all the BGP speakers are computed at once
+    in_sync = handler(ctx, db, _get_bgp_speaker_ids(ctx, db))
+    return 0 if in_sync else 1
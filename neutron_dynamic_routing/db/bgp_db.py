@@ -12,8 +12,10 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
 import itertools
 
+from oslo_config import cfg
 from oslo_db import exception as oslo_db_exc
 from oslo_utils import uuidutils
 import sqlalchemy as sa
@@ -22,6 +24,7 @@ from sqlalchemy import orm
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm import exc as sa_exc
 
+from neutron_lib.api import converters
 from neutron_lib.api import validators
 from neutron_lib import constants as lib_consts
 from neutron_lib.db import model_base
@@ -36,11 +39,39 @@ from neutron.db import models_v2
 from neutron.plugins.ml2 import models as ml2_models
 
 from neutron_dynamic_routing._i18n import _
+from neutron_dynamic_routing.db import bgp_route_cache
+from neutron_dynamic_routing.db import bgp_vrf_db
 from neutron_dynamic_routing.extensions import bgp as bgp_ext
+from neutron_dynamic_routing.services.bgp.common import utils
 
 
 DEVICE_OWNER_ROUTER_GW = lib_consts.DEVICE_OWNER_ROUTER_GW
 DEVICE_OWNER_ROUTER_INTF = lib_consts.DEVICE_OWNER_ROUTER_INTF
+DEVICE_OWNER_ROUTER_SNAT = lib_consts.DEVICE_OWNER_ROUTER_SNAT
+
+# Router ports whose subnets are advertised as EVPN IP prefix routes
+EVPN_ROUTER_PORT_TYPES = (lib_consts.DEVICE_OWNER_ROUTER_INTF,
+                          lib_consts.DEVICE_OWNER_DVR_INTERFACE,
+                          lib_consts.DEVICE_OWNER_HA_REPLICATED_INT)
+
+# Number of stored routes read per query when iterating over the routes of a
+# BgpSpeaker
+ROUTE_QUERY_BATCH_SIZE = 1000
+
+# BgpSpeaker attributes which change the set of routes to be advertised
+ROUTE_AFFECTING_ATTRS = frozenset(['advertise_floating_ip_host_routes',
+                                   'advertise_tenant_networks'])
+
+BGP_ROUTE_HISTORY_OPTS = [
+    cfg.IntOpt('bgp_route_withdrawal_history', default=1000, min=1,
+               help=_("Number of BGP speaker route generations for which "
+                      "withdrawn routes are remembered. A BGP DRAgent "
+                      "whose last seen generation is older than this "
+                      "receives a full snapshot of the BGP speaker instead "
+                      "of a delta.")),
+]
+
+cfg.CONF.register_opts(BGP_ROUTE_HISTORY_OPTS)
 
 
 class BgpSpeakerPeerBinding(model_base.BASEV2):
@@ -81,6 +112,38 @@ class BgpSpeakerNetworkBinding(model_base.BASEV2):
                            primary_key=True)
 
 
+class BgpSpeakerRoute(model_base.BASEV2):
+
+    """Represents a route currently advertised by a BGP speaker"""
+
+    __tablename__ = 'bgp_speaker_routes'
+
+    bgp_speaker_id = sa.Column(sa.String(length=36),
+                               sa.ForeignKey('bgp_speakers.id',
+                                             ondelete='CASCADE'),
+                               nullable=False,
+                               primary_key=True)
+    destination = sa.Column(sa.String(64), nullable=False, primary_key=True)
+    next_hop = sa.Column(sa.String(64), nullable=False)
+    generation = sa.Column(sa.BigInteger, nullable=False, default=0,
+                           server_default='0')
+
+
+class BgpSpeakerWithdrawnRoute(model_base.BASEV2):
+
+    """Represents a route recently withdrawn by a BGP speaker"""
+
+    __tablename__ = 'bgp_speaker_withdrawn_routes'
+
+    bgp_speaker_id = sa.Column(sa.String(length=36),
+                               sa.ForeignKey('bgp_speakers.id',
+                                             ondelete='CASCADE'),
+                               nullable=False,
+                               primary_key=True)
+    destination = sa.Column(sa.String(64), nullable=False, primary_key=True)
+    generation = sa.Column(sa.BigInteger, nullable=False)
+
+
 class BgpSpeaker(model_base.BASEV2,
                  model_base.HasId,
                  model_base.HasProject):
@@ -93,6 +156,9 @@ class BgpSpeaker(model_base.BASEV2,
     local_as = sa.Column(sa.Integer, nullable=False, autoincrement=False)
     advertise_floating_ip_host_routes = sa.Column(sa.Boolean, nullable=False)
     advertise_tenant_networks = sa.Column(sa.Boolean, nullable=False)
+    # Whether the BGP DrAgents summarize the routes before advertising them
+    aggregate_routes = sa.Column(sa.Boolean, nullable=False, default=False,
+                                 server_default=sa.sql.false())
     peers = orm.relationship(BgpSpeakerPeerBinding,
                              backref='bgp_speaker_peer_bindings',
                              cascade='all, delete, delete-orphan',
@@ -106,6 +172,15 @@ class BgpSpeaker(model_base.BASEV2,
                             backref='bgp_speaker_vrf_bindings',
                             cascade='all, delete, delete-orphan',
                             lazy='joined')
+    # Bumped on every change to the routes or peers of the speaker
+    generation = sa.Column(sa.BigInteger, nullable=False, default=0,
+                           server_default='0')
+    # Oldest generation from which a delta can still be computed
+    base_generation = sa.Column(sa.BigInteger, nullable=False, default=0,
+                                server_default='0')
+    # Generation at which the VRFs of the speaker last changed
+    vrf_generation = sa.Column(sa.BigInteger, nullable=False, default=0,
+                               server_default='0')
 
 
 class BgpPeer(model_base.BASEV2,
@@ -135,10 +210,13 @@ class BgpDbMixin(common_db.CommonDbMixin):
                          sorts=None, limit=None, marker=None,
                          page_reverse=False):
         with context.session.begin(subtransactions=True):
+            marker_obj = self._get_marker_obj(context, 'bgp_speaker', limit,
+                                              marker)
             return self._get_collection(context, BgpSpeaker,
                                         self._make_bgp_speaker_dict,
                                         filters=filters, fields=fields,
                                         sorts=sorts, limit=limit,
+                                        marker_obj=marker_obj,
                                         page_reverse=page_reverse)
 
     def get_bgp_speaker(self, context, bgp_speaker_id, fields=None):
@@ -148,18 +226,80 @@ class BgpDbMixin(common_db.CommonDbMixin):
 
     def get_bgp_speaker_with_advertised_routes(self, context,
                                                bgp_speaker_id):
-        bgp_speaker_attrs = ['id', 'local_as', 'tenant_id']
+        bgp_speaker_attrs = ['id', 'local_as', 'tenant_id',
+                             'aggregate_routes']
         bgp_peer_attrs = ['peer_ip', 'remote_as', 'password']
         with context.session.begin(subtransactions=True):
             bgp_speaker = self.get_bgp_speaker(context, bgp_speaker_id,
                                                fields=bgp_speaker_attrs)
             res = dict((k, bgp_speaker[k]) for k in bgp_speaker_attrs)
+            res['generation'] = self._get_bgp_speaker_generation(
+                                                               context,
+                                                               bgp_speaker_id)
             res['peers'] = self.get_bgp_peers_by_bgp_speaker(context,
                                                          bgp_speaker['id'],
                                                          fields=bgp_peer_attrs)
-            res['advertised_routes'] = self.get_routes_by_bgp_speaker_id(
+            res['advertised_routes'] = list(
+                self.get_routes_by_bgp_speaker_id(context, bgp_speaker_id))
+            vrfs = self.get_vrfs_by_bgp_speaker_ids(context,
+                                                    [bgp_speaker_id])
+            res['vrfs'] = vrfs[bgp_speaker_id]
+            return res
+
+    def get_bgp_speaker_with_route_delta(self, context, bgp_speaker_id,
+                                         generation):
+        """Get the routes of a BgpSpeaker changed since a generation.
+
+        The result holds the routes added or changed and the destinations
+        withdrawn after the given generation, along with the current peers
+        and generation of the BgpSpeaker. The VRFs are only included when
+        they changed after the given generation. When no delta can be
+        computed from the given generation, the full set of advertised
+        routes and the VRFs are returned instead and 'full_sync' is set in
+        the result.
+        """
+        bgp_speaker_attrs = ['id', 'local_as', 'tenant_id',
+                             'aggregate_routes']
+        bgp_peer_attrs = ['peer_ip', 'remote_as', 'password']
+        with context.session.begin(subtransactions=True):
+            bgp_speaker_db = self._get_bgp_speaker(context, bgp_speaker_id)
+            self._ensure_bgp_speaker_routes(context, bgp_speaker_id)
+            query = context.session.query(BgpSpeaker.generation,
+                                          BgpSpeaker.base_generation,
+                                          BgpSpeaker.vrf_generation)
+            current, base, vrf_generation = query.filter(
+                                    BgpSpeaker.id == bgp_speaker_id).one()
+            if generation is None or not base <= generation <= current:
+                res = self.get_bgp_speaker_with_advertised_routes(
                                                                context,
                                                                bgp_speaker_id)
+                res['full_sync'] = True
+                return res
+
+            res = dict((k, bgp_speaker_db[k]) for k in bgp_speaker_attrs)
+            res['generation'] = current
+            res['full_sync'] = False
+            res['peers'] = self.get_bgp_peers_by_bgp_speaker(context,
+                                                         bgp_speaker_id,
+                                                         fields=bgp_peer_attrs)
+            query = context.session.query(BgpSpeakerRoute.destination,
+                                          BgpSpeakerRoute.next_hop)
+            query = query.filter(
+                            BgpSpeakerRoute.bgp_speaker_id == bgp_speaker_id,
+                            BgpSpeakerRoute.generation > generation)
+            res['advertised_routes'] = list(
+                                self._make_advertised_routes_list(query.all()))
+            query = context.session.query(
+                                        BgpSpeakerWithdrawnRoute.destination)
+            query = query.filter(
+                    BgpSpeakerWithdrawnRoute.bgp_speaker_id == bgp_speaker_id,
+                    BgpSpeakerWithdrawnRoute.generation > generation)
+            res['withdrawn_routes'] = [{'destination': route.destination}
+                                       for route in query.all()]
+            if vrf_generation > generation:
+                vrfs = self.get_vrfs_by_bgp_speaker_ids(context,
+                                                        [bgp_speaker_id])
+                res['vrfs'] = vrfs[bgp_speaker_id]
             return res
 
     def update_bgp_speaker(self, context, bgp_speaker_id, bgp_speaker):
@@ -167,6 +307,8 @@ class BgpDbMixin(common_db.CommonDbMixin):
         with context.session.begin(subtransactions=True):
             bgp_speaker_db = self._get_bgp_speaker(context, bgp_speaker_id)
             bgp_speaker_db.update(bp)
+            if ROUTE_AFFECTING_ATTRS.intersection(bp):
+                self.rebuild_bgp_speaker_routes(context, bgp_speaker_id)
 
         bgp_speaker_dict = self._make_bgp_speaker_dict(bgp_speaker_db)
         return bgp_speaker_dict
@@ -179,6 +321,7 @@ class BgpDbMixin(common_db.CommonDbMixin):
                         'advertise_floating_ip_host_routes',
                         'advertise_tenant_networks']
             res = dict((k, ri[k]) for k in res_keys)
+            res['aggregate_routes'] = ri.get('aggregate_routes', False)
             res['id'] = uuid
             bgp_speaker_db = BgpSpeaker(**res)
             context.session.add(bgp_speaker_db)
@@ -208,6 +351,7 @@ class BgpDbMixin(common_db.CommonDbMixin):
                 raise bgp_ext.BgpSpeakerNetworkBindingError(
                                                 network_id=network_id,
                                                 bgp_speaker_id=bgp_speaker_id)
+            self.rebuild_bgp_speaker_routes(context, bgp_speaker_id)
         return {'network_id': network_id}
 
     def remove_gateway_network(self, context, bgp_speaker_id, network_info):
@@ -216,12 +360,14 @@ class BgpDbMixin(common_db.CommonDbMixin):
             self._remove_bgp_speaker_network_binding(context,
                                                      bgp_speaker_id,
                                                      network_id)
+            self.rebuild_bgp_speaker_routes(context, bgp_speaker_id)
         return {'network_id': network_id}
 
     def delete_bgp_speaker(self, context, bgp_speaker_id):
         with context.session.begin(subtransactions=True):
             bgp_speaker_db = self._get_bgp_speaker(context, bgp_speaker_id)
             context.session.delete(bgp_speaker_db)
+        self._get_bgp_route_cache().invalidate(bgp_speaker_id)
 
     def create_bgp_peer(self, context, bgp_peer):
         ri = bgp_peer[bgp_ext.BGP_PEER_BODY_KEY_NAME]
@@ -243,10 +389,12 @@ class BgpDbMixin(common_db.CommonDbMixin):
 
     def get_bgp_peers(self, context, fields=None, filters=None, sorts=None,
                       limit=None, marker=None, page_reverse=False):
+        marker_obj = self._get_marker_obj(context, 'bgp_peer', limit, marker)
         return self._get_collection(context, BgpPeer,
                                     self._make_bgp_peer_dict,
                                     filters=filters, fields=fields,
                                     sorts=sorts, limit=limit,
+                                    marker_obj=marker_obj,
                                     page_reverse=page_reverse)
 
     def get_bgp_peers_by_bgp_speaker(self, context,
@@ -307,9 +455,55 @@ class BgpDbMixin(common_db.CommonDbMixin):
                             BgpSpeakerNetworkBinding.network_id == network_id)
             return query.all()
 
-    def get_advertised_routes(self, context, bgp_speaker_id):
-        routes = self.get_routes_by_bgp_speaker_id(context, bgp_speaker_id)
-        return self._make_advertised_routes_dict(routes)
+    def _get_bgp_speaker_ids_by_bgp_peer(self, context, bgp_peer_id):
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(
+                                      BgpSpeakerPeerBinding.bgp_speaker_id)
+            query = query.filter(
+                            BgpSpeakerPeerBinding.bgp_peer_id == bgp_peer_id)
+            return [binding.bgp_speaker_id for binding in query.all()]
+
+    def get_advertised_routes(self, context, bgp_speaker_id, page_info=None):
+        """Get the routes advertised by a BgpSpeaker, sorted by destination.
+
+        page_info may hold a limit, a marker and page_reverse, in which case
+        only the page of at most limit routes whose destinations follow the
+        marker, or precede it when page_reverse is set, is read.
+        """
+        limit, marker, page_reverse = self._get_route_page_info(page_info)
+        with context.session.begin(subtransactions=True):
+            if limit:
+                self._ensure_bgp_speaker_routes(context, bgp_speaker_id)
+                routes = self._make_advertised_routes_list(
+                    self._get_bgp_speaker_routes_page(
+                                                context, bgp_speaker_id,
+                                                limit=limit, marker=marker,
+                                                page_reverse=page_reverse))
+            else:
+                routes = self.get_routes_by_bgp_speaker_id(context,
+                                                           bgp_speaker_id)
+            return self._make_advertised_routes_dict(routes)
+
+    def _get_route_page_info(self, page_info):
+        page_info = page_info or {}
+        limit = page_info.get('limit')
+        if limit is not None:
+            msg = validators.validate_non_negative(limit)
+            if msg:
+                raise n_exc.BadRequest(
+                                resource=bgp_ext.BGP_SPEAKER_RESOURCE_NAME,
+                                msg=msg)
+            limit = int(limit)
+            max_limit = int(cfg.CONF.pagination_max_limit)
+            if max_limit > 0:
+                limit = min(limit, max_limit) if limit else max_limit
+        marker = page_info.get('marker')
+        page_reverse = page_info.get('page_reverse', False)
+        msg = validators.validate_boolean(page_reverse)
+        if msg:
+            raise n_exc.BadRequest(resource=bgp_ext.BGP_SPEAKER_RESOURCE_NAME,
+                                   msg=msg)
+        return limit, marker, converters.convert_to_boolean(page_reverse)
 
     def _get_id_for(self, resource, id_name):
         try:
@@ -351,6 +545,7 @@ class BgpDbMixin(common_db.CommonDbMixin):
             binding = BgpSpeakerPeerBinding(bgp_speaker_id=bgp_speaker.id,
                                             bgp_peer_id=bgp_peer.id)
             context.session.add(binding)
+            self._bump_bgp_speaker_generation(context, bgp_speaker_id)
 
     def _validate_peer_ips(self, bgp_speaker_id, current_peers, new_peer):
         for peer in current_peers:
@@ -373,6 +568,7 @@ class BgpDbMixin(common_db.CommonDbMixin):
                                                 bgp_peer_id=bgp_peer_id,
                                                 bgp_speaker_id=bgp_speaker_id)
             context.session.delete(binding)
+            self._bump_bgp_speaker_generation(context, bgp_speaker_id)
 
     def _save_bgp_speaker_network_binding(self,
                                           context,
@@ -415,7 +611,7 @@ class BgpDbMixin(common_db.CommonDbMixin):
     def _make_bgp_speaker_dict(self, bgp_speaker, fields=None):
         attrs = {'id', 'local_as', 'tenant_id', 'name', 'ip_version',
                  'advertise_floating_ip_host_routes',
-                 'advertise_tenant_networks'}
+                 'advertise_tenant_networks', 'aggregate_routes'}
         peer_bindings = bgp_speaker['peers']
         network_bindings = bgp_speaker['networks']
         vrf_bindings = bgp_speaker['vrfs']
@@ -467,19 +663,357 @@ class BgpDbMixin(common_db.CommonDbMixin):
                 models_v2.SubnetPool.address_scope_id == address_scope.id)
             return [scope.id for scope in query.all()]
 
+    def _get_bgp_speaker_routes_page(self, context, bgp_speaker_id,
+                                     limit=None, marker=None,
+                                     page_reverse=False):
+        """Get a page of the stored routes of a BgpSpeaker.
+
+        The routes are sorted by destination, which is part of the primary
+        key of bgp_speaker_routes, so that a page is read from the index
+        whatever the number of routes of the BgpSpeaker.
+        """
+        destination = BgpSpeakerRoute.destination
+        query = context.session.query(BgpSpeakerRoute.destination,
+                                      BgpSpeakerRoute.next_hop)
+        query = query.filter(BgpSpeakerRoute.bgp_speaker_id == bgp_speaker_id)
+        if page_reverse:
+            if marker is not None:
+                query = query.filter(destination < marker)
+            query = query.order_by(destination.desc())
+        else:
+            if marker is not None:
+                query = query.filter(destination > marker)
+            query = query.order_by(destination)
+        if limit:
+            query = query.limit(limit)
+        routes = query.all()
+        if page_reverse:
+            routes.reverse()
+        return routes
+
+    def iter_routes_by_bgp_speaker_id(self, context, bgp_speaker_id,
+                                      batch_size=ROUTE_QUERY_BATCH_SIZE):
+        """Yield the stored routes of a BgpSpeaker, sorted by destination.
+
+        The routes are read batch_size at a time, so that only one batch of
+        the routes of the BgpSpeaker is loaded at once.
+        """
+        marker = None
+        while True:
+            with context.session.begin(subtransactions=True):
+                routes = self._get_bgp_speaker_routes_page(
+                                                    context, bgp_speaker_id,
+                                                    limit=batch_size,
+                                                    marker=marker)
+            for route in self._make_advertised_routes_list(routes):
+                yield route
+            if len(routes) < batch_size:
+                return
+            marker = routes[-1][0]
+
     def get_routes_by_bgp_speaker_id(self, context, bgp_speaker_id):
-        """Get all routes that should be advertised by a BgpSpeaker."""
+        """Get all routes that should be advertised by a BgpSpeaker.
+
+        The routes are served from the route cache as long as the generation
+        of the BgpSpeaker is unchanged. Returns a tuple of the routes, which
+        may be shared with the route cache and must not be modified.
+        """
+        route_cache = self._get_bgp_route_cache()
         with context.session.begin(subtransactions=True):
-            net_routes = self._get_tenant_network_routes_by_bgp_speaker(
-                                                               context,
-                                                               bgp_speaker_id)
-            fip_routes = self._get_central_fip_host_routes_by_bgp_speaker(
-                                                               context,
-                                                               bgp_speaker_id)
-            dvr_fip_routes = self._get_dvr_fip_host_routes_by_bgp_speaker(
-                                                               context,
+            generation = self._ensure_bgp_speaker_routes(context,
+                                                         bgp_speaker_id)
+            routes = route_cache.get(bgp_speaker_id, generation)
+            if routes is None:
+                routes = tuple(self.iter_routes_by_bgp_speaker_id(
+                                                            context,
+                                                            bgp_speaker_id))
+                route_cache.put(bgp_speaker_id, generation, routes)
+            return routes
+
+    def _get_bgp_route_cache(self):
+        if getattr(self, '_bgp_route_cache', None) is None:
+            self._bgp_route_cache = bgp_route_cache.BgpSpeakerRouteCache()
+        return self._bgp_route_cache
+
+    def get_bgp_route_cache_stats(self):
+        """Return the size and hit, miss and eviction counts of the cache."""
+        return self._get_bgp_route_cache().get_stats()
+
+    def rebuild_bgp_speaker_routes(self, context, bgp_speaker_id):
+        """Recompute the stored routes of a BgpSpeaker from the topology.
+
+        The withdrawal history of the BgpSpeaker is discarded, so the next
+        delta requested by a BGP DRAgent is answered with a full snapshot.
+        """
+        return self.rebuild_bgp_speakers_routes(context,
+                                                [bgp_speaker_id])[
+                                                            bgp_speaker_id]
+
+    def rebuild_bgp_speakers_routes(self, context, bgp_speaker_ids):
+        """Recompute the stored routes of several BgpSpeakers at once.
+
+        The routes of all the BgpSpeakers are computed with a fixed number
+        of queries. Returns the stored routes keyed by BgpSpeaker ID.
+        """
+        res = {}
+        with context.session.begin(subtransactions=True):
+            computed = self._compute_routes_by_bgp_speaker_ids(
+                                                            context,
+                                                            bgp_speaker_ids)
+            for bgp_speaker_id, routes in computed.items():
+                routes = self._get_unique_routes_by_destination(routes)
+                generation = self._bump_bgp_speaker_generation(
+                                                        context,
+                                                        bgp_speaker_id,
+                                                        reset_history=True)
+                for model in (BgpSpeakerRoute, BgpSpeakerWithdrawnRoute):
+                    query = context.session.query(model)
+                    query = query.filter(
+                                    model.bgp_speaker_id == bgp_speaker_id)
+                    query.delete(synchronize_session=False)
+                for destination, next_hop in routes.items():
+                    context.session.add(BgpSpeakerRoute(
+                                                bgp_speaker_id=bgp_speaker_id,
+                                                destination=destination,
+                                                next_hop=next_hop,
+                                                generation=generation))
+                res[bgp_speaker_id] = self._route_list_from_route_dict(
+                                                                    routes)
+        return res
+
+    def verify_bgp_speaker_routes(self, context, bgp_speaker_id):
+        """Compare the stored routes of a BgpSpeaker against the topology.
+
+        Returns the routes missing from the bgp_speaker_routes table and the
+        stored routes which should no longer be advertised.
+        """
+        return self.verify_bgp_speakers_routes(context,
+                                               [bgp_speaker_id])[
+                                                            bgp_speaker_id]
+
+    def verify_bgp_speakers_routes(self, context, bgp_speaker_ids):
+        """Compare the stored routes of several BgpSpeakers at once.
+
+        Returns the result of verify_bgp_speaker_routes keyed by BgpSpeaker
+        ID.
+        """
+        res = {}
+        with context.session.begin(subtransactions=True):
+            self._ensure_bgp_speakers_routes(context, bgp_speaker_ids)
+            computed = self._compute_routes_by_bgp_speaker_ids(
+                                                            context,
+                                                            bgp_speaker_ids)
+            for bgp_speaker_id, routes in computed.items():
+                expected = self._get_unique_routes_by_destination(routes)
+                stored = self._get_unique_routes_by_destination(
+                    self.get_routes_by_bgp_speaker_id(context,
+                                                      bgp_speaker_id))
+                missing = dict((dest, next_hop)
+                               for dest, next_hop in expected.items()
+                               if stored.get(dest) != next_hop)
+                stale = dict((dest, next_hop)
+                             for dest, next_hop in stored.items()
+                             if expected.get(dest) != next_hop)
+                res[bgp_speaker_id] = {
+                    'missing_routes': self._route_list_from_route_dict(
+                                                                    missing),
+                    'stale_routes': self._route_list_from_route_dict(stale)}
+        return res
+
+    def _ensure_bgp_speaker_routes(self, context, bgp_speaker_id):
+        """Store the routes of a BgpSpeaker if they were never stored.
+
+        A BgpSpeaker still at generation 0 has never had its routes stored,
+        as is the case of the BgpSpeakers created before the
+        bgp_speaker_routes table. Its routes are then computed from the
+        topology before they are first read or changed. Returns the
+        generation of the BgpSpeaker.
+        """
+        generation = self._get_bgp_speaker_generation(context,
+                                                      bgp_speaker_id)
+        if generation == 0:
+            self.rebuild_bgp_speaker_routes(context, bgp_speaker_id)
+            generation = self._get_bgp_speaker_generation(context,
+                                                          bgp_speaker_id)
+        return generation
+
+    def _ensure_bgp_speakers_routes(self, context, bgp_speaker_ids):
+        """Store the routes of the BgpSpeakers which never had them stored.
+
+        The routes of all such BgpSpeakers are computed at once.
+        """
+        if not bgp_speaker_ids:
+            return
+        query = context.session.query(BgpSpeaker.id)
+        query = query.filter(BgpSpeaker.id.in_(list(bgp_speaker_ids)),
+                             BgpSpeaker.generation == 0)
+        unstored_ids = [bgp_speaker_id for bgp_speaker_id, in query]
+        if unstored_ids:
+            self.rebuild_bgp_speakers_routes(context, unstored_ids)
+
+    def _get_bgp_speaker_generation(self, context, bgp_speaker_id):
+        query = context.session.query(BgpSpeaker.generation)
+        return query.filter(BgpSpeaker.id == bgp_speaker_id).scalar()
+
+    def _bump_bgp_speaker_generation(self, context, bgp_speaker_id,
+                                     reset_history=False):
+        """Increment the generation of a BgpSpeaker and return the new one.
+
+        The increment is done in SQL so that concurrent writers serialize on
+        the row of the BgpSpeaker: a delta handed out at a generation must
+        never miss the changes of a transaction which commits later with a
+        lower generation. The row stays locked until the transaction ends,
+        so callers bump the generation as late as possible in their
+        transaction, and once for all the changes made to a BgpSpeaker in it.
+        """
+        with context.session.begin(subtransactions=True):
+            if not reset_history:
+                self._ensure_bgp_speaker_routes(context, bgp_speaker_id)
+            values = {BgpSpeaker.generation: BgpSpeaker.generation + 1}
+            if reset_history:
+                values[BgpSpeaker.base_generation] = (
+                                                BgpSpeaker.generation + 1)
+            query = context.session.query(BgpSpeaker)
+            query = query.filter(BgpSpeaker.id == bgp_speaker_id)
+            query.update(values, synchronize_session=False)
+            self._get_bgp_route_cache().invalidate(bgp_speaker_id)
+            return self._get_bgp_speaker_generation(context, bgp_speaker_id)
+
+    def _bump_bgp_speaker_vrf_generations(self, context, bgp_speaker_ids):
+        """Record that the VRFs of BgpSpeakers changed.
+
+        The generation of each BgpSpeaker is incremented, so that the next
+        delta of the BgpSpeaker includes its VRFs.
+        """
+        with context.session.begin(subtransactions=True):
+            for bgp_speaker_id in bgp_speaker_ids:
+                generation = self._bump_bgp_speaker_generation(context,
                                                                bgp_speaker_id)
-            return itertools.chain(fip_routes, net_routes, dvr_fip_routes)
+                query = context.session.query(BgpSpeaker)
+                query = query.filter(BgpSpeaker.id == bgp_speaker_id)
+                query.update({BgpSpeaker.vrf_generation: generation},
+                             synchronize_session=False)
+
+    def _get_bgp_speaker_ids_by_vrf_ids(self, context, vrf_ids):
+        """Return the IDs of the BgpSpeakers bound to any of the VRFs."""
+        if not vrf_ids:
+            return []
+        VrfBinding = bgp_vrf_db.BgpSpeakerVrfBinding
+        query = context.session.query(VrfBinding.speaker_id).distinct()
+        query = query.filter(VrfBinding.vrf_id.in_(list(vrf_ids)))
+        return [bgp_speaker_id for bgp_speaker_id, in query]
+
+    def _get_bgp_speaker_ids_by_router_vrfs(self, context, router_id):
+        """Return the IDs of the BgpSpeakers bound to the VRFs of a router.
+
+        The router associations are read from the database rather than from
+        the router index of this worker, so that associations made through
+        another neutron server worker are never missed.
+        """
+        VrfBinding = bgp_vrf_db.BgpSpeakerVrfBinding
+        RouterAssoc = bgp_vrf_db.BGPVRFRouterAssociation
+        query = context.session.query(VrfBinding.speaker_id).distinct()
+        query = query.join(RouterAssoc,
+                           RouterAssoc.vrf_id == VrfBinding.vrf_id)
+        query = query.filter(RouterAssoc.router_id == router_id)
+        return [bgp_speaker_id for bgp_speaker_id, in query]
+
+    def _prune_withdrawn_routes(self, context, bgp_speaker_id, generation):
+        """Forget withdrawals older than the configured history."""
+        base_generation = (generation -
+                           cfg.CONF.bgp_route_withdrawal_history)
+        if base_generation <= 0:
+            return
+        query = context.session.query(BgpSpeakerWithdrawnRoute)
+        query = query.filter(
+                    BgpSpeakerWithdrawnRoute.bgp_speaker_id == bgp_speaker_id,
+                    BgpSpeakerWithdrawnRoute.generation < base_generation)
+        if query.delete(synchronize_session=False):
+            query = context.session.query(BgpSpeaker)
+            query = query.filter(BgpSpeaker.id == bgp_speaker_id,
+                                 BgpSpeaker.base_generation < base_generation)
+            query.update({BgpSpeaker.base_generation: base_generation},
+                         synchronize_session=False)
+
+    def _save_bgp_speaker_routes(self, context, bgp_speaker_id, routes,
+                                 generation=None):
+        """Record routes advertised by a BgpSpeaker, replacing next hops.
+
+        The routes are recorded at the given generation, which the caller
+        bumped in the current transaction, or else at a new generation.
+        Returns the set of the destinations which were not recorded yet.
+        """
+        routes = self._get_unique_routes_by_destination(routes)
+        if not routes:
+            return set()
+        destinations = list(routes.keys())
+        with context.session.begin(subtransactions=True):
+            self._ensure_bgp_speaker_routes(context, bgp_speaker_id)
+            query = context.session.query(BgpSpeakerWithdrawnRoute)
+            query = query.filter(
+                    BgpSpeakerWithdrawnRoute.bgp_speaker_id == bgp_speaker_id,
+                    BgpSpeakerWithdrawnRoute.destination.in_(destinations))
+            query.delete(synchronize_session=False)
+            query = context.session.query(BgpSpeakerRoute)
+            query = query.filter(
+                        BgpSpeakerRoute.bgp_speaker_id == bgp_speaker_id,
+                        BgpSpeakerRoute.destination.in_(destinations))
+            existing = dict((route_db.destination, route_db)
+                            for route_db in query.all())
+            if generation is None:
+                generation = self._bump_bgp_speaker_generation(
+                                                            context,
+                                                            bgp_speaker_id)
+            for destination, next_hop in routes.items():
+                route_db = existing.get(destination)
+                if route_db:
+                    route_db.next_hop = next_hop
+                    route_db.generation = generation
+                else:
+                    context.session.add(BgpSpeakerRoute(
+                                                bgp_speaker_id=bgp_speaker_id,
+                                                destination=destination,
+                                                next_hop=next_hop,
+                                                generation=generation))
+        return set(routes) - set(existing)
+
+    def _remove_bgp_speaker_routes(self, context, bgp_speaker_id, routes,
+                                   generation=None):
+        """Forget routes withdrawn by a BgpSpeaker.
+
+        Routes may be given either as route dicts or as bare destinations.
+        The withdrawals are remembered so that they can be handed out as
+        part of a delta, at the given generation or else at a new one.
+        """
+        destinations = set(route['destination'] if isinstance(route, dict)
+                           else route for route in routes)
+        if not destinations:
+            return
+        with context.session.begin(subtransactions=True):
+            self._ensure_bgp_speaker_routes(context, bgp_speaker_id)
+            for model in (BgpSpeakerRoute, BgpSpeakerWithdrawnRoute):
+                query = context.session.query(model)
+                query = query.filter(model.bgp_speaker_id == bgp_speaker_id,
+                                     model.destination.in_(destinations))
+                query.delete(synchronize_session=False)
+            if generation is None:
+                generation = self._bump_bgp_speaker_generation(
+                                                            context,
+                                                            bgp_speaker_id)
+            for destination in destinations:
+                context.session.add(BgpSpeakerWithdrawnRoute(
+                                                bgp_speaker_id=bgp_speaker_id,
+                                                destination=destination,
+                                                generation=generation))
+            self._prune_withdrawn_routes(context, bgp_speaker_id, generation)
+
+    def _get_unique_routes_by_destination(self, routes):
+        return dict((route['destination'], route['next_hop'])
+                    for route in routes)
+
+    def _route_list_from_route_dict(self, routes):
+        return [{'destination': destination, 'next_hop': next_hop}
+                for destination, next_hop in sorted(routes.items())]
 
     def get_routes_by_bgp_speaker_binding(self, context,
                                           bgp_speaker_id, network_id):
@@ -502,74 +1036,115 @@ class BgpDbMixin(common_db.CommonDbMixin):
     def _get_routes_by_router(self, context, router_id):
         bgp_speaker_ids = self._get_bgp_speaker_ids_by_router(context,
                                                               router_id)
-        route_dict = {}
-        for bgp_speaker_id in bgp_speaker_ids:
-            fip_routes = self._get_central_fip_host_routes_by_router(
+        return self._compute_routes_by_bgp_speaker_ids(context,
+                                                       bgp_speaker_ids,
+                                                       router_id=router_id)
+
+    def _compute_routes_by_bgp_speaker_ids(self, context, bgp_speaker_ids,
+                                           router_id=None):
+        """Compute the routes of several BgpSpeakers at once.
+
+        The routes are computed with a fixed number of queries, whatever the
+        number of BgpSpeakers. When a router is given, only the routes with
+        this router as nexthop are computed. Returns the routes keyed by
+        BgpSpeaker ID.
+        """
+        route_dict = dict((bgp_speaker_id, [])
+                          for bgp_speaker_id in bgp_speaker_ids)
+        if not route_dict:
+            return route_dict
+        bgp_speaker_ids = list(route_dict)
+        with context.session.begin(subtransactions=True):
+            fip_routes = self._get_central_fip_host_routes_by_bgp_speakers(
                                                                context,
-                                                               router_id,
-                                                               bgp_speaker_id)
-            net_routes = self._get_tenant_network_routes_by_router(
+                                                               bgp_speaker_ids,
+                                                               router_id)
+            net_routes = self._get_tenant_network_routes_by_bgp_speakers(
                                                                context,
-                                                               router_id,
-                                                               bgp_speaker_id)
-            dvr_fip_routes = self._get_dvr_fip_host_routes_by_router(
+                                                               bgp_speaker_ids,
+                                                               router_id)
+            dvr_fip_routes = self._get_dvr_fip_host_routes_by_bgp_speakers(
                                                                context,
-                                                               router_id,
-                                                               bgp_speaker_id)
-            routes = itertools.chain(fip_routes, net_routes, dvr_fip_routes)
-            route_dict[bgp_speaker_id] = list(routes)
+                                                               bgp_speaker_ids,
+                                                               router_id)
+            for bgp_speaker_id, route in itertools.chain(fip_routes,
+                                                         net_routes,
+                                                         dvr_fip_routes):
+                route_dict[bgp_speaker_id].append(route)
         return route_dict
 
-    def _get_central_fip_host_routes_by_router(self, context, router_id,
-                                               bgp_speaker_id):
-        """Get floating IP host routes with the given router as nexthop."""
+    def get_vrfs_by_bgp_speaker_ids(self, context, bgp_speaker_ids):
+        """Compute the EVPN VRFs of several BgpSpeakers with their routes.
+
+        Each VRF bound to a BgpSpeaker is returned with its route
+        distinguisher, route targets and VNI (its segmentation ID), and the
+        EVPN IP prefix (type-5) routes of the subnets behind the routers
+        associated with it. These are computed with two queries, whatever
+        the number of BgpSpeakers, VRFs and routers. A VRF without route
+        distinguisher uses <local_as>:<segmentation_id>, and is left out if
+        it has no segmentation ID either. Returns the VRFs keyed by
+        BgpSpeaker ID.
+        """
+        vrf_dict = dict((bgp_speaker_id, [])
+                        for bgp_speaker_id in bgp_speaker_ids)
+        if not vrf_dict:
+            return vrf_dict
+        bgp_speaker_ids = list(vrf_dict)
+        VrfBinding = bgp_vrf_db.BgpSpeakerVrfBinding
+        RouterAssoc = bgp_vrf_db.BGPVRFRouterAssociation
         with context.session.begin(subtransactions=True):
-            dest_alias = aliased(l3_db.FloatingIP,
-                                 name='destination')
-            next_hop_alias = aliased(models_v2.IPAllocation,
-                                     name='next_hop')
-            binding_alias = aliased(BgpSpeakerNetworkBinding,
-                                    name='binding')
-            router_attrs = aliased(l3_attrs_db.RouterExtraAttributes,
-                                   name='router_attrs')
-            query = context.session.query(dest_alias.floating_ip_address,
-                                          next_hop_alias.ip_address)
-            query = query.join(
-                  next_hop_alias,
-                  next_hop_alias.network_id == dest_alias.floating_network_id)
-            query = query.join(l3_db.Router,
-                               dest_alias.router_id == l3_db.Router.id)
-            query = query.filter(
-                l3_db.Router.id == router_id,
-                dest_alias.router_id == l3_db.Router.id,
-                l3_db.Router.id == router_attrs.router_id,
-                router_attrs.distributed == sa.sql.false(),
-                l3_db.Router.gw_port_id == next_hop_alias.port_id,
-                next_hop_alias.subnet_id == models_v2.Subnet.id,
-                models_v2.Subnet.ip_version == 4,
-                binding_alias.network_id == models_v2.Subnet.network_id,
-                binding_alias.bgp_speaker_id == bgp_speaker_id,
-                binding_alias.ip_version == 4,
-                BgpSpeaker.advertise_floating_ip_host_routes == sa.sql.true())
-            query = query.outerjoin(router_attrs,
-                                    l3_db.Router.id == router_attrs.router_id)
-            query = query.filter(router_attrs.distributed != sa.sql.true())
-            return self._host_route_list_from_tuples(query.all())
-
-    def _get_dvr_fip_host_routes_by_router(self, context, bgp_speaker_id,
-                                           router_id):
-        with context.session.begin(subtransactions=True):
-            gw_query = self._get_gateway_query(context, bgp_speaker_id)
-
-            fip_query = self._get_fip_query(context, bgp_speaker_id)
-            fip_query.filter(l3_db.FloatingIP.router_id == router_id)
-
-            #Create the join query
-            join_query = self._join_fip_by_host_binding_to_agent_gateway(
-                context,
-                fip_query.subquery(),
-                gw_query.subquery())
-            return self._host_route_list_from_tuples(join_query.all())
+            vrfs_q = context.session.query(VrfBinding.speaker_id,
+                                           BgpSpeaker.local_as,
+                                           bgp_vrf_db.BGPVRF)
+            vrfs_q = vrfs_q.filter(
+                VrfBinding.speaker_id.in_(bgp_speaker_ids),
+                VrfBinding.speaker_id == BgpSpeaker.id,
+                VrfBinding.vrf_id == bgp_vrf_db.BGPVRF.id)
+            bindings = vrfs_q.all()
+
+            vrf_ids_q = context.session.query(VrfBinding.vrf_id).filter(
+                VrfBinding.speaker_id.in_(bgp_speaker_ids))
+            routes_q = context.session.query(
+                                            RouterAssoc.vrf_id,
+                                            models_v2.Subnet.cidr,
+                                            models_v2.IPAllocation.ip_address)
+            routes_q = routes_q.distinct().filter(
+                RouterAssoc.vrf_id.in_(vrf_ids_q.subquery()),
+                l3_db.RouterPort.router_id == RouterAssoc.router_id,
+                l3_db.RouterPort.port_type.in_(EVPN_ROUTER_PORT_TYPES),
+                models_v2.IPAllocation.port_id == l3_db.RouterPort.port_id,
+                models_v2.IPAllocation.subnet_id == models_v2.Subnet.id)
+            routes_by_vrf = collections.defaultdict(list)
+            for vrf_id, cidr, gateway_ip in routes_q:
+                routes_by_vrf[vrf_id].append({'destination': cidr,
+                                              'gateway_ip': gateway_ip})
+
+            for bgp_speaker_id, local_as, vrf_db in bindings:
+                vrf = self._make_evpn_vrf_dict(vrf_db, local_as,
+                                               routes_by_vrf[vrf_db.id])
+                if vrf:
+                    vrf_dict[bgp_speaker_id].append(vrf)
+        return vrf_dict
+
+    def _make_evpn_vrf_dict(self, vrf_db, local_as, routes):
+        route_distinguishers = utils.rtrd_str2list(
+                                                vrf_db.route_distinguishers)
+        vni = vrf_db.segmentation_id
+        if route_distinguishers:
+            route_distinguisher = route_distinguishers[0]
+        elif vni is not None:
+            route_distinguisher = '%s:%s' % (local_as, vni)
+        else:
+            return
+        return {'id': vrf_db.id,
+                'route_distinguisher': route_distinguisher,
+                'import_targets': bgp_vrf_db.get_vrf_route_targets(
+                                            vrf_db, bgp_vrf_db.RT_TYPE_IMPORT),
+                'export_targets': bgp_vrf_db.get_vrf_route_targets(
+                                            vrf_db, bgp_vrf_db.RT_TYPE_EXPORT),
+                'vni': vni,
+                'routes': sorted(routes,
+                                 key=lambda route: route['destination'])}
 
     def _get_central_fip_host_routes_by_binding(self, context,
                                                 network_id, bgp_speaker_id):
@@ -628,9 +1203,10 @@ class BgpDbMixin(common_db.CommonDbMixin):
                 gw_query.subquery())
             return self._host_route_list_from_tuples(join_query.all())
 
-    def _get_central_fip_host_routes_by_bgp_speaker(self, context,
-                                                    bgp_speaker_id):
-        """Get all the floating IP host routes advertised by a BgpSpeaker."""
+    def _get_central_fip_host_routes_by_bgp_speakers(self, context,
+                                                     bgp_speaker_ids,
+                                                     router_id=None):
+        """Get the floating IP host routes of several BgpSpeakers."""
         with context.session.begin(subtransactions=True):
             dest_alias = aliased(l3_db.FloatingIP,
                                  name='destination')
@@ -640,7 +1216,8 @@ class BgpDbMixin(common_db.CommonDbMixin):
                                       name="speaker_network_mapping")
             router_attrs = aliased(l3_attrs_db.RouterExtraAttributes,
                                    name='router_attrs')
-            query = context.session.query(dest_alias.floating_ip_address,
+            query = context.session.query(speaker_binding.bgp_speaker_id,
+                                          dest_alias.floating_ip_address,
                                           next_hop_alias.ip_address)
             query = query.select_from(dest_alias,
                                       BgpSpeaker,
@@ -655,7 +1232,7 @@ class BgpDbMixin(common_db.CommonDbMixin):
             query = query.join(l3_db.Router,
                                dest_alias.router_id == l3_db.Router.id)
             query = query.filter(
-                 BgpSpeaker.id == bgp_speaker_id,
+                 BgpSpeaker.id.in_(bgp_speaker_ids),
                  BgpSpeaker.advertise_floating_ip_host_routes,
                  speaker_binding.bgp_speaker_id == BgpSpeaker.id,
                  dest_alias.floating_network_id == speaker_binding.network_id,
@@ -664,10 +1241,68 @@ class BgpDbMixin(common_db.CommonDbMixin):
                  l3_db.Router.gw_port_id == next_hop_alias.port_id,
                  next_hop_alias.subnet_id == models_v2.Subnet.id,
                  models_v2.Subnet.ip_version == 4)
+            if router_id:
+                query = query.filter(l3_db.Router.id == router_id)
             query = query.outerjoin(router_attrs,
                                     l3_db.Router.id == router_attrs.router_id)
             query = query.filter(router_attrs.distributed != sa.sql.true())
-            return self._host_route_list_from_tuples(query.all())
+            return self._tagged_host_route_list_from_tuples(query.all())
+
+    def _get_dvr_fip_host_routes_by_bgp_speakers(self, context,
+                                                 bgp_speaker_ids,
+                                                 router_id=None):
+        """Get the DVR floating IP host routes of several BgpSpeakers."""
+        BgpBinding = BgpSpeakerNetworkBinding
+        ML2PortBinding = ml2_models.PortBinding
+        IpAllocation = models_v2.IPAllocation
+        Port = models_v2.Port
+        router_attrs = l3_attrs_db.RouterExtraAttributes
+        with context.session.begin(subtransactions=True):
+            #Subquery for FIP agent gateway ports
+            gw_query = context.session.query(BgpBinding.bgp_speaker_id,
+                                             Port.network_id,
+                                             ML2PortBinding.host,
+                                             IpAllocation.ip_address)
+            gw_query = gw_query.filter(
+                ML2PortBinding.port_id == Port.id,
+                IpAllocation.port_id == Port.id,
+                IpAllocation.subnet_id == models_v2.Subnet.id,
+                models_v2.Subnet.ip_version == 4,
+                Port.device_owner == lib_consts.DEVICE_OWNER_AGENT_GW,
+                Port.network_id == BgpBinding.network_id,
+                BgpBinding.bgp_speaker_id.in_(bgp_speaker_ids),
+                BgpBinding.ip_version == 4)
+
+            #Subquery for floating IP's
+            fip_query = context.session.query(
+                BgpBinding.bgp_speaker_id,
+                l3_db.FloatingIP.floating_network_id,
+                ML2PortBinding.host,
+                l3_db.FloatingIP.floating_ip_address)
+            fip_query = fip_query.filter(
+                l3_db.FloatingIP.fixed_port_id == ML2PortBinding.port_id,
+                l3_db.FloatingIP.floating_network_id == BgpBinding.network_id,
+                BgpBinding.bgp_speaker_id.in_(bgp_speaker_ids),
+                BgpBinding.bgp_speaker_id == BgpSpeaker.id,
+                BgpSpeaker.advertise_floating_ip_host_routes == sa.sql.true(),
+                l3_db.FloatingIP.router_id == router_attrs.router_id,
+                router_attrs.distributed == sa.sql.true())
+            if router_id:
+                fip_query = fip_query.filter(
+                                l3_db.FloatingIP.router_id == router_id)
+
+            #Create the join query
+            gw_subq = gw_query.subquery()
+            fip_subq = fip_query.subquery()
+            join_query = context.session.query(fip_subq.c.bgp_speaker_id,
+                                               fip_subq.c.floating_ip_address,
+                                               gw_subq.c.ip_address)
+            and_cond = and_(
+                gw_subq.c.bgp_speaker_id == fip_subq.c.bgp_speaker_id,
+                gw_subq.c.host == fip_subq.c.host,
+                gw_subq.c.network_id == fip_subq.c.floating_network_id)
+            join_query = join_query.join(gw_subq, and_cond)
+            return self._tagged_host_route_list_from_tuples(join_query.all())
 
     def _get_gateway_query(self, context, bgp_speaker_id):
         BgpBinding = BgpSpeakerNetworkBinding
@@ -702,27 +1337,11 @@ class BgpDbMixin(common_db.CommonDbMixin):
         fip_query = fip_query.filter(
             l3_db.FloatingIP.fixed_port_id == ML2PortBinding.port_id,
             l3_db.FloatingIP.floating_network_id == BgpBinding.network_id,
-            BgpBinding.bgp_speaker_id == bgp_speaker_id)
+            BgpBinding.bgp_speaker_id == bgp_speaker_id,
+            BgpBinding.bgp_speaker_id == BgpSpeaker.id,
+            BgpSpeaker.advertise_floating_ip_host_routes == sa.sql.true())
         return fip_query
 
-    def _get_dvr_fip_host_routes_by_bgp_speaker(self, context,
-                                                bgp_speaker_id):
-        router_attrs = l3_attrs_db.RouterExtraAttributes
-        with context.session.begin(subtransactions=True):
-            gw_query = self._get_gateway_query(context, bgp_speaker_id)
-            fip_query = self._get_fip_query(context, bgp_speaker_id)
-
-            fip_query = fip_query.filter(
-                l3_db.FloatingIP.router_id == router_attrs.router_id,
-                router_attrs.distributed == sa.sql.true())
-
-            #Create the join query
-            join_query = self._join_fip_by_host_binding_to_agent_gateway(
-                context,
-                fip_query.subquery(),
-                gw_query.subquery())
-            return self._host_route_list_from_tuples(join_query.all())
-
     def _join_fip_by_host_binding_to_agent_gateway(self, context,
                                                    fip_subq, gw_subq):
         join_query = context.session.query(fip_subq.c.floating_ip_address,
@@ -752,70 +1371,83 @@ class BgpDbMixin(common_db.CommonDbMixin):
                                              nexthops_query.subquery())
             return self._make_advertised_routes_list(join_q.all())
 
-    def _get_tenant_network_routes_by_router(self, context, router_id,
-                                             bgp_speaker_id):
-        """Get all tenant network routes with the given router as nexthop."""
-
+    def _get_tenant_network_routes_by_bgp_speakers(self, context,
+                                                   bgp_speaker_ids,
+                                                   router_id=None):
+        """Get the tenant network routes of several BgpSpeakers."""
+        BgpBinding = BgpSpeakerNetworkBinding
         with context.session.begin(subtransactions=True):
-            scopes = self._get_address_scope_ids_for_bgp_speaker(
-                                                               context,
-                                                               bgp_speaker_id)
-            address_scope = aliased(address_scope_db.AddressScope)
-            inside_query = context.session.query(
-                                            models_v2.Subnet.cidr,
+            scopes_subq = self._address_scopes_by_bgp_speakers_query(
+                                                    context,
+                                                    bgp_speaker_ids).subquery()
+            router_attrs = aliased(l3_attrs_db.RouterExtraAttributes,
+                                   name='router_attrs')
+            tenant_nets_q = context.session.query(BgpBinding.bgp_speaker_id,
+                                                  l3_db.RouterPort.router_id,
+                                                  models_v2.Subnet.cidr,
+                                                  models_v2.Subnet.ip_version)
+            tenant_nets_q = tenant_nets_q.distinct()
+            scope_id = scopes_subq.c.address_scope_id
+            tenant_nets_q = tenant_nets_q.filter(
+                models_v2.IPAllocation.port_id == l3_db.RouterPort.port_id,
+                l3_db.RouterPort.router_id == router_attrs.router_id,
+                l3_db.RouterPort.port_type != DEVICE_OWNER_ROUTER_GW,
+                l3_db.RouterPort.port_type != DEVICE_OWNER_ROUTER_SNAT,
+                models_v2.IPAllocation.subnet_id == models_v2.Subnet.id,
+                models_v2.Subnet.network_id != BgpBinding.network_id,
+                models_v2.Subnet.subnetpool_id == models_v2.SubnetPool.id,
+                models_v2.SubnetPool.address_scope_id == scope_id,
+                scopes_subq.c.bgp_speaker_id == BgpBinding.bgp_speaker_id,
+                models_v2.Subnet.ip_version == BgpBinding.ip_version,
+                BgpBinding.bgp_speaker_id == BgpSpeaker.id,
+                BgpSpeaker.id.in_(bgp_speaker_ids),
+                BgpSpeaker.advertise_tenant_networks == sa.sql.true())
+
+            nexthop_router_attrs = aliased(l3_attrs_db.RouterExtraAttributes,
+                                           name='nexthop_router_attrs')
+            nexthops_q = context.session.query(
+                                            BgpBinding.bgp_speaker_id,
+                                            l3_db.RouterPort.router_id,
                                             models_v2.IPAllocation.ip_address,
-                                            address_scope.id)
-            outside_query = context.session.query(
-                                            address_scope.id,
-                                            models_v2.IPAllocation.ip_address)
-            speaker_binding = aliased(BgpSpeakerNetworkBinding,
-                                      name="speaker_network_mapping")
-            port_alias = aliased(l3_db.RouterPort, name='routerport')
-            inside_query = inside_query.filter(
-                    port_alias.router_id == router_id,
-                    models_v2.IPAllocation.port_id == port_alias.port_id,
-                    models_v2.IPAllocation.subnet_id == models_v2.Subnet.id,
-                    models_v2.Subnet.subnetpool_id == models_v2.SubnetPool.id,
-                    models_v2.SubnetPool.address_scope_id == address_scope.id,
-                    address_scope.id.in_(scopes),
-                    port_alias.port_type != lib_consts.DEVICE_OWNER_ROUTER_GW,
-                    speaker_binding.bgp_speaker_id == bgp_speaker_id)
-            outside_query = outside_query.filter(
-                    port_alias.router_id == router_id,
-                    port_alias.port_type == lib_consts.DEVICE_OWNER_ROUTER_GW,
-                    models_v2.IPAllocation.port_id == port_alias.port_id,
-                    models_v2.IPAllocation.subnet_id == models_v2.Subnet.id,
-                    models_v2.Subnet.subnetpool_id == models_v2.SubnetPool.id,
-                    models_v2.SubnetPool.address_scope_id == address_scope.id,
-                    address_scope.id.in_(scopes),
-                    speaker_binding.bgp_speaker_id == bgp_speaker_id,
-                    speaker_binding.network_id == models_v2.Port.network_id,
-                    port_alias.port_id == models_v2.Port.id)
-            inside_query = inside_query.subquery()
-            outside_query = outside_query.subquery()
-            join_query = context.session.query(inside_query.c.cidr,
-                                               outside_query.c.ip_address)
-            and_cond = and_(inside_query.c.id == outside_query.c.id)
-            join_query = join_query.join(outside_query, and_cond)
-            return self._make_advertised_routes_list(join_query.all())
-
-    def _get_tenant_network_routes_by_bgp_speaker(self, context,
-                                                  bgp_speaker_id):
-        """Get all tenant network routes to be advertised by a BgpSpeaker."""
-
-        with context.session.begin(subtransactions=True):
-            tenant_nets_q = self._tenant_networks_by_bgp_speaker_query(
-                                                               context,
-                                                               bgp_speaker_id)
-            nexthops_q = self._nexthop_ip_addresses_by_bgp_speaker_query(
-                                                               context,
-                                                               bgp_speaker_id)
-            join_q = self._join_tenant_networks_to_next_hops(
-                                                     context,
-                                                     tenant_nets_q.subquery(),
-                                                     nexthops_q.subquery())
-
-            return self._make_advertised_routes_list(join_q.all())
+                                            models_v2.Subnet.ip_version)
+            nexthops_q = nexthops_q.filter(
+                l3_db.RouterPort.port_type == DEVICE_OWNER_ROUTER_GW,
+                l3_db.RouterPort.router_id == nexthop_router_attrs.router_id,
+                BgpBinding.network_id == models_v2.Subnet.network_id,
+                BgpBinding.ip_version == models_v2.Subnet.ip_version,
+                BgpBinding.bgp_speaker_id.in_(bgp_speaker_ids),
+                models_v2.IPAllocation.port_id == l3_db.RouterPort.port_id,
+                models_v2.IPAllocation.subnet_id == models_v2.Subnet.id)
+            if router_id:
+                tenant_nets_q = tenant_nets_q.filter(
+                                l3_db.RouterPort.router_id == router_id)
+                nexthops_q = nexthops_q.filter(
+                                l3_db.RouterPort.router_id == router_id)
+
+            left_subq = tenant_nets_q.subquery()
+            right_subq = nexthops_q.subquery()
+            join_query = context.session.query(left_subq.c.bgp_speaker_id,
+                                               left_subq.c.cidr,
+                                               right_subq.c.ip_address)
+            and_cond = and_(
+                left_subq.c.bgp_speaker_id == right_subq.c.bgp_speaker_id,
+                left_subq.c.router_id == right_subq.c.router_id,
+                left_subq.c.ip_version == right_subq.c.ip_version)
+            join_query = join_query.join(right_subq, and_cond)
+            return self._tagged_advertised_routes_list(join_query.all())
+
+    def _address_scopes_by_bgp_speakers_query(self, context,
+                                              bgp_speaker_ids):
+        """Return the query for the address scopes of BgpSpeakers"""
+        binding = aliased(BgpSpeakerNetworkBinding)
+        query = context.session.query(binding.bgp_speaker_id,
+                                      models_v2.SubnetPool.address_scope_id)
+        return query.distinct().filter(
+            binding.bgp_speaker_id.in_(bgp_speaker_ids),
+            models_v2.Subnet.ip_version == binding.ip_version,
+            models_v2.Subnet.network_id == binding.network_id,
+            models_v2.Subnet.subnetpool_id == models_v2.SubnetPool.id,
+            models_v2.SubnetPool.address_scope_id.isnot(None))
 
     def _join_tenant_networks_to_next_hops(self, context,
                                            tenant_networks_subquery,
@@ -856,34 +1488,6 @@ class BgpDbMixin(common_db.CommonDbMixin):
              models_v2.Subnet.ip_version == address_scope.ip_version)
         return tenant_networks_query
 
-    def _tenant_networks_by_bgp_speaker_query(self, context, bgp_speaker_id):
-        """Return subquery for tenant networks by binding bgp_speaker_id"""
-        router_id = l3_db.RouterPort.router_id.distinct().label('router_id')
-        tenant_nets_subq = context.session.query(router_id,
-                                                 models_v2.Subnet.cidr,
-                                                 models_v2.Subnet.ip_version)
-        scopes = self._get_address_scope_ids_for_bgp_speaker(context,
-                                                             bgp_speaker_id)
-        filters = self._tenant_networks_by_bgp_speaker_filters(scopes)
-        tenant_nets_subq = tenant_nets_subq.filter(*filters)
-        return tenant_nets_subq
-
-    def _tenant_networks_by_bgp_speaker_filters(self, address_scope_ids):
-        """Return the filters for querying tenant networks by BGP speaker"""
-        router_attrs = aliased(l3_attrs_db.RouterExtraAttributes,
-                               name='router_attrs')
-        return [models_v2.IPAllocation.port_id == l3_db.RouterPort.port_id,
-          l3_db.RouterPort.router_id == router_attrs.router_id,
-          l3_db.RouterPort.port_type != lib_consts.DEVICE_OWNER_ROUTER_GW,
-          l3_db.RouterPort.port_type != lib_consts.DEVICE_OWNER_ROUTER_SNAT,
-          models_v2.IPAllocation.subnet_id == models_v2.Subnet.id,
-          models_v2.Subnet.network_id != BgpSpeakerNetworkBinding.network_id,
-          models_v2.Subnet.subnetpool_id == models_v2.SubnetPool.id,
-          models_v2.SubnetPool.address_scope_id.in_(address_scope_ids),
-          models_v2.Subnet.ip_version == BgpSpeakerNetworkBinding.ip_version,
-          BgpSpeakerNetworkBinding.bgp_speaker_id == BgpSpeaker.id,
-          BgpSpeaker.advertise_tenant_networks == sa.sql.true()]
-
     def _nexthop_ip_addresses_by_binding_query(self, context,
                                                network_id, bgp_speaker_id):
         """Return the subquery for locating nexthops by binding network"""
@@ -914,31 +1518,6 @@ class BgpDbMixin(common_db.CommonDbMixin):
             models_v2.Subnet.ip_version == address_scope.ip_version,
             l3_db.RouterPort.port_type == DEVICE_OWNER_ROUTER_GW]
 
-    def _nexthop_ip_addresses_by_bgp_speaker_query(self, context,
-                                                   bgp_speaker_id):
-        """Return the subquery for locating nexthops by BGP speaker"""
-        nexthops_query = context.session.query(
-                                            l3_db.RouterPort.router_id,
-                                            models_v2.IPAllocation.ip_address,
-                                            models_v2.Subnet.ip_version)
-        filters = self._next_hop_ip_addresses_by_bgp_speaker_filters(
-                                                               bgp_speaker_id)
-        nexthops_query = nexthops_query.filter(*filters)
-        return nexthops_query
-
-    def _next_hop_ip_addresses_by_bgp_speaker_filters(self, bgp_speaker_id):
-        """Return the filters for querying nexthops by BGP speaker"""
-        router_attrs = aliased(l3_attrs_db.RouterExtraAttributes,
-                               name='router_attrs')
-
-        return [l3_db.RouterPort.port_type == DEVICE_OWNER_ROUTER_GW,
-           l3_db.RouterPort.router_id == router_attrs.router_id,
-           BgpSpeakerNetworkBinding.network_id == models_v2.Subnet.network_id,
-           BgpSpeakerNetworkBinding.ip_version == models_v2.Subnet.ip_version,
-           BgpSpeakerNetworkBinding.bgp_speaker_id == bgp_speaker_id,
-           models_v2.IPAllocation.port_id == l3_db.RouterPort.port_id,
-           models_v2.IPAllocation.subnet_id == models_v2.Subnet.id]
-
     def _tenant_prefixes_by_router(self, context, router_id, bgp_speaker_id):
         with context.session.begin(subtransactions=True):
             query = context.session.query(models_v2.Subnet.cidr.distinct())
@@ -1019,6 +1598,16 @@ class BgpDbMixin(common_db.CommonDbMixin):
                        'next_hop': next_hop} for x in routes]
         return route_list
 
+    def _tagged_advertised_routes_list(self, routes):
+        """Return (BgpSpeaker ID, route) pairs from tagged route tuples"""
+        return ((bgp_speaker_id, {'destination': x, 'next_hop': y})
+                for bgp_speaker_id, x, y in routes)
+
+    def _tagged_host_route_list_from_tuples(self, ip_next_hop_tuples):
+        """Return (BgpSpeaker ID, host route) pairs from tagged tuples"""
+        return ((bgp_speaker_id, {'destination': x + '/32', 'next_hop': y})
+                for bgp_speaker_id, x, y in ip_next_hop_tuples)
+
     def _host_route_list_from_tuples(self, ip_next_hop_tuples):
         """Return the list of host routes given a list of (IP, nexthop)"""
         return ({'destination': x + '/32',
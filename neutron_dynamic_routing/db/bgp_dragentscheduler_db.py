@@ -13,19 +13,25 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import datetime
+
 from neutron_lib.db import model_base
 from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
 import sqlalchemy as sa
 from sqlalchemy import orm
 from sqlalchemy.orm import exc
 
+from neutron import context as n_context
 from neutron.db import agents_db
 from neutron.db import agentschedulers_db as as_db
 
 from neutron_dynamic_routing._i18n import _
-from neutron_dynamic_routing._i18n import _LW
+from neutron_dynamic_routing._i18n import _LE, _LI, _LW
 from neutron_dynamic_routing.extensions import bgp_dragentscheduler as bgp_dras_ext  # noqa
 from neutron_dynamic_routing.services.bgp.common import constants as bgp_consts
 
@@ -38,11 +44,45 @@ BGP_DRAGENT_SCHEDULER_OPTS = [
         'bgp_drscheduler_driver',
         default='neutron_dynamic_routing.services.bgp.scheduler'
                 '.bgp_dragent_scheduler.ChanceScheduler',
-        help=_('Driver used for scheduling BGP speakers to BGP DrAgent'))
+        help=_('Driver used for scheduling BGP speakers to BGP DrAgent')),
+    cfg.IntOpt(
+        'dragents_per_bgp_speaker', default=1, min=1,
+        help=_('Number of BGP DrAgents each BGP speaker is scheduled to. '
+               'The BGP DrAgents run on distinct hosts and all of them '
+               'advertise the routes of the BGP speaker to its peers.')),
+    cfg.BoolOpt(
+        'allow_automatic_bgp_speaker_failover', default=True,
+        help=_('Automatically reschedule BGP speakers from BGP DrAgents '
+               'which are down to BGP DrAgents which are up.')),
+    cfg.IntOpt(
+        'bgp_dragent_hosts_cache_ttl', default=30, min=0,
+        help=_('Seconds for which each neutron server worker caches the '
+               'host of each BGP DrAgent, to which route changes are sent. '
+               'The bindings of the BGP speakers to the BGP DrAgents are '
+               'read from the database for every notification, so binding '
+               'changes made through any worker are seen at once. A worker '
+               'drops the host of a BGP DrAgent it updates or deletes, '
+               'other workers may use it for up to this many seconds. Set '
+               'to 0 to disable the cache.')),
 ]
 
 cfg.CONF.register_opts(BGP_DRAGENT_SCHEDULER_OPTS)
 
+# Maximum number of BgpSpeaker IDs in the IN clause of a query
+BGP_SPEAKER_ID_CHUNK_SIZE = 500
+
+# Number of BgpSpeakers hosted by BgpDrAgents which do not report it
+DEFAULT_MAX_BGP_SPEAKERS = 1
+
+
+def get_max_bgp_speakers(agent):
+    """Return the number of BgpSpeakers a BgpDrAgent can host."""
+    try:
+        configurations = jsonutils.loads(agent.configurations)
+    except (TypeError, ValueError):
+        return DEFAULT_MAX_BGP_SPEAKERS
+    return configurations.get('max_bgp_speakers', DEFAULT_MAX_BGP_SPEAKERS)
+
 
 class BgpSpeakerDrAgentBinding(model_base.BASEV2):
     """Represents a mapping between BGP speaker and BGP DRAgent"""
@@ -52,7 +92,7 @@ class BgpSpeakerDrAgentBinding(model_base.BASEV2):
     bgp_speaker_id = sa.Column(sa.String(length=36),
                                sa.ForeignKey("bgp_speakers.id",
                                              ondelete='CASCADE'),
-                               nullable=False)
+                               primary_key=True)
     dragent = orm.relation(agents_db.Agent)
     agent_id = sa.Column(sa.String(length=36),
                          sa.ForeignKey("agents.id",
@@ -65,6 +105,90 @@ class BgpDrAgentSchedulerDbMixin(bgp_dras_ext.BgpDrSchedulerPluginBase,
 
     bgp_drscheduler = None
 
+    def add_periodic_dragent_status_check(self):
+        if not cfg.CONF.allow_automatic_bgp_speaker_failover:
+            LOG.info(_LI("Skipping periodic BgpDrAgent status check because "
+                         "automatic BgpSpeaker rescheduling is disabled."))
+            return
+
+        self.add_agent_status_check_worker(
+            self.reschedule_bgp_speakers_from_down_dragents)
+
+    def reschedule_bgp_speakers_from_down_dragents(self):
+        """Reschedule BgpSpeakers from down BgpDrAgents if admin state is up.
+
+        BgpSpeakers hosted by fewer than dragents_per_bgp_speaker BgpDrAgents
+        are then scheduled to additional BgpDrAgents.
+        """
+        if not self.bgp_drscheduler:
+            return
+        agent_dead_limit = self.agent_dead_limit_seconds()
+        self.wait_down_agents('BgpDrAgent', agent_dead_limit)
+        context = n_context.get_admin_context()
+        try:
+            down_bindings = self._get_down_bgp_speaker_bindings(
+                                                    context, agent_dead_limit)
+            for agent_id, bgp_speaker_id in down_bindings:
+                LOG.warning(_LW("Rescheduling BgpSpeaker %(bgp_speaker)s "
+                                "from BgpDrAgent %(agent)s because the "
+                                "agent did not report to the server in the "
+                                "last %(dead_time)s seconds."),
+                            {'bgp_speaker': bgp_speaker_id,
+                             'agent': agent_id,
+                             'dead_time': agent_dead_limit})
+                try:
+                    self.reschedule_bgp_speaker(context, bgp_speaker_id,
+                                                agent_id)
+                except bgp_dras_ext.BgpSpeakerRescheduleError as e:
+                    LOG.warning(_LW("%s"), e)
+
+            for bgp_speaker_id in self._get_underscheduled_bgp_speakers(
+                                                                    context):
+                self.schedule_bgp_speaker(
+                    context, self.get_bgp_speaker(context, bgp_speaker_id))
+        except Exception:
+            LOG.exception(_LE("Exception encountered during BgpSpeaker "
+                              "rescheduling."))
+
+    def _get_down_bgp_speaker_bindings(self, context, agent_dead_limit):
+        cutoff = timeutils.utcnow() - datetime.timedelta(
+                                                    seconds=agent_dead_limit)
+        query = context.session.query(BgpSpeakerDrAgentBinding.agent_id,
+                                      BgpSpeakerDrAgentBinding.bgp_speaker_id)
+        query = query.join(BgpSpeakerDrAgentBinding.dragent)
+        query = query.filter(agents_db.Agent.heartbeat_timestamp < cutoff,
+                             agents_db.Agent.admin_state_up == sa.true())
+        return query.all()
+
+    def _get_underscheduled_bgp_speakers(self, context):
+        """Return the scheduled BgpSpeakers lacking BgpDrAgents."""
+        query = context.session.query(
+                    BgpSpeakerDrAgentBinding.bgp_speaker_id)
+        query = query.group_by(BgpSpeakerDrAgentBinding.bgp_speaker_id)
+        query = query.having(sa.func.count(BgpSpeakerDrAgentBinding.agent_id)
+                             < cfg.CONF.dragents_per_bgp_speaker)
+        return [bgp_speaker_id for bgp_speaker_id, in query]
+
+    def reschedule_bgp_speaker(self, context, bgp_speaker_id, agent_id):
+        """Move a BgpSpeaker from a BgpDrAgent to another one."""
+        bgp_speaker = self.get_bgp_speaker(context, bgp_speaker_id)
+        old_agent = self._get_agent(context, agent_id)
+        with context.session.begin(subtransactions=True):
+            self._remove_bgp_speaker_dragent_binding(context, agent_id,
+                                                     bgp_speaker_id)
+            new_agents = self.bgp_drscheduler.schedule(self, context,
+                                                      bgp_speaker)
+            if not new_agents:
+                raise bgp_dras_ext.BgpSpeakerRescheduleError(
+                    bgp_speaker_id=bgp_speaker_id,
+                    failure_reason=_('no eligible BgpDrAgent found'))
+
+        self._bgp_rpc.bgp_speaker_removed(context, bgp_speaker_id,
+                                          old_agent.host)
+        for agent in new_agents:
+            self._bgp_rpc.bgp_speaker_created(context, bgp_speaker_id,
+                                              agent.host)
+
     def schedule_unscheduled_bgp_speakers(self, context, host):
         if self.bgp_drscheduler:
             return self.bgp_drscheduler.schedule_unscheduled_bgp_speakers(
@@ -75,7 +199,7 @@ class BgpDrAgentSchedulerDbMixin(bgp_dras_ext.BgpDrSchedulerPluginBase,
 
     def schedule_bgp_speaker(self, context, created_bgp_speaker):
         if self.bgp_drscheduler:
-            agents = self.bgp_drscheduler.schedule(context,
+            agents = self.bgp_drscheduler.schedule(self, context,
                                                    created_bgp_speaker)
             for agent in agents:
                 self._bgp_rpc.bgp_speaker_created(context,
@@ -109,6 +233,13 @@ class BgpDrAgentSchedulerDbMixin(bgp_dras_ext.BgpDrSchedulerPluginBase,
             if not is_agent_bgp or not agent_up:
                 raise bgp_dras_ext.DrAgentInvalid(id=agent_id)
 
+            max_bgp_speakers = get_max_bgp_speakers(agent_db)
+            query = context.session.query(BgpSpeakerDrAgentBinding)
+            query = query.filter_by(agent_id=agent_id)
+            if query.count() >= max_bgp_speakers:
+                raise bgp_dras_ext.DrAgentMaxBgpSpeakers(
+                    agent_id=agent_id, count=max_bgp_speakers)
+
             binding = BgpSpeakerDrAgentBinding()
             binding.bgp_speaker_id = speaker_id
             binding.agent_id = agent_id
@@ -124,44 +255,139 @@ class BgpDrAgentSchedulerDbMixin(bgp_dras_ext.BgpDrSchedulerPluginBase,
             if not is_agent_bgp:
                 raise bgp_dras_ext.DrAgentInvalid(id=agent_id)
 
-            query = context.session.query(BgpSpeakerDrAgentBinding)
-            query = query.filter_by(bgp_speaker_id=speaker_id,
-                                    agent_id=agent_id)
-
-            num_deleted = query.delete()
-            if not num_deleted:
-                raise bgp_dras_ext.DrAgentNotHostingBgpSpeaker(
-                    bgp_speaker_id=speaker_id,
-                    agent_id=agent_id)
-            LOG.debug('BgpSpeaker %(bgp_speaker_id)s removed from '
-                      'BgpDrAgent %(agent_id)s',
-                      {'bgp_speaker_id': speaker_id,
-                       'agent_id': agent_id})
+            self._remove_bgp_speaker_dragent_binding(context, agent_id,
+                                                     speaker_id)
 
         self._bgp_rpc.bgp_speaker_removed(context, speaker_id, agent_db.host)
 
-    def get_dragents_hosting_bgp_speakers(self, context, bgp_speaker_ids,
-                                          active=None, admin_state_up=None):
+    def _remove_bgp_speaker_dragent_binding(self, context,
+                                            agent_id, speaker_id):
         query = context.session.query(BgpSpeakerDrAgentBinding)
-        query = query.options(orm.contains_eager(
-                              BgpSpeakerDrAgentBinding.dragent))
-        query = query.join(BgpSpeakerDrAgentBinding.dragent)
+        query = query.filter_by(bgp_speaker_id=speaker_id,
+                                agent_id=agent_id)
+
+        num_deleted = query.delete()
+        if not num_deleted:
+            raise bgp_dras_ext.DrAgentNotHostingBgpSpeaker(
+                bgp_speaker_id=speaker_id,
+                agent_id=agent_id)
+        LOG.debug('BgpSpeaker %(bgp_speaker_id)s removed from '
+                  'BgpDrAgent %(agent_id)s',
+                  {'bgp_speaker_id': speaker_id,
+                   'agent_id': agent_id})
 
-        if len(bgp_speaker_ids) == 1:
-            query = query.filter(
-                BgpSpeakerDrAgentBinding.bgp_speaker_id == (
-                    bgp_speaker_ids[0]))
-        elif bgp_speaker_ids:
-            query = query.filter(
-                BgpSpeakerDrAgentBinding.bgp_speaker_id in bgp_speaker_ids)
-        if admin_state_up is not None:
-            query = query.filter(agents_db.Agent.admin_state_up ==
-                                 admin_state_up)
-
-        return [binding.dragent
-                for binding in query
+    def get_dragents_hosting_bgp_speakers(self, context, bgp_speaker_ids,
+                                          active=None, admin_state_up=None):
+        dragents_by_bgp_speaker = self.get_dragents_by_bgp_speaker(
+            context, bgp_speaker_ids, active=active,
+            admin_state_up=admin_state_up)
+        return [dragent
+                for dragents in dragents_by_bgp_speaker.values()
+                for dragent in dragents]
+
+    def get_dragents_by_bgp_speaker(self, context, bgp_speaker_ids,
+                                    active=None, admin_state_up=None):
+        """Return the BgpDrAgents hosting each of the given BgpSpeakers.
+
+        The result maps each BgpSpeaker ID to the list of its BgpDrAgents.
+        The bindings are read with one query per BGP_SPEAKER_ID_CHUNK_SIZE
+        BgpSpeaker IDs.
+        """
+        dragents_by_bgp_speaker = collections.OrderedDict(
+            (bgp_speaker_id, []) for bgp_speaker_id in bgp_speaker_ids)
+        bgp_speaker_ids = list(dragents_by_bgp_speaker)
+        for i in range(0, len(bgp_speaker_ids), BGP_SPEAKER_ID_CHUNK_SIZE):
+            query = context.session.query(BgpSpeakerDrAgentBinding)
+            query = query.options(orm.contains_eager(
+                                  BgpSpeakerDrAgentBinding.dragent))
+            query = query.join(BgpSpeakerDrAgentBinding.dragent)
+            query = query.filter(BgpSpeakerDrAgentBinding.bgp_speaker_id.in_(
+                bgp_speaker_ids[i:i + BGP_SPEAKER_ID_CHUNK_SIZE]))
+            if admin_state_up is not None:
+                query = query.filter(agents_db.Agent.admin_state_up ==
+                                     admin_state_up)
+
+            for binding in query:
                 if as_db.AgentSchedulerDbMixin.is_eligible_agent(
-                                                active, binding.dragent)]
+                                                active, binding.dragent):
+                    dragents_by_bgp_speaker[binding.bgp_speaker_id].append(
+                        binding.dragent)
+        return dragents_by_bgp_speaker
+
+    def get_dragent_hosts_by_bgp_speaker(self, context, bgp_speaker_ids):
+        """Return the hosts of the BgpDrAgents hosting the given BgpSpeakers.
+
+        The bindings are always read, so that a BgpSpeaker bound or unbound
+        through another worker is notified accordingly. Only the hosts of
+        the BgpDrAgents are cached, for bgp_dragent_hosts_cache_ttl seconds,
+        so that notifying route changes usually does not read the agents.
+        """
+        hosts_by_bgp_speaker = collections.OrderedDict(
+            (bgp_speaker_id, []) for bgp_speaker_id in bgp_speaker_ids)
+        bgp_speaker_ids = list(hosts_by_bgp_speaker)
+        bindings = []
+        for i in range(0, len(bgp_speaker_ids), BGP_SPEAKER_ID_CHUNK_SIZE):
+            query = context.session.query(
+                BgpSpeakerDrAgentBinding.bgp_speaker_id,
+                BgpSpeakerDrAgentBinding.agent_id)
+            query = query.filter(BgpSpeakerDrAgentBinding.bgp_speaker_id.in_(
+                bgp_speaker_ids[i:i + BGP_SPEAKER_ID_CHUNK_SIZE]))
+            bindings.extend(query)
+
+        agent_ids = set(agent_id for bgp_speaker_id, agent_id in bindings)
+        hosts = self._get_dragent_hosts(context, agent_ids)
+        for bgp_speaker_id, agent_id in bindings:
+            if agent_id in hosts:
+                hosts_by_bgp_speaker[bgp_speaker_id].append(hosts[agent_id])
+        return hosts_by_bgp_speaker
+
+    def _get_dragent_hosts(self, context, agent_ids):
+        """Return the hosts of BgpDrAgents by ID, through the cache."""
+        cache = self._get_dragent_hosts_cache()
+        now = timeutils.utcnow_ts(microsecond=True)
+        hosts = {}
+        missing_agent_ids = []
+        for agent_id in agent_ids:
+            entry = cache.get(agent_id)
+            if entry is not None and now < entry[0]:
+                hosts[agent_id] = entry[1]
+            else:
+                missing_agent_ids.append(agent_id)
+        if not missing_agent_ids:
+            return hosts
+
+        ttl = cfg.CONF.bgp_dragent_hosts_cache_ttl
+        dragent_hosts = self._get_dragent_hosts_by_agent_ids(
+                                                    context, missing_agent_ids)
+        for agent_id, host in dragent_hosts:
+            hosts[agent_id] = host
+            if ttl > 0:
+                cache[agent_id] = (now + ttl, host)
+        return hosts
+
+    def _get_dragent_hosts_by_agent_ids(self, context, agent_ids):
+        query = context.session.query(agents_db.Agent.id,
+                                      agents_db.Agent.host)
+        return query.filter(agents_db.Agent.id.in_(agent_ids)).all()
+
+    def invalidate_dragent_hosts(self, host=None):
+        """Drop cached BgpDrAgent hosts.
+
+        The entries of the given host are dropped, or the whole cache if no
+        host is given.
+        """
+        cache = self._get_dragent_hosts_cache()
+        if host is None:
+            cache.clear()
+            return
+        for agent_id, (expires_at, agent_host) in list(cache.items()):
+            if agent_host == host:
+                cache.pop(agent_id, None)
+
+    def _get_dragent_hosts_cache(self):
+        if getattr(self, '_dragent_hosts_cache', None) is None:
+            self._dragent_hosts_cache = {}
+        return self._dragent_hosts_cache
 
     def get_dragent_bgp_speaker_bindings(self, context):
         return context.session.query(BgpSpeakerDrAgentBinding).all()
@@ -195,13 +421,36 @@ class BgpDrAgentSchedulerDbMixin(bgp_dras_ext.BgpDrSchedulerPluginBase,
 
         query = context.session.query(BgpSpeakerDrAgentBinding)
         query = query.filter(BgpSpeakerDrAgentBinding.agent_id == agent.id)
-        try:
-            binding = query.one()
-        except exc.NoResultFound:
+        bindings = query.all()
+        self._ensure_bgp_speakers_routes(
+            context, [binding['bgp_speaker_id'] for binding in bindings])
+        return [self.get_bgp_speaker_with_advertised_routes(
+                    context, binding['bgp_speaker_id'])
+                for binding in bindings]
+
+    def get_bgp_speaker_deltas_for_agent_host(self, context, host,
+                                              generations):
+        """Return the BgpSpeakers of a host as deltas.
+
+        generations maps the ID of each BgpSpeaker known to the agent to the
+        last generation it has seen. BgpSpeakers missing from the mapping
+        are returned as full snapshots.
+        """
+        agent = self._get_agent_by_type_and_host(
+            context, bgp_consts.AGENT_TYPE_BGP_ROUTING, host)
+        if not agent.admin_state_up:
             return []
-        bgp_speaker = self.get_bgp_speaker_with_advertised_routes(
-                                context, binding['bgp_speaker_id'])
-        return [bgp_speaker]
+
+        query = context.session.query(BgpSpeakerDrAgentBinding)
+        query = query.filter(BgpSpeakerDrAgentBinding.agent_id == agent.id)
+        bindings = query.all()
+        # The routes of the BgpSpeakers never stored are computed at once
+        self._ensure_bgp_speakers_routes(
+            context, [binding['bgp_speaker_id'] for binding in bindings])
+        return [self.get_bgp_speaker_with_route_delta(
+                    context, binding['bgp_speaker_id'],
+                    generations.get(binding['bgp_speaker_id']))
+                for binding in bindings]
 
     def get_bgp_speaker_by_speaker_id(self, context, bgp_speaker_id):
         try:
@@ -0,0 +1,100 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from neutron_dynamic_routing._i18n import _
+
+BGP_ROUTE_CACHE_OPTS = [
+    cfg.IntOpt('bgp_route_cache_size', default=64, min=0,
+               help=_("Number of BGP speakers whose advertised routes are "
+                      "cached by each neutron server worker. The least "
+                      "recently used BGP speaker is evicted first. Set to 0 "
+                      "to disable the cache.")),
+    cfg.IntOpt('bgp_route_cache_ttl', default=60, min=1,
+               help=_("Seconds for which the cached advertised routes of a "
+                      "BGP speaker may be served.")),
+]
+
+cfg.CONF.register_opts(BGP_ROUTE_CACHE_OPTS)
+
+
+class BgpSpeakerRouteCache(object):
+    """LRU cache of the advertised routes of BGP speakers.
+
+    The routes of a BGP speaker are cached along with the route generation
+    they were read at, and are only served while the BGP speaker is still
+    at that generation and for at most ttl seconds. Routes changed by
+    another neutron server worker are therefore never served from here,
+    while local changes invalidate the entry right away.
+
+    The routes are cached and served as a tuple, which is shared by all the
+    callers and must not be modified.
+    """
+
+    def __init__(self, size=None, ttl=None):
+        """Initialize the cache.
+
+        :param size: maximum number of BGP speakers cached. Defaults to
+                     bgp_route_cache_size.
+        :param ttl: seconds for which an entry is served. Defaults to
+                    bgp_route_cache_ttl.
+        """
+        if size is None:
+            size = cfg.CONF.bgp_route_cache_size
+        if ttl is None:
+            ttl = cfg.CONF.bgp_route_cache_ttl
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, bgp_speaker_id, generation):
+        """Return the cached routes of a BGP speaker, or None."""
+        entry = self._entries.pop(bgp_speaker_id, None)
+        if entry is not None:
+            cached_generation, expires_at, routes = entry
+            if (cached_generation == generation and
+                    timeutils.utcnow_ts(microsecond=True) < expires_at):
+                # Move the BGP speaker to the most recently used end
+                self._entries[bgp_speaker_id] = entry
+                self.hits += 1
+                return routes
+        self.misses += 1
+
+    def put(self, bgp_speaker_id, generation, routes):
+        if self.size <= 0 or generation is None:
+            return
+        self._entries.pop(bgp_speaker_id, None)
+        expires_at = timeutils.utcnow_ts(microsecond=True) + self.ttl
+        self._entries[bgp_speaker_id] = (generation, expires_at,
+                                         tuple(routes))
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, bgp_speaker_id):
+        self._entries.pop(bgp_speaker_id, None)
+
+    def get_stats(self):
+        return {'size': len(self._entries),
+                'max_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
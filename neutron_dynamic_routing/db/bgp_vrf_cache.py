@@ -0,0 +1,127 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from neutron_dynamic_routing._i18n import _
+
+BGP_VRF_CACHE_OPTS = [
+    cfg.IntOpt('bgpvrf_router_index_ttl', default=60, min=0,
+               help=_("Seconds for which each neutron server worker serves "
+                      "the BGPVRFs of the routers from memory before "
+                      "reading them again. Associations changed through "
+                      "another worker are seen after at most that long. "
+                      "Set to 0 to disable the index.")),
+]
+
+cfg.CONF.register_opts(BGP_VRF_CACHE_OPTS)
+
+
+def _copy_vrf(vrf):
+    return {'id': vrf['id'],
+            'import_targets': list(vrf['import_targets']),
+            'export_targets': list(vrf['export_targets']),
+            'segmentation_id': vrf['segmentation_id']}
+
+
+class RouterVrfIndex(object):
+    """In-memory index of the BGPVRFs associated to each router.
+
+    The index maps each router to the ID, route targets and segmentation ID
+    of its BGPVRFs. It is loaded in full from the database, then kept up to
+    date by the association and BGPVRF changes of this worker until it
+    expires after ttl seconds, so that the changes made through another
+    neutron server worker are picked up by the next load.
+    """
+
+    def __init__(self, ttl=None):
+        """Initialize the index.
+
+        :param ttl: seconds for which the index is served once loaded.
+                    Defaults to bgpvrf_router_index_ttl.
+        """
+        if ttl is None:
+            ttl = cfg.CONF.bgpvrf_router_index_ttl
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        # router ID -> BGPVRF ID -> BGPVRF
+        self._routers = None
+        self._expires_at = None
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def is_loaded(self):
+        if self._routers is None:
+            return False
+        if timeutils.utcnow_ts(microsecond=True) >= self._expires_at:
+            self._routers = None
+            return False
+        return True
+
+    def get(self, router_id):
+        """Return the BGPVRFs of a router, or None if not loaded."""
+        if not self.is_loaded():
+            self.misses += 1
+            return None
+        self.hits += 1
+        vrfs = self._routers.get(router_id, {})
+        return [_copy_vrf(vrf)
+                for vrf_id, vrf in sorted(vrfs.items())]
+
+    def load(self, router_vrfs):
+        """Replace the index with the (router ID, BGPVRF) pairs given."""
+        if not self.enabled:
+            return
+        self._routers = {}
+        for router_id, vrf in router_vrfs:
+            self._routers.setdefault(router_id, {})[vrf['id']] = (
+                                                            _copy_vrf(vrf))
+        self._expires_at = timeutils.utcnow_ts(microsecond=True) + self.ttl
+        self.loads += 1
+
+    def add_router(self, router_id, vrf):
+        if self.is_loaded():
+            self._routers.setdefault(router_id, {})[vrf['id']] = (
+                                                            _copy_vrf(vrf))
+
+    def remove_router(self, router_id, vrf_id):
+        if self.is_loaded():
+            vrfs = self._routers.get(router_id, {})
+            vrfs.pop(vrf_id, None)
+            if not vrfs:
+                self._routers.pop(router_id, None)
+
+    def update_vrf(self, vrf):
+        """Update a BGPVRF in the entries of the routers it is in."""
+        if self.is_loaded():
+            for vrfs in self._routers.values():
+                if vrf['id'] in vrfs:
+                    vrfs[vrf['id']] = _copy_vrf(vrf)
+
+    def remove_vrf(self, vrf_id):
+        if self.is_loaded():
+            for router_id, vrfs in list(self._routers.items()):
+                if vrfs.pop(vrf_id, None) is not None and not vrfs:
+                    del self._routers[router_id]
+
+    def get_stats(self):
+        return {'routers': len(self._routers) if self.is_loaded() else 0,
+                'hits': self.hits,
+                'misses': self.misses,
+                'loads': self.loads}
@@ -26,11 +26,37 @@ from sqlalchemy import orm
 from sqlalchemy.orm import exc
 
 from neutron_dynamic_routing._i18n import _LI, _LW
+from neutron_dynamic_routing.db import bgp_vrf_cache
 from neutron_dynamic_routing.extensions import vrf as vrf_ext
 from neutron_dynamic_routing.services.bgp.common import utils
 
 LOG = log.getLogger(__name__)
 
+RT_TYPE_IMPORT = 'import'
+RT_TYPE_EXPORT = 'export'
+RT_TYPES = {RT_TYPE_IMPORT: 'import_targets',
+            RT_TYPE_EXPORT: 'export_targets'}
+# Fields of the BGPVRFs held by the router index
+ROUTER_VRF_FIELDS = ['id', 'import_targets', 'export_targets',
+                     'segmentation_id']
+
+
+def get_vrf_route_targets(vrf_db, rt_type):
+    """Return the route targets of a type imported or exported by a VRF.
+
+    The route targets are read from the bgpvrf_route_targets table, unless
+    they do not match the string column of the VRF. This happens during a
+    rolling upgrade, as the rows of the existing VRFs are only copied by the
+    contract migration and the servers not upgraded yet only write the
+    string columns, which then hold the current route targets.
+    """
+    route_targets = [rt_db.route_target for rt_db in vrf_db.route_targets
+                     if rt_db.type == rt_type]
+    column = utils.rtrd_str2list(getattr(vrf_db, RT_TYPES[rt_type]))
+    if set(route_targets) != set(column):
+        return column
+    return route_targets
+
 
 class BgpSpeakerVrfBinding(model_base.BASEV2, models_v2.HasId,
                            models_v2.HasTenant):
@@ -62,6 +88,24 @@ class BGPVRFRouterAssociation(model_base.BASEV2, models_v2.HasId,
     sa.UniqueConstraint(vrf_id, router_id)
 
 
+class BGPVRFRouteTarget(model_base.BASEV2):
+    """Represents a route target imported or exported by a BGPVRF."""
+    __tablename__ = 'bgpvrf_route_targets'
+
+    vrf_id = sa.Column(sa.String(36),
+                       sa.ForeignKey('vrfs.id', ondelete='CASCADE'),
+                       nullable=False,
+                       primary_key=True)
+    type = sa.Column(sa.Enum(RT_TYPE_IMPORT, RT_TYPE_EXPORT,
+                             name='bgpvrf_route_target_types'),
+                     nullable=False,
+                     primary_key=True)
+    route_target = sa.Column(sa.String(64), nullable=False, primary_key=True)
+    # Resolves the VRFs importing or exporting a route target
+    __table_args__ = (sa.Index('ix_bgpvrf_route_targets_type_route_target',
+                               'type', 'route_target'),)
+
+
 class BGPVRF(model_base.BASEV2, models_v2.HasId, models_v2.HasTenant):
     """Represents a BGPVRF Object."""
     __tablename__ = 'vrfs'
@@ -74,6 +118,15 @@ class BGPVRF(model_base.BASEV2, models_v2.HasId, models_v2.HasTenant):
     route_distinguishers = sa.Column(sa.String(255), nullable=True)
     segmentation_id = sa.Column(sa.BigInteger(), nullable=True)
 
+    # The import_targets and export_targets columns are still written for
+    # the servers not upgraded yet, the route targets are read from here
+    # while they match them.
+    route_targets = orm.relationship(BGPVRFRouteTarget,
+                                     lazy='subquery',
+                                     order_by=BGPVRFRouteTarget.route_target,
+                                     cascade='all, delete-orphan')
+    # Both collections are eagerly loaded, with a fixed number of queries
+    # for any number of VRFs.
     router_associations = orm.relationship("BGPVRFRouterAssociation",
                                            backref="vrf_router_bindings",
                                            lazy='joined',
@@ -83,15 +136,31 @@ class BGPVRF(model_base.BASEV2, models_v2.HasId, models_v2.HasTenant):
 class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
     """BGPVRF service plugin database class using SQLAlchemy models."""
 
-    def _get_vrfs_for_tenant(self, session, tenant_id, fields):
-        try:
-            qry = session.query(BGPVRF)
-            vrfs = qry.filter_by(tenant_id=tenant_id)
-        except exc.NoResultFound:
-            return
-
-        return [self._make_vrf_dict(vrf, fields=fields)
-                for vrf in vrfs]
+    def _get_vrfs_for_tenant(self, context, tenant_id, fields=None,
+                             sorts=None, limit=None, marker=None,
+                             page_reverse=False):
+        return self.get_vrfs(context, filters={'tenant_id': [tenant_id]},
+                             fields=fields, sorts=sorts, limit=limit,
+                             marker=marker, page_reverse=page_reverse)
+
+    def _get_vrf_route_targets(self, vrf_db, rt_type):
+        return get_vrf_route_targets(vrf_db, rt_type)
+
+    def _set_vrf_route_targets(self, vrf_db, rt_type, route_targets):
+        route_targets = utils.rtrd_str2list(route_targets)
+        current = set(rt_db.route_target for rt_db in vrf_db.route_targets
+                      if rt_db.type == rt_type)
+        for rt_db in list(vrf_db.route_targets):
+            if (rt_db.type == rt_type and
+                    rt_db.route_target not in route_targets):
+                vrf_db.route_targets.remove(rt_db)
+        for route_target in route_targets:
+            if route_target not in current:
+                vrf_db.route_targets.append(
+                    BGPVRFRouteTarget(type=rt_type,
+                                      route_target=route_target))
+        setattr(vrf_db, RT_TYPES[rt_type],
+                utils.rtrd_list2str(route_targets))
 
     def _make_vrf_dict(self, vrf_db, fields=None):
         router_list = [router_assocs.router_id for router_assocs in
@@ -105,9 +174,9 @@ class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
             'route_distinguishers':
                 utils.rtrd_str2list(vrf_db['route_distinguishers']),
             'import_targets':
-                utils.rtrd_str2list(vrf_db['import_targets']),
+                self._get_vrf_route_targets(vrf_db, RT_TYPE_IMPORT),
             'export_targets':
-                utils.rtrd_str2list(vrf_db['export_targets']),
+                self._get_vrf_route_targets(vrf_db, RT_TYPE_EXPORT),
             'segmentation_id': str(vrf_db['segmentation_id'])
         }
         return self._fields(res, fields)
@@ -115,8 +184,6 @@ class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
     def create_vrf(self, context, vrf):
         LOG.debug("vrf: %s", vrf)
         vrf_info = vrf['vrf']
-        i_rt = utils.rtrd_list2str(vrf_info['import_targets'])
-        e_rt = utils.rtrd_list2str(vrf_info['export_targets'])
         rd = utils.rtrd_list2str(vrf_info.get('route_distinguishers', ''))
 
         with context.session.begin(subtransactions=True):
@@ -125,18 +192,26 @@ class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
                 tenant_id=vrf_info['tenant_id'],
                 name=vrf_info['name'],
                 type=vrf_info['type'],
-                import_targets=i_rt,
-                export_targets=e_rt,
                 route_distinguishers=rd,
                 segmentation_id=long(vrf_info['segmentation_id'])
             )
+            for rt_type, attr in RT_TYPES.items():
+                self._set_vrf_route_targets(vrf_db, rt_type, vrf_info[attr])
             context.session.add(vrf_db)
 
         return self._make_vrf_dict(vrf_db)
 
-    def get_vrfs(self, context, filters=None, fields=None):
+    def get_vrfs(self, context, filters=None, fields=None, sorts=None,
+                 limit=None, marker=None, page_reverse=False):
+        # The router associations and route targets of the VRFs are eagerly
+        # loaded along with the page of VRFs, so the number of queries does
+        # not depend on the number of VRFs.
+        marker_obj = self._get_marker_obj(context, 'vrf', limit, marker)
         return self._get_collection(context, BGPVRF, self._make_vrf_dict,
-                                    filters=filters, fields=fields)
+                                    filters=filters, fields=fields,
+                                    sorts=sorts, limit=limit,
+                                    marker_obj=marker_obj,
+                                    page_reverse=page_reverse)
 
     def _get_vrf(self, context, id):
         try:
@@ -155,18 +230,22 @@ class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
         with context.session.begin(subtransactions=True):
             vrf_db = self._get_vrf(context, id)
             if vrf_info:
-                # Format Route Target lists to string
-                if 'import_targets' in vrf_info:
-                    i_rt = utils.rtrd_list2str(vrf_info['import_targets'])
-                    vrf_info['import_targets'] = i_rt
-                if 'export_targets' in vrf_info:
-                    e_rt = utils.rtrd_list2str(vrf_info['export_targets'])
-                    vrf_info['export_targets'] = e_rt
+                # The route targets left unchanged are written again, to
+                # catch up with the changes of the servers not upgraded yet.
+                for rt_type, attr in RT_TYPES.items():
+                    self._set_vrf_route_targets(
+                        vrf_db, rt_type,
+                        vrf_info.pop(attr,
+                                     self._get_vrf_route_targets(vrf_db,
+                                                                 rt_type)))
+                # Format Route Distinguisher list to string
                 if 'route_distinguishers' in vrf_info:
                     rd = utils.rtrd_list2str(vrf_info['route_distinguishers'])
                     vrf_info['route_distinguishers'] = rd
 
                 vrf_db.update(vrf_info)
+        self._get_router_vrf_index().update_vrf(
+            self._make_vrf_dict(vrf_db, ROUTER_VRF_FIELDS))
         return self._make_vrf_dict(vrf_db, fields)
 
     def delete_vrf(self, context, id):
@@ -175,18 +254,87 @@ class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
             vrf_db = self._get_vrf(context, id)
             vrf = self._make_vrf_dict(vrf_db)
             context.session.delete(vrf_db)
+        self._get_router_vrf_index().remove_vrf(id)
         return vrf
 
-    def find_vrfs_for_router(self, context, router_id):
-        try:
-            query = (context.session.query(BGPVRF).
-                     join(BGPVRFRouterAssociation).
-                     filter(BGPVRFRouterAssociation.router_id == router_id))
-        except exc.NoResultFound:
-            return
-
-        return [self._make_vrf_dict(vrf)
-                for vrf in query.all()]
+    def get_vrf_ids_by_route_targets(self, context, route_targets,
+                                     rt_type=RT_TYPE_IMPORT):
+        """Return the IDs of the VRFs importing each of the route targets.
+
+        The VRFs exporting them are returned instead with rt_type 'export'.
+        """
+        vrf_ids = dict((route_target, set())
+                       for route_target in route_targets)
+        if not vrf_ids:
+            return vrf_ids
+        query = context.session.query(BGPVRFRouteTarget.route_target,
+                                      BGPVRFRouteTarget.vrf_id)
+        query = query.filter(BGPVRFRouteTarget.type == rt_type,
+                             BGPVRFRouteTarget.route_target.in_(list(vrf_ids)))
+        for route_target, vrf_id in query:
+            vrf_ids[route_target].add(vrf_id)
+        return vrf_ids
+
+    def get_vrfs_by_route_targets(self, context, route_targets,
+                                  rt_type=RT_TYPE_IMPORT, fields=None):
+        """Return the VRFs importing any of the route targets.
+
+        The VRFs exporting them are returned instead with rt_type 'export'.
+        """
+        route_targets = list(route_targets)
+        if not route_targets:
+            return []
+        matches = context.session.query(BGPVRFRouteTarget.vrf_id).filter(
+            BGPVRFRouteTarget.type == rt_type,
+            BGPVRFRouteTarget.route_target.in_(route_targets))
+        query = self._model_query(context, BGPVRF)
+        query = query.filter(BGPVRF.id.in_(matches.subquery()))
+        return [self._make_vrf_dict(vrf_db, fields) for vrf_db in query]
+
+    def find_vrfs_for_router(self, context, router_id, fields=None,
+                             sorts=None, limit=None, marker=None,
+                             page_reverse=False):
+        vrf_ids = [vrf['id']
+                   for vrf in self.get_router_vrfs(context, router_id)]
+        if not vrf_ids:
+            return []
+        return self.get_vrfs(context, filters={'id': vrf_ids},
+                             fields=fields, sorts=sorts, limit=limit,
+                             marker=marker, page_reverse=page_reverse)
+
+    def get_router_vrfs(self, context, router_id):
+        """Return the BGPVRFs associated to a router.
+
+        Only the ID, route targets and segmentation ID of the BGPVRFs are
+        returned. They are served from the router index of this worker,
+        which is loaded in full on a miss.
+        """
+        index = self._get_router_vrf_index()
+        vrfs = index.get(router_id)
+        if vrfs is not None:
+            return vrfs
+        # The index is shared by all the tenants
+        query = context.session.query(BGPVRF)
+        if not index.enabled:
+            query = query.filter(
+                BGPVRF.router_associations.any(router_id=router_id))
+        router_vrfs = [(router_assoc_db.router_id,
+                        self._make_vrf_dict(vrf_db, ROUTER_VRF_FIELDS))
+                       for vrf_db in query
+                       for router_assoc_db in vrf_db.router_associations]
+        index.load(router_vrfs)
+        return sorted((vrf for vrf_router_id, vrf in router_vrfs
+                       if vrf_router_id == router_id),
+                      key=lambda vrf: vrf['id'])
+
+    def _get_router_vrf_index(self):
+        if getattr(self, '_router_vrf_index', None) is None:
+            self._router_vrf_index = bgp_vrf_cache.RouterVrfIndex()
+        return self._router_vrf_index
+
+    def get_router_vrf_index_stats(self):
+        """Return the size and hit, miss and load counts of the index."""
+        return self._get_router_vrf_index().get_stats()
 
     def _make_router_assoc_dict(self, router_assoc_db, fields=None):
         res = {'id': router_assoc_db['id'],
@@ -214,7 +362,6 @@ class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
                     vrf_id=vrf_id,
                     router_id=router_id)
                 context.session.add(router_assoc_db)
-            return self._make_router_assoc_dict(router_assoc_db)
         except db_exc.DBDuplicateEntry:
             LOG.warning(_LW("router %(router_id)s is already associated to "
                             "BGPVRF %(vrf_id)s"),
@@ -222,6 +369,11 @@ class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
                          'vrf_id': vrf_id})
             raise vrf_ext.BGPVRFRouterAssocAlreadyExists(
                 vrf_id=vrf_id, router_id=router_id)
+        index = self._get_router_vrf_index()
+        if index.is_loaded():
+            index.add_router(router_id, self.get_vrf(context, vrf_id,
+                                                     ROUTER_VRF_FIELDS))
+        return self._make_router_assoc_dict(router_assoc_db)
 
     def remove_vrf_router_assoc(self, context, vrf_id, router_association):
         LOG.debug("association %s", router_association)
@@ -234,6 +386,7 @@ class BGPVRFPluginDb(common_db_mixin.CommonDbMixin):
                                                      vrf_id, router_id)
             router_assoc = self._make_router_assoc_dict(router_assoc_db)
             context.session.delete(router_assoc_db)
+        self._get_router_vrf_index().remove_router(router_id, vrf_id)
         return router_assoc
 
     def _make_speaker_assoc_dict(self, speaker_assoc_db, fields=None):
@@ -0,0 +1,81 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""backfill bgpvrf route targets
+
+Revision ID: 9b8f2ac1d4e7
+Revises: a589fdb5724c
+Create Date: 2016-10-18 11:12:04.618230
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b8f2ac1d4e7'
+down_revision = 'a589fdb5724c'
+depends_on = ('7d32f979895f',)
+
+RT_TYPE_COLUMNS = (('import', 'import_targets'),
+                   ('export', 'export_targets'))
+
+vrfs = sa.Table('vrfs', sa.MetaData(),
+                sa.Column('id', sa.String(length=36)),
+                sa.Column('import_targets', sa.String(255)),
+                sa.Column('export_targets', sa.String(255)))
+
+route_targets = sa.Table('bgpvrf_route_targets', sa.MetaData(),
+                         sa.Column('vrf_id', sa.String(length=36)),
+                         sa.Column('type', sa.String(16)),
+                         sa.Column('route_target', sa.String(64)))
+
+
+def upgrade():
+    """Copy the route targets of the VRFs into bgpvrf_route_targets.
+
+    All the servers are stopped by now, so the string columns of the VRFs
+    hold their current route targets, including those written by servers
+    which did not know about the table. The rows which differ from them are
+    replaced.
+    """
+
+    bind = op.get_bind()
+    existing = {}
+    for row in bind.execute(sa.select([route_targets])):
+        key = (row[route_targets.c.vrf_id], row[route_targets.c.type])
+        existing.setdefault(key, set()).add(row[route_targets.c.route_target])
+
+    stale = []
+    rows = []
+    for vrf in bind.execute(sa.select([vrfs])):
+        vrf_id = vrf[vrfs.c.id]
+        for rt_type, column in RT_TYPE_COLUMNS:
+            targets = set(filter(None, (vrf[column] or '').split(',')))
+            current = existing.get((vrf_id, rt_type), set())
+            if targets == current:
+                continue
+            if current:
+                stale.append((vrf_id, rt_type))
+            rows.extend({'vrf_id': vrf_id,
+                         'type': rt_type,
+                         'route_target': route_target}
+                        for route_target in sorted(targets))
+
+    for vrf_id, rt_type in stale:
+        op.execute(route_targets.delete().where(sa.and_(
+            route_targets.c.vrf_id == vrf_id,
+            route_targets.c.type == rt_type)))
+    if rows:
+        op.bulk_insert(route_targets, rows)
@@ -0,0 +1,53 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""multiple bgp speakers per dragent
+
+Revision ID: a589fdb5724c
+Revises: 4cf8bc3edb66
+Create Date: 2016-10-12 10:08:41.536784
+
+"""
+
+from alembic import op
+from sqlalchemy.engine import reflection
+
+
+# revision identifiers, used by Alembic.
+revision = 'a589fdb5724c'
+down_revision = '4cf8bc3edb66'
+
+TABLE = 'bgp_speaker_dragent_bindings'
+
+
+def upgrade():
+    """Add bgp_speaker_id to the primary key of the BgpDrAgent bindings.
+
+    The primary key used to be agent_id alone, which only allowed one
+    BgpSpeaker per BgpDrAgent. The foreign key to the agents is dropped
+    first, as MySQL uses the primary key as its index.
+    """
+
+    inspector = reflection.Inspector.from_engine(op.get_bind())
+    agent_fks = [fk for fk in inspector.get_foreign_keys(TABLE)
+                 if fk['referred_table'] == 'agents']
+    for fk in agent_fks:
+        op.drop_constraint(fk['name'], TABLE, type_='foreignkey')
+
+    pk_name = inspector.get_pk_constraint(TABLE).get('name') or 'PRIMARY'
+    op.drop_constraint(pk_name, TABLE, type_='primary')
+    op.create_primary_key(pk_name, TABLE, ['agent_id', 'bgp_speaker_id'])
+
+    for fk in agent_fks:
+        op.create_foreign_key(fk['name'], TABLE, 'agents',
+                              ['agent_id'], ['id'], ondelete='CASCADE')
@@ -0,0 +1,42 @@
+#    Copyright 2016 Huawei Technologies India Pvt Limited.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add bgp speaker routes table
+
+Revision ID: 2a4e1f39cd7b
+Revises: b7a91e8ba52c
+Create Date: 2016-10-03 09:12:44.503112
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2a4e1f39cd7b'
+down_revision = 'b7a91e8ba52c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.create_table(
+        'bgp_speaker_routes',
+        sa.Column('bgp_speaker_id', sa.String(length=36),
+                  sa.ForeignKey('bgp_speakers.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('destination', sa.String(64), nullable=False),
+        sa.Column('next_hop', sa.String(64), nullable=False),
+        sa.PrimaryKeyConstraint('bgp_speaker_id', 'destination'),
+    )
@@ -0,0 +1,36 @@
+#    Copyright 2016 Huawei Technologies India Pvt Limited.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add bgp speaker aggregate routes
+
+Revision ID: 3e3c8a8f9d21
+Revises: 61c3a4b7e0d2
+Create Date: 2016-10-14 09:47:13.662051
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e3c8a8f9d21'
+down_revision = '61c3a4b7e0d2'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.add_column('bgp_speakers',
+                  sa.Column('aggregate_routes', sa.Boolean(), nullable=False,
+                            server_default=sa.sql.false()))
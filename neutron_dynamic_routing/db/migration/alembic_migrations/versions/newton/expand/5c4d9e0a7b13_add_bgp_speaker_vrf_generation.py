@@ -0,0 +1,36 @@
+#    Copyright 2016 Huawei Technologies India Pvt Limited.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add bgp speaker vrf generation
+
+Revision ID: 5c4d9e0a7b13
+Revises: 7d32f979895f
+Create Date: 2016-10-24 16:12:48.530216
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c4d9e0a7b13'
+down_revision = '7d32f979895f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.add_column('bgp_speakers',
+                  sa.Column('vrf_generation', sa.BigInteger(),
+                            nullable=False, server_default='0'))
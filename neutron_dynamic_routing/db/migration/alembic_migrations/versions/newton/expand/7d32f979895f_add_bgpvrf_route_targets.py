@@ -0,0 +1,51 @@
+#    Copyright 2016 Huawei Technologies India Pvt Limited.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add bgpvrf route targets table
+
+Revision ID: 7d32f979895f
+Revises: 3e3c8a8f9d21
+Create Date: 2016-10-18 11:05:37.294410
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d32f979895f'
+down_revision = '3e3c8a8f9d21'
+
+from alembic import op
+import sqlalchemy as sa
+
+rt_type = sa.Enum('import', 'export', name='bgpvrf_route_target_types')
+
+
+def upgrade():
+    """Add the bgpvrf_route_targets table.
+
+    Only the schema is changed here, the route targets of the existing VRFs
+    are copied by the contract migration 9b8f2ac1d4e7.
+    """
+
+    op.create_table(
+        'bgpvrf_route_targets',
+        sa.Column('vrf_id', sa.String(length=36),
+                  sa.ForeignKey('vrfs.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('type', rt_type, nullable=False),
+        sa.Column('route_target', sa.String(64), nullable=False),
+        sa.PrimaryKeyConstraint('vrf_id', 'type', 'route_target'),
+    )
+    op.create_index('ix_bgpvrf_route_targets_type_route_target',
+                    'bgpvrf_route_targets', ['type', 'route_target'])
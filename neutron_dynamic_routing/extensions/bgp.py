@@ -78,6 +78,13 @@ RESOURCE_ATTRIBUTE_MAP = {
                                       'is_visible': True, 'default': True,
                                       'required_by_policy': False,
                                       'enforce_policy': True},
+        'aggregate_routes': {'allow_post': True,
+                             'allow_put': True,
+                             'convert_to': attr.convert_to_boolean,
+                             'validate': {'type:boolean': None},
+                             'is_visible': True, 'default': False,
+                             'required_by_policy': False,
+                             'enforce_policy': True},
         'vrfs': {'allow_post': False, 'allow_put': False,
                  'validate': {'type:uuid_list': None},
                  'is_visible': True, 'default': [],
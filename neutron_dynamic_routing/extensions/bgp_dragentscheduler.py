@@ -54,6 +54,16 @@ class DrAgentAssociationError(n_exc.Conflict):
                 "to a BGP speaker.")
 
 
+class BgpSpeakerRescheduleError(n_exc.Conflict):
+    message = _("Failed rescheduling BGP speaker %(bgp_speaker_id)s: "
+                "%(failure_reason)s.")
+
+
+class DrAgentMaxBgpSpeakers(n_exc.Conflict):
+    message = _("BgpDrAgent %(agent_id)s already hosts its maximum of "
+                "%(count)d BGP speakers.")
+
+
 class BgpDrSchedulerController(wsgi.Controller):
     """Schedule BgpSpeaker for a BgpDrAgent"""
     def get_plugin(self):
@@ -14,13 +14,22 @@
 # limitations under the License.
 
 import collections
+import heapq
+import itertools
+import os
 
+import eventlet
+from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging
 from oslo_service import loopingcall
+from oslo_serialization import jsonutils
 from oslo_service import periodic_task
+from oslo_utils import fileutils
 from oslo_utils import importutils
+from oslo_utils import timeutils
+import six
 
 from neutron.agent import rpc as agent_rpc
 from neutron.common import constants as n_const
@@ -32,11 +41,19 @@ from neutron import manager
 
 from neutron_dynamic_routing.extensions import bgp as bgp_ext
 from neutron_dynamic_routing._i18n import _, _LE, _LI, _LW
+from neutron_dynamic_routing.services.bgp.agent import route_aggregator
 from neutron_dynamic_routing.services.bgp.agent.driver import exceptions as driver_exc  # noqa
 from neutron_dynamic_routing.services.bgp.common import constants as bgp_consts  # noqa
 
 LOG = logging.getLogger(__name__)
 
+# Version of the format of the BGP DrAgent state file.
+STATE_FILE_VERSION = 1
+
+# Priorities of the resyncs of a BGP speaker, the lowest is served first.
+RESYNC_PRIORITY_ERROR = 0
+RESYNC_PRIORITY_REFRESH = 1
+
 
 class BgpDrAgent(manager.Manager):
     """BGP Dynamic Routing agent service manager.
@@ -50,16 +67,27 @@ class BgpDrAgent(manager.Manager):
 
     API version history:
         1.0 initial Version
+        1.1 Added bgp_speaker_vrfs_update_end
     """
-    target = oslo_messaging.Target(version='1.0')
+    target = oslo_messaging.Target(version='1.1')
 
     def __init__(self, host, conf=None):
         super(BgpDrAgent, self).__init__()
         self.initialize_driver(conf)
-        self.needs_resync_reasons = collections.defaultdict(list)
+        self.resync_queue = BgpSpeakerResyncQueue(
+                                            self.conf.bgp_resync_max_backoff)
         self.needs_full_sync_reason = None
+        # Whether the due resyncs are about to be served out of the periodic
+        # resync
+        self._resync_woken = False
+        # BGP peers associated with a BGP speaker which are still to be
+        # added, so that the notifications queued behind the lock of the
+        # speaker are resolved with a single RPC call.
+        self.pending_bgp_peer_ids = collections.defaultdict(set)
 
         self.cache = BgpSpeakerCache()
+        # Change count of the cache when the state file was last written
+        self.saved_changes = None
         self.context = context.get_admin_context_without_session()
         self.plugin_rpc = BgpDrPluginApi(bgp_consts.BGP_PLUGIN,
                                          self.context, host)
@@ -76,6 +104,13 @@ class BgpDrAgent(manager.Manager):
             raise SystemExit(1)
 
     def _handle_driver_failure(self, bgp_speaker_id, method, driver_exec):
+        if isinstance(driver_exec, driver_exc.BgpSpeakerNotAdded):
+            # The driver lost the BGP speaker, for instance as the process
+            # running it exited, so the next resync adds it again.
+            self.cache.remove_bgp_speaker_by_id(bgp_speaker_id)
+        # The driver state can no longer be derived from the last seen
+        # generation, so the next resync must fetch a full snapshot.
+        self.cache.invalidate_generation(bgp_speaker_id)
         self.schedule_resync(reason=driver_exec,
                              speaker_id=bgp_speaker_id)
         LOG.error(_LE('Call to driver for BGP Speaker %(bgp_speaker)s '
@@ -91,81 +126,258 @@ class BgpDrAgent(manager.Manager):
 
     def run(self):
         """Activate BGP Dynamic Routing agent."""
+        self.restore_state()
         self.sync_state(self.context)
         self.periodic_resync(self.context)
 
-    @utils.synchronized('bgp-dragent')
+    def restore_state(self):
+        """Advertise the BGP speakers saved in the state file.
+
+        The BGP speakers are restored along with the route generation they
+        were saved with, so that the next sync only applies the changes made
+        on the neutron server since the state was saved.
+        """
+        if self.cache.get_bgp_speaker_ids():
+            return
+        bgp_speakers = self._load_state()
+        for bgp_speaker in bgp_speakers:
+            with self._bgp_speaker_lock(bgp_speaker['id']):
+                self.safe_configure_dragent_for_bgp_speaker(bgp_speaker)
+        if bgp_speakers:
+            LOG.info(_LI("Restored %(count)d BGP speakers from %(file)s"),
+                     {'count': len(bgp_speakers),
+                      'file': self.conf.bgp_state_file})
+
+    def _load_state(self):
+        state_file = self.conf.bgp_state_file
+        if not state_file or not os.path.exists(state_file):
+            return []
+        try:
+            with open(state_file) as f:
+                state = jsonutils.load(f)
+            if state.get('version') != STATE_FILE_VERSION:
+                LOG.warning(_LW("Ignoring BGP DrAgent state file %(file)s "
+                                "of unsupported version %(version)s"),
+                            {'file': state_file,
+                             'version': state.get('version')})
+                return []
+            return state['bgp_speakers']
+        except Exception:
+            LOG.exception(_LE("Unable to load BGP DrAgent state from %s"),
+                          state_file)
+            return []
+
+    def save_state(self):
+        """Save the cached BGP speakers to the state file if changed."""
+        state_file = self.conf.bgp_state_file
+        changes = self.cache.changes
+        if not state_file or changes == self.saved_changes:
+            return
+        state = jsonutils.dumps(
+            {'version': STATE_FILE_VERSION,
+             'bgp_speakers': self.cache.get_bgp_speakers_state()},
+            sort_keys=True)
+        try:
+            state_dir = os.path.dirname(state_file)
+            if state_dir:
+                fileutils.ensure_tree(state_dir)
+            # The state holds the passwords of the BGP peers, and is
+            # renamed into place so that a crash never leaves it truncated.
+            tmp_file = state_file + '.tmp'
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(state)
+            os.rename(tmp_file, state_file)
+            self.saved_changes = changes
+        except Exception:
+            LOG.exception(_LE("Unable to save BGP DrAgent state to %s"),
+                          state_file)
+
+    def _bgp_speaker_lock(self, bgp_speaker_id):
+        """Serialize the processing of a single BGP speaker.
+
+        Work on different BGP speakers, like a resync of one and a route
+        advertisement for another, proceeds concurrently.
+        """
+        return lockutils.lock('bgp-speaker-%s' % bgp_speaker_id)
+
     def sync_state(self, context, full_sync=None, bgp_speakers=None):
+        # No agent wide lock is held, so the events and resyncs of the BGP
+        # speakers which are not being synchronized are not delayed.
         try:
-            hosted_bgp_speakers = self.plugin_rpc.get_bgp_speakers(context)
-            hosted_bgp_speaker_ids = [bgp_speaker['id']
-                                      for bgp_speaker in hosted_bgp_speakers]
-            cached_bgp_speakers = self.cache.get_bgp_speaker_ids()
-            for bgp_speaker_id in cached_bgp_speakers:
-                if bgp_speaker_id not in hosted_bgp_speaker_ids:
-                    self.remove_bgp_speaker_from_dragent(bgp_speaker_id)
-
-            resync_all = not bgp_speakers or full_sync
-            only_bs = set() if resync_all else set(bgp_speakers)
-            for hosted_bgp_speaker in hosted_bgp_speakers:
-                hosted_bs_id = hosted_bgp_speaker['id']
-                if resync_all or hosted_bs_id in only_bs:
-                    if not self.cache.is_bgp_speaker_added(hosted_bs_id):
-                        self.safe_configure_dragent_for_bgp_speaker(
-                            hosted_bgp_speaker)
-                        continue
-                    self.sync_bgp_speaker(hosted_bgp_speaker)
-                    resync_reason = "Periodic route cache refresh"
-                    self.schedule_resync(speaker_id=hosted_bs_id,
-                                         reason=resync_reason)
+            hosted_bgp_speakers = self.plugin_rpc.get_bgp_speakers_delta(
+                                            context,
+                                            self.cache.get_generations())
         except Exception as e:
             self.schedule_full_resync(reason=e)
             LOG.error(_LE('Unable to sync BGP speaker state.'))
+            return
+
+        # BGP speakers are synchronized concurrently, each under its own
+        # lock, as their sync is dominated by RPC and driver round trips.
+        pool = eventlet.GreenPool(self.conf.bgp_sync_workers)
+        hosted_bgp_speaker_ids = [bgp_speaker['id']
+                                  for bgp_speaker in hosted_bgp_speakers]
+        cached_bgp_speakers = list(self.cache.get_bgp_speaker_ids())
+        for bgp_speaker_id in cached_bgp_speakers:
+            if bgp_speaker_id not in hosted_bgp_speaker_ids:
+                pool.spawn_n(self._remove_unhosted_bgp_speaker,
+                             bgp_speaker_id)
+
+        if not bgp_speakers or full_sync:
+            bgp_speakers_to_sync = hosted_bgp_speakers
+        else:
+            # Keep the order of the requested BGP speakers, so that the
+            # most urgent resyncs are started first.
+            hosted_bgp_speakers = dict((bgp_speaker['id'], bgp_speaker)
+                                       for bgp_speaker in hosted_bgp_speakers)
+            bgp_speakers_to_sync = [hosted_bgp_speakers[bgp_speaker_id]
+                                    for bgp_speaker_id in bgp_speakers
+                                    if bgp_speaker_id in hosted_bgp_speakers]
+        for hosted_bgp_speaker in bgp_speakers_to_sync:
+            pool.spawn_n(self._sync_hosted_bgp_speaker, hosted_bgp_speaker)
+        pool.waitall()
+
+    def _remove_unhosted_bgp_speaker(self, bgp_speaker_id):
+        with self._bgp_speaker_lock(bgp_speaker_id):
+            try:
+                self.remove_bgp_speaker_from_dragent(bgp_speaker_id)
+            except Exception as e:
+                self.schedule_resync(speaker_id=bgp_speaker_id, reason=e)
+                LOG.error(_LE('Unable to remove BGP speaker %s.'),
+                          bgp_speaker_id)
+
+    def _sync_hosted_bgp_speaker(self, bgp_speaker):
+        bgp_speaker_id = bgp_speaker['id']
+        with self._bgp_speaker_lock(bgp_speaker_id):
+            try:
+                if not self.cache.is_bgp_speaker_added(bgp_speaker_id):
+                    self.safe_configure_dragent_for_bgp_speaker(bgp_speaker)
+                    return
+                self.sync_bgp_speaker(bgp_speaker)
+                self.schedule_route_refresh(bgp_speaker_id)
+            except Exception as e:
+                # The changes of the delta may not all have been applied, so
+                # the resync must not request the next delta.
+                self.cache.invalidate_generation(bgp_speaker_id)
+                self.schedule_resync(speaker_id=bgp_speaker_id, reason=e)
+                LOG.error(_LE('Unable to sync BGP speaker %s state.'),
+                          bgp_speaker_id)
 
     def sync_bgp_speaker(self, bgp_speaker):
+        # Driver failures below, and any error raised by the sync,
+        # invalidate the generation again
+        self.cache.set_generation(bgp_speaker['id'],
+                                  bgp_speaker.get('generation'))
+
         # sync BGP Speakers
         bgp_peer_ips = set(
             [bgp_peer['peer_ip'] for bgp_peer in bgp_speaker['peers']])
         cached_bgp_peer_ips = set(
             self.cache.get_bgp_peer_ips(bgp_speaker['id']))
         removed_bgp_peer_ips = cached_bgp_peer_ips - bgp_peer_ips
+        enable_evpn = self._is_evpn_enabled(bgp_speaker)
+        if enable_evpn != self.cache.is_evpn_enabled(bgp_speaker['id']):
+            # The address families are only negotiated when a peer is
+            # added, so all the peers are added again.
+            removed_bgp_peer_ips = cached_bgp_peer_ips
+            self.cache.set_evpn_enabled(bgp_speaker['id'], enable_evpn)
 
         for bgp_peer_ip in removed_bgp_peer_ips:
             self.remove_bgp_peer_from_bgp_speaker(bgp_speaker['id'],
                                                   bgp_peer_ip)
         if bgp_peer_ips:
             self.add_bgp_peers_to_bgp_speaker(bgp_speaker)
+        if not self.cache.is_bgp_speaker_added(bgp_speaker['id']):
+            # The driver lost the BGP speaker, the resync adds it again
+            return
+
+        self._sync_route_aggregation(bgp_speaker)
+        self.sync_vrfs(bgp_speaker)
 
         # sync advertise routes
-        cached_adv_routes = self.cache.get_adv_routes(bgp_speaker['id'])
-        adv_routes = bgp_speaker['advertised_routes']
-        if cached_adv_routes == adv_routes:
+        if bgp_speaker.get('full_sync', True):
+            stale_routes, new_routes = self.cache.get_adv_routes_diff(
+                                            bgp_speaker['id'],
+                                            bgp_speaker['advertised_routes'])
+        else:
+            stale_routes, new_routes = self._get_adv_routes_delta(bgp_speaker)
+        if not stale_routes and not new_routes:
             return
 
-        for cached_route in cached_adv_routes:
-            if cached_route not in adv_routes:
-                self.withdraw_route_via_bgp_speaker(bgp_speaker['id'],
-                                                    bgp_speaker['local_as'],
-                                                    cached_route)
+        if stale_routes:
+            self._withdraw_routes(bgp_speaker['id'],
+                                  bgp_speaker['local_as'],
+                                  stale_routes)
 
         self.advertise_routes_via_bgp_speaker(bgp_speaker)
 
+    def _sync_route_aggregation(self, bgp_speaker):
+        """Switch the route aggregation of a BGP speaker on or off.
+
+        The driver is moved from the advertised routes to their summary, or
+        back, with the fewest advertisements and withdrawals.
+        """
+        bgp_speaker_id = bgp_speaker['id']
+        aggregate_routes = bool(bgp_speaker.get('aggregate_routes'))
+        aggregator = self.cache.get_route_aggregator(bgp_speaker_id)
+        if aggregate_routes == (aggregator is not None):
+            return
+
+        adv_routes = self.cache.get_adv_routes(bgp_speaker_id)
+        if aggregator is not None:
+            old_routes = aggregator.get_routes()
+            new_routes = adv_routes
+            aggregator = None
+        else:
+            aggregator = route_aggregator.RouteAggregator()
+            aggregator.update(routes=adv_routes)
+            old_routes = adv_routes
+            new_routes = aggregator.get_routes()
+        self.cache.set_route_aggregator(bgp_speaker_id, aggregator)
+
+        old_routes = dict((route['destination'], route['next_hop'])
+                          for route in old_routes)
+        new_routes = dict((route['destination'], route['next_hop'])
+                          for route in new_routes)
+        cidrs = [destination for destination in old_routes
+                 if destination not in new_routes]
+        routes = [{'destination': destination, 'next_hop': next_hop}
+                  for destination, next_hop in new_routes.items()
+                  if old_routes.get(destination) != next_hop]
+        self._update_driver_routes(bgp_speaker_id, bgp_speaker['local_as'],
+                                   routes, cidrs)
+
+    def _get_adv_routes_delta(self, bgp_speaker):
+        """Return the cached routes replaced or withdrawn by a delta."""
+        stale_routes = []
+        for route in itertools.chain(bgp_speaker['withdrawn_routes'],
+                                     bgp_speaker['advertised_routes']):
+            cached_route = self.cache.get_adv_route_by_destination(
+                                                    bgp_speaker['id'],
+                                                    route['destination'])
+            if cached_route and (cached_route['next_hop'] !=
+                                 route.get('next_hop')):
+                stale_routes.append(cached_route)
+        return stale_routes, bgp_speaker['advertised_routes']
+
     @utils.exception_logger()
     def _periodic_resync_helper(self, context):
-        """Resync the BgpDrAgent state at the configured interval."""
-        if self.needs_resync_reasons or self.needs_full_sync_reason:
-            full_sync = self.needs_full_sync_reason
-            reasons = self.needs_resync_reasons
-            # Reset old reasons
-            self.needs_full_sync_reason = None
-            self.needs_resync_reasons = collections.defaultdict(list)
-            if full_sync:
-                LOG.debug("resync all: %(reason)s", {"reason": full_sync})
-            for bgp_speaker, reason in reasons.items():
-                LOG.debug("resync (%(bgp_speaker)s): %(reason)s",
-                          {"reason": reason, "bgp_speaker": bgp_speaker})
-            self.sync_state(
-                context, full_sync=full_sync, bgp_speakers=reasons.keys())
+        """Resync the BGP speakers whose resync is due."""
+        full_sync = self.needs_full_sync_reason
+        resyncs = self.resync_queue.pop_due()
+        if not full_sync and not resyncs:
+            return
+        self.needs_full_sync_reason = None
+        if full_sync:
+            LOG.debug("resync all: %(reason)s", {"reason": full_sync})
+        for bgp_speaker, reasons in resyncs:
+            LOG.debug("resync (%(bgp_speaker)s): %(reason)s",
+                      {"reason": reasons, "bgp_speaker": bgp_speaker})
+        self.sync_state(
+            context, full_sync=full_sync,
+            bgp_speakers=[bgp_speaker for bgp_speaker, reasons in resyncs])
 
     # NOTE: spacing is set 1 sec. The actual interval is controlled
     # by neutron/service.py which defaults to CONF.periodic_interval
@@ -174,16 +386,33 @@ class BgpDrAgent(manager.Manager):
         LOG.debug("Started periodic resync.")
         self._periodic_resync_helper(context)
 
-    @utils.synchronized('bgp-dr-agent')
+    def wake_resync(self):
+        """Serve the due resyncs now rather than at the next periodic tick.
+
+        The wake-ups requested before the resyncs are served are coalesced.
+        """
+        if self._resync_woken:
+            return
+        self._resync_woken = True
+        eventlet.spawn_n(self._woken_resync)
+
+    def _woken_resync(self):
+        self._resync_woken = False
+        self._periodic_resync_helper(self.context)
+
+    @periodic_task.periodic_task(spacing=1)
+    def periodic_save_state(self, context):
+        self.save_state()
+
     def bgp_speaker_create_end(self, context, payload):
         """Handle bgp_speaker_create_end notification event."""
         bgp_speaker_id = payload['bgp_speaker']['id']
         LOG.debug('Received BGP speaker create notification for '
                   'speaker_id=%(speaker_id)s from the neutron server.',
                   {'speaker_id': bgp_speaker_id})
-        self.add_bgp_speaker_helper(bgp_speaker_id)
+        with self._bgp_speaker_lock(bgp_speaker_id):
+            self.add_bgp_speaker_helper(bgp_speaker_id)
 
-    @utils.synchronized('bgp-dr-agent')
     def bgp_speaker_remove_end(self, context, payload):
         """Handle bgp_speaker_create_end notification event."""
 
@@ -191,9 +420,9 @@ class BgpDrAgent(manager.Manager):
         LOG.debug('Received BGP speaker remove notification for '
                   'speaker_id=%(speaker_id)s from the neutron server.',
                   {'speaker_id': bgp_speaker_id})
-        self.remove_bgp_speaker_from_dragent(bgp_speaker_id)
+        with self._bgp_speaker_lock(bgp_speaker_id):
+            self.remove_bgp_speaker_from_dragent(bgp_speaker_id)
 
-    @utils.synchronized('bgp-dr-agent')
     def bgp_peer_association_end(self, context, payload):
         """Handle bgp_peer_association_end notification event."""
 
@@ -204,9 +433,14 @@ class BgpDrAgent(manager.Manager):
                   'from the neutron server.',
                   {'speaker_id': bgp_speaker_id,
                    'peer_id': bgp_peer_id})
-        self.add_bgp_peer_helper(bgp_speaker_id, bgp_peer_id)
+        self.pending_bgp_peer_ids[bgp_speaker_id].add(bgp_peer_id)
+        with self._bgp_speaker_lock(bgp_speaker_id):
+            bgp_peer_ids = self.pending_bgp_peer_ids.pop(bgp_speaker_id,
+                                                         None)
+            if bgp_peer_ids:
+                self.add_bgp_peers_helper(bgp_speaker_id,
+                                          sorted(bgp_peer_ids))
 
-    @utils.synchronized('bgp-dr-agent')
     def bgp_peer_disassociation_end(self, context, payload):
         """Handle bgp_peer_disassociation_end notification event."""
 
@@ -217,9 +451,23 @@ class BgpDrAgent(manager.Manager):
                   'from the neutron server.',
                   {'speaker_id': bgp_speaker_id,
                    'peer_ip': bgp_peer_ip})
-        self.remove_bgp_peer_from_bgp_speaker(bgp_speaker_id, bgp_peer_ip)
+        with self._bgp_speaker_lock(bgp_speaker_id):
+            self.remove_bgp_peer_from_bgp_speaker(bgp_speaker_id,
+                                                  bgp_peer_ip)
+
+    def bgp_speaker_vrfs_update_end(self, context, payload):
+        """Handle bgp_speaker_vrfs_update_end notification event."""
+
+        bgp_speaker_id = payload['bgp_speaker']['id']
+        LOG.debug('Received VRFs update notification for '
+                  'speaker_id=%(speaker_id)s from the neutron server.',
+                  {'speaker_id': bgp_speaker_id})
+        # The VRFs come with the next delta of the BGP speaker, which is
+        # fetched now rather than at the next periodic resync.
+        self.resync_queue.schedule(bgp_speaker_id, "BGP Speaker VRFs updated",
+                                   RESYNC_PRIORITY_REFRESH)
+        self.wake_resync()
 
-    @utils.synchronized('bgp-dr-agent')
     def bgp_routes_advertisement_end(self, context, payload):
         """Handle bgp_routes_advertisement_end notification event."""
 
@@ -228,9 +476,9 @@ class BgpDrAgent(manager.Manager):
                   'for speaker_id=%(speaker_id)s from the neutron server.',
                   {'speaker_id': bgp_speaker_id})
         routes = payload['advertise_routes']['routes']
-        self.add_routes_helper(bgp_speaker_id, routes)
+        with self._bgp_speaker_lock(bgp_speaker_id):
+            self.add_routes_helper(bgp_speaker_id, routes)
 
-    @utils.synchronized('bgp-dr-agent')
     def bgp_routes_withdrawal_end(self, context, payload):
         """Handle bgp_routes_withdrawal_end notification event."""
 
@@ -239,7 +487,8 @@ class BgpDrAgent(manager.Manager):
                   'speaker_id=%(speaker_id)s from the neutron server.',
                   {'speaker_id': bgp_speaker_id})
         routes = payload['withdraw_routes']['routes']
-        self.withdraw_routes_helper(bgp_speaker_id, routes)
+        with self._bgp_speaker_lock(bgp_speaker_id):
+            self.withdraw_routes_helper(bgp_speaker_id, routes)
 
     def add_bgp_speaker_helper(self, bgp_speaker_id):
         """Add BGP speaker."""
@@ -249,6 +498,10 @@ class BgpDrAgent(manager.Manager):
 
     def add_bgp_peer_helper(self, bgp_speaker_id, bgp_peer_id):
         """Add BGP peer."""
+        self.add_bgp_peers_helper(bgp_speaker_id, [bgp_peer_id])
+
+    def add_bgp_peers_helper(self, bgp_speaker_id, bgp_peer_ids):
+        """Add BGP peers."""
         # Ideally BGP Speaker must be added by now, If not then let's
         # re-sync.
         if not self.cache.is_bgp_speaker_added(bgp_speaker_id):
@@ -256,14 +509,15 @@ class BgpDrAgent(manager.Manager):
                                  reason="BGP Speaker Out-of-sync")
             return
 
-        bgp_peer = self.safe_get_bgp_peer_info(bgp_speaker_id,
-                                               bgp_peer_id)
-        if bgp_peer:
+        bgp_peers = self.safe_get_bgp_peers_info(bgp_speaker_id,
+                                                 bgp_peer_ids)
+        if bgp_peers:
             bgp_speaker_as = self.cache.get_bgp_speaker_local_as(
                                                             bgp_speaker_id)
-            self.add_bgp_peer_to_bgp_speaker(bgp_speaker_id,
-                                             bgp_speaker_as,
-                                             bgp_peer)
+            for bgp_peer in bgp_peers:
+                self.add_bgp_peer_to_bgp_speaker(bgp_speaker_id,
+                                                 bgp_speaker_as,
+                                                 bgp_peer)
 
     def add_routes_helper(self, bgp_speaker_id, routes):
         """Advertise routes to BGP speaker."""
@@ -275,12 +529,7 @@ class BgpDrAgent(manager.Manager):
             return
 
         bgp_speaker_as = self.cache.get_bgp_speaker_local_as(bgp_speaker_id)
-        for route in routes:
-            self.advertise_route_via_bgp_speaker(bgp_speaker_id,
-                                                 bgp_speaker_as,
-                                                 route)
-            if self.is_resync_scheduled(bgp_speaker_id):
-                break
+        self._advertise_routes(bgp_speaker_id, bgp_speaker_as, routes)
 
     def withdraw_routes_helper(self, bgp_speaker_id, routes):
         """Withdraw routes advertised by BGP speaker."""
@@ -292,12 +541,7 @@ class BgpDrAgent(manager.Manager):
             return
 
         bgp_speaker_as = self.cache.get_bgp_speaker_local_as(bgp_speaker_id)
-        for route in routes:
-            self.withdraw_route_via_bgp_speaker(bgp_speaker_id,
-                                                bgp_speaker_as,
-                                                route)
-            if self.is_resync_scheduled(bgp_speaker_id):
-                break
+        self._withdraw_routes(bgp_speaker_id, bgp_speaker_as, routes)
 
     def safe_get_bgp_speaker_info(self, bgp_speaker_id):
         try:
@@ -328,6 +572,28 @@ class BgpDrAgent(manager.Manager):
                           'failed with reason=%(e)s.'),
                       {'bgp_peer': bgp_peer_id, 'e': e})
 
+    def safe_get_bgp_peers_info(self, bgp_speaker_id, bgp_peer_ids):
+        """Resolve BGP peers, with a single RPC call for several peers."""
+        if len(bgp_peer_ids) == 1:
+            bgp_peer = self.safe_get_bgp_peer_info(bgp_speaker_id,
+                                                   bgp_peer_ids[0])
+            return [bgp_peer] if bgp_peer else []
+        try:
+            bgp_peers = self.plugin_rpc.get_bgp_peers_info(self.context,
+                                                           bgp_peer_ids)
+            deleted = set(bgp_peer_ids) - set(bgp_peer['id']
+                                              for bgp_peer in bgp_peers)
+            if deleted:
+                LOG.warning(_LW('BGP Peers %s have been deleted.'),
+                            ', '.join(sorted(deleted)))
+            return bgp_peers
+        except Exception as e:
+            self.schedule_resync(speaker_id=bgp_speaker_id,
+                                 reason=e)
+            LOG.error(_LE('BGP peers %(bgp_peers)s info call '
+                          'failed with reason=%(e)s.'),
+                      {'bgp_peers': bgp_peer_ids, 'e': e})
+
     @utils.exception_logger()
     def safe_configure_dragent_for_bgp_speaker(self, bgp_speaker):
         try:
@@ -341,6 +607,8 @@ class BgpDrAgent(manager.Manager):
         # Caching BGP speaker details in BGPSpeakerCache. Will be used
         # during smooth.
         self.cache.put_bgp_speaker(bgp_speaker)
+        self.cache.set_evpn_enabled(bgp_speaker['id'],
+                                    self._is_evpn_enabled(bgp_speaker))
 
         LOG.debug('Calling driver for adding BGP speaker %(speaker_id)s,'
                   ' speaking for local_as %(local_as)s',
@@ -353,18 +621,22 @@ class BgpDrAgent(manager.Manager):
         except Exception as e:
             self._handle_driver_failure(bgp_speaker['id'],
                                         'add_bgp_speaker', e)
+            # The resync adds the BGP speaker again
+            self.cache.remove_bgp_speaker_by_id(bgp_speaker['id'])
+            return
 
         # Add peer and route information to the driver.
         self.add_bgp_peers_to_bgp_speaker(bgp_speaker)
         self.advertise_routes_via_bgp_speaker(bgp_speaker)
-        self.schedule_resync(speaker_id=bgp_speaker['id'],
-                             reason="Periodic route cache refresh")
+        self.sync_vrfs(bgp_speaker)
+        self.schedule_route_refresh(bgp_speaker['id'])
 
     def remove_bgp_speaker_from_dragent(self, bgp_speaker_id):
         if self.cache.is_bgp_speaker_added(bgp_speaker_id):
             bgp_speaker_as = self.cache.get_bgp_speaker_local_as(
                                                         bgp_speaker_id)
             self.cache.remove_bgp_speaker_by_id(bgp_speaker_id)
+            self.resync_queue.cancel(bgp_speaker_id)
 
             LOG.debug('Calling driver for removing BGP speaker %(speaker_as)s',
                       {'speaker_as': bgp_speaker_as})
@@ -382,6 +654,16 @@ class BgpDrAgent(manager.Manager):
         self.schedule_resync(speaker_id=bgp_speaker_id,
                              reason="BGP Speaker Out-of-sync")
 
+    def _is_evpn_enabled(self, bgp_speaker):
+        """Whether the peers of a BGP speaker must negotiate EVPN.
+
+        EVPN is negotiated while the BGP speaker has VRFs. The cached VRFs
+        are used when the BGP speaker info leaves them out.
+        """
+        if 'vrfs' in bgp_speaker:
+            return bool(bgp_speaker['vrfs'])
+        return bool(self.cache.get_vrfs(bgp_speaker['id']))
+
     def add_bgp_peers_to_bgp_speaker(self, bgp_speaker):
         for bgp_peer in bgp_speaker['peers']:
             self.add_bgp_peer_to_bgp_speaker(bgp_speaker['id'],
@@ -396,19 +678,22 @@ class BgpDrAgent(manager.Manager):
             return
 
         self.cache.put_bgp_peer(bgp_speaker_id, bgp_peer)
+        enable_evpn = self.cache.is_evpn_enabled(bgp_speaker_id)
 
         LOG.debug('Calling driver interface for adding BGP peer %(peer_ip)s '
                   'remote_as=%(remote_as)s to BGP Speaker running for '
-                  'local_as=%(local_as)d',
+                  'local_as=%(local_as)d, EVPN enabled: %(evpn)s',
                   {'peer_ip': bgp_peer['peer_ip'],
                    'remote_as': bgp_peer['remote_as'],
-                   'local_as': bgp_speaker_as})
+                   'local_as': bgp_speaker_as,
+                   'evpn': enable_evpn})
         try:
             self.dr_driver_cls.add_bgp_peer(bgp_speaker_as,
                                             bgp_peer['peer_ip'],
                                             bgp_peer['remote_as'],
                                             bgp_peer['auth_type'],
-                                            bgp_peer['password'])
+                                            bgp_peer['password'],
+                                            enable_evpn=enable_evpn)
         except Exception as e:
             self._handle_driver_failure(bgp_speaker_id,
                                         'add_bgp_peer', e)
@@ -447,55 +732,183 @@ class BgpDrAgent(manager.Manager):
                              reason="BGP Peer Out-of-sync")
 
     def advertise_routes_via_bgp_speaker(self, bgp_speaker):
-        for route in bgp_speaker['advertised_routes']:
-            self.advertise_route_via_bgp_speaker(bgp_speaker['id'],
-                                                 bgp_speaker['local_as'],
-                                                 route)
-            if self.is_resync_scheduled(bgp_speaker['id']):
-                break
+        self._advertise_routes(bgp_speaker['id'],
+                               bgp_speaker['local_as'],
+                               bgp_speaker['advertised_routes'])
 
-    def advertise_route_via_bgp_speaker(self, bgp_speaker_id,
-                                        bgp_speaker_as, route):
-        if self.cache.is_route_advertised(bgp_speaker_id, route):
-            # Requested route already advertised. Hence, Nothing to be done.
+    def _advertise_routes(self, bgp_speaker_id, bgp_speaker_as, routes):
+        """Advertise the routes not advertised yet in one driver call."""
+        new_routes = []
+        for route in routes:
+            if not self.cache.is_route_advertised(bgp_speaker_id, route):
+                self.cache.put_adv_route(bgp_speaker_id, route)
+                new_routes.append(route)
+        if not new_routes:
             return
-        self.cache.put_adv_route(bgp_speaker_id, route)
 
-        LOG.debug('Calling driver for advertising prefix: %(cidr)s, '
-                  'next_hop: %(nexthop)s',
-                  {'cidr': route['destination'],
-                   'nexthop': route['next_hop']})
+        aggregator = self.cache.get_route_aggregator(bgp_speaker_id)
+        cidrs = []
+        if aggregator is not None:
+            cidrs, new_routes = aggregator.update(routes=new_routes)
+        self._update_driver_routes(bgp_speaker_id, bgp_speaker_as,
+                                   new_routes, cidrs)
+
+    def _withdraw_routes(self, bgp_speaker_id, bgp_speaker_as, routes):
+        """Withdraw the advertised routes in one driver call."""
+        cidrs = []
+        out_of_sync = False
+        for route in routes:
+            if not self.cache.is_route_advertised(bgp_speaker_id, route):
+                out_of_sync = True
+                continue
+            cached_route = self.cache.get_adv_route_by_destination(
+                                                        bgp_speaker_id,
+                                                        route['destination'])
+            self.cache.remove_adv_route(bgp_speaker_id, cached_route)
+            cidrs.append(cached_route['destination'])
+
+        aggregator = self.cache.get_route_aggregator(bgp_speaker_id)
+        routes = []
+        if aggregator is not None and cidrs:
+            cidrs, routes = aggregator.update(withdrawn=cidrs)
+        self._update_driver_routes(bgp_speaker_id, bgp_speaker_as,
+                                   routes, cidrs)
+
+        if out_of_sync:
+            # Ideally, only the advertised routes can be withdrawn by the
+            # neutron server. Let's initiate a re-sync to resolve the issue.
+            self.schedule_resync(speaker_id=bgp_speaker_id,
+                                 reason="Advertised routes Out-of-sync")
+
+    def _update_driver_routes(self, bgp_speaker_id, bgp_speaker_as,
+                              routes, cidrs):
+        """Advertise routes and withdraw prefixes through the driver.
+
+        The routes are advertised first, so that traffic is never left
+        without a route while a summary prefix is split or merged.
+        """
+        if routes:
+            LOG.debug('Calling driver for advertising %(count)d prefixes '
+                      'for BGP Speaker %(speaker_id)s',
+                      {'count': len(routes), 'speaker_id': bgp_speaker_id})
+            try:
+                self.dr_driver_cls.advertise_routes(bgp_speaker_as, routes)
+            except Exception as e:
+                self._handle_driver_failure(bgp_speaker_id,
+                                            'advertise_routes', e)
+        if cidrs:
+            LOG.debug('Calling driver for withdrawing %(count)d prefixes '
+                      'for BGP Speaker %(speaker_id)s',
+                      {'count': len(cidrs), 'speaker_id': bgp_speaker_id})
+            try:
+                self.dr_driver_cls.withdraw_routes(bgp_speaker_as, cidrs)
+            except Exception as e:
+                self._handle_driver_failure(bgp_speaker_id,
+                                            'withdraw_routes', e)
+
+    def sync_vrfs(self, bgp_speaker):
+        """Reconcile the VRFs of a BGP speaker with the driver.
+
+        The VRFs missing from the BGP speaker info, or whose route
+        distinguisher, route targets or VNI changed, are deleted. The others
+        are added if needed, and get their new routes advertised and their
+        stale routes withdrawn in one driver call each. Nothing is done when
+        the BGP speaker info leaves the VRFs out, as a delta does when they
+        did not change.
+        """
+        if 'vrfs' not in bgp_speaker:
+            return
+        bgp_speaker_id = bgp_speaker['id']
+        bgp_speaker_as = bgp_speaker['local_as']
+        vrfs = dict((vrf['id'], vrf) for vrf in bgp_speaker['vrfs'])
+        for cached_vrf in self.cache.get_vrfs(bgp_speaker_id):
+            vrf = vrfs.get(cached_vrf['id'])
+            if vrf is not None and self._is_same_vrf(vrf, cached_vrf):
+                continue
+            if not self._delete_vrf(bgp_speaker_id, bgp_speaker_as,
+                                    cached_vrf):
+                # Retried on the resync scheduled by the failure
+                vrfs.pop(cached_vrf['id'], None)
+        for vrf in vrfs.values():
+            self._sync_vrf(bgp_speaker_id, bgp_speaker_as, vrf)
+
+    def _is_same_vrf(self, vrf, cached_vrf):
+        return (vrf['route_distinguisher'] ==
+                cached_vrf['route_distinguisher'] and
+                vrf['import_targets'] == cached_vrf['import_targets'] and
+                vrf['export_targets'] == cached_vrf['export_targets'] and
+                vrf['vni'] == cached_vrf['vni'])
+
+    def _delete_vrf(self, bgp_speaker_id, bgp_speaker_as, vrf):
+        LOG.debug('Calling driver for deleting VRF %(vrf_id)s from BGP '
+                  'Speaker %(speaker_id)s',
+                  {'vrf_id': vrf['id'], 'speaker_id': bgp_speaker_id})
         try:
-            self.dr_driver_cls.advertise_route(bgp_speaker_as,
-                                               route['destination'],
-                                               route['next_hop'])
+            self.dr_driver_cls.delete_vrf(bgp_speaker_as,
+                                          vrf['route_distinguisher'])
         except Exception as e:
-            self._handle_driver_failure(bgp_speaker_id,
-                                        'advertise_route', e)
+            self._handle_driver_failure(bgp_speaker_id, 'delete_vrf', e)
+            return False
+        self.cache.remove_vrf(bgp_speaker_id, vrf['id'])
+        return True
 
-    def withdraw_route_via_bgp_speaker(self, bgp_speaker_id,
-                                       bgp_speaker_as, route):
-        if self.cache.is_route_advertised(bgp_speaker_id, route):
-            self.cache.remove_adv_route(bgp_speaker_id, route)
-            LOG.debug('Calling driver for withdrawing prefix: %(cidr)s, '
-                  'next_hop: %(nexthop)s',
-                  {'cidr': route['destination'],
-                   'nexthop': route['next_hop']})
+    def _sync_vrf(self, bgp_speaker_id, bgp_speaker_as, vrf):
+        rd = vrf['route_distinguisher']
+        cached_vrf = self.cache.get_vrf(bgp_speaker_id, vrf['id'])
+        if cached_vrf is None:
+            LOG.debug('Calling driver for adding VRF %(vrf_id)s to BGP '
+                      'Speaker %(speaker_id)s',
+                      {'vrf_id': vrf['id'], 'speaker_id': bgp_speaker_id})
             try:
-                self.dr_driver_cls.withdraw_route(bgp_speaker_as,
-                                                  route['destination'],
-                                                  route['next_hop'])
+                self.dr_driver_cls.add_vrf(bgp_speaker_as, rd,
+                                           vrf['import_targets'],
+                                           vrf['export_targets'])
+            except Exception as e:
+                self._handle_driver_failure(bgp_speaker_id, 'add_vrf', e)
+                return
+            cached_vrf = self.cache.put_vrf(bgp_speaker_id, vrf)
+
+        # The cache only records what the driver accepted, so that failed
+        # calls are retried by the next resync.
+        cached_routes = cached_vrf['routes']
+        routes = [route for route in vrf['routes']
+                  if cached_routes.get(route['destination']) !=
+                  route['gateway_ip']]
+        destinations = set(route['destination'] for route in vrf['routes'])
+        cidrs = [destination for destination in cached_routes
+                 if destination not in destinations]
+        if routes:
+            LOG.debug('Calling driver for advertising %(count)d prefixes '
+                      'from VRF %(vrf_id)s',
+                      {'count': len(routes), 'vrf_id': vrf['id']})
+            try:
+                self.dr_driver_cls.advertise_vrf_routes(bgp_speaker_as, rd,
+                                                        routes, vrf['vni'])
             except Exception as e:
                 self._handle_driver_failure(bgp_speaker_id,
-                                            'withdraw_route', e)
-            return
+                                            'advertise_vrf_routes', e)
+                return
+            self.cache.put_vrf_routes(bgp_speaker_id, vrf['id'], routes)
+        if cidrs:
+            LOG.debug('Calling driver for withdrawing %(count)d prefixes '
+                      'from VRF %(vrf_id)s',
+                      {'count': len(cidrs), 'vrf_id': vrf['id']})
+            try:
+                self.dr_driver_cls.withdraw_vrf_routes(bgp_speaker_as, rd,
+                                                       cidrs)
+            except Exception as e:
+                self._handle_driver_failure(bgp_speaker_id,
+                                            'withdraw_vrf_routes', e)
+                return
+            self.cache.remove_vrf_routes(bgp_speaker_id, vrf['id'], cidrs)
 
-        # Ideally, only the advertised routes can be withdrawn by the
-        # neutron server. Looks like there might be some synchronization
-        # issue between the server and the agent. Let's initiate a re-sync
-        # to resolve the issue.
-        self.schedule_resync(speaker_id=bgp_speaker_id,
-                             reason="Advertised routes Out-of-sync")
+    def advertise_route_via_bgp_speaker(self, bgp_speaker_id,
+                                        bgp_speaker_as, route):
+        self._advertise_routes(bgp_speaker_id, bgp_speaker_as, [route])
+
+    def withdraw_route_via_bgp_speaker(self, bgp_speaker_id,
+                                       bgp_speaker_as, route):
+        self._withdraw_routes(bgp_speaker_id, bgp_speaker_as, [route])
 
     def schedule_full_resync(self, reason):
         LOG.debug('Recording full resync request for all BGP Speakers '
@@ -504,17 +917,34 @@ class BgpDrAgent(manager.Manager):
 
     def schedule_resync(self, reason, speaker_id):
         """Schedule a full resync for a given BGP Speaker.
-        If no BGP Speaker is specified, resync all BGP Speakers.
+
+        The resync is served before the routine route refreshes, and is
+        delayed with an exponential backoff while the resyncs of the BGP
+        Speaker keep failing.
         """
         LOG.debug('Recording resync request for BGP Speaker %s '
                   'with reason=%s', speaker_id, reason)
-        self.needs_resync_reasons[speaker_id].append(reason)
+        self.resync_queue.schedule(speaker_id, reason, RESYNC_PRIORITY_ERROR)
+
+    def schedule_route_refresh(self, bgp_speaker_id):
+        """Schedule the routine resync of a BGP Speaker in sync."""
+        if self.resync_queue.is_scheduled(bgp_speaker_id,
+                                          RESYNC_PRIORITY_ERROR):
+            return
+        self.resync_queue.reset_backoff(bgp_speaker_id)
+        refresh_interval = self.conf.bgp_route_refresh_interval
+        if refresh_interval:
+            self.resync_queue.schedule(bgp_speaker_id,
+                                       "Periodic route cache refresh",
+                                       RESYNC_PRIORITY_REFRESH,
+                                       delay=refresh_interval)
 
     def is_resync_scheduled(self, bgp_speaker_id):
-        if bgp_speaker_id not in self.needs_resync_reasons:
+        reason = self.resync_queue.is_scheduled(bgp_speaker_id,
+                                                RESYNC_PRIORITY_ERROR)
+        if not reason:
             return False
 
-        reason = self.needs_resync_reasons[bgp_speaker_id]
         # Re-sync scheduled for the queried BGP speaker. No point
         # continuing further. Let's stop processing and wait for
         # re-sync to happen.
@@ -534,6 +964,8 @@ class BgpDrPluginApi(object):
 
     API version history:
         1.0 - Initial version.
+        1.1 - Added get_bgp_speakers_delta.
+        1.2 - Added get_bgp_peers_info.
     """
     def __init__(self, topic, context, host):
         self.context = context
@@ -546,6 +978,16 @@ class BgpDrPluginApi(object):
         cctxt = self.client.prepare()
         return cctxt.call(context, 'get_bgp_speakers', host=self.host)
 
+    def get_bgp_speakers_delta(self, context, generations):
+        """Make a remote process call to retrieve BGP speaker changes.
+
+        generations maps BGP speaker IDs to the last generation seen by the
+        agent. BGP speakers missing from it are returned in full.
+        """
+        cctxt = self.client.prepare(version='1.1')
+        return cctxt.call(context, 'get_bgp_speakers_delta', host=self.host,
+                          generations=generations)
+
     def get_bgp_speaker_info(self, context, bgp_speaker_id):
         """Make a remote process call to retrieve a BGP speaker info."""
         cctxt = self.client.prepare()
@@ -558,6 +1000,105 @@ class BgpDrPluginApi(object):
         return cctxt.call(context, 'get_bgp_peer_info',
                           bgp_peer_id=bgp_peer_id)
 
+    def get_bgp_peers_info(self, context, bgp_peer_ids):
+        """Make a remote process call to retrieve several BGP peers info."""
+        cctxt = self.client.prepare(version='1.2')
+        return cctxt.call(context, 'get_bgp_peers_info',
+                          bgp_peer_ids=bgp_peer_ids)
+
+
+class BgpSpeakerResyncQueue(object):
+    """Pending resyncs of BGP speakers, by due time and priority.
+
+    A BGP speaker has at most one pending resync. Scheduling it again
+    coalesces the reasons and keeps the earliest due time and the highest
+    priority, so that a burst of failures results in a single resync.
+
+    The resyncs with an error priority which are popped are counted as
+    failures of the BGP speaker, and its next resync with an error priority
+    is delayed by 1, 2, 4... seconds, up to max_backoff, until the backoff
+    of the BGP speaker is reset. A resync brought forward by a refresh is
+    popped before its backoff elapsed, and is not counted.
+    """
+    def __init__(self, max_backoff):
+        self.max_backoff = max_backoff
+        self.resyncs = {}
+        self.failures = collections.Counter()
+        self._queue = []
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.resyncs)
+
+    def _backoff(self, bgp_speaker_id):
+        failures = self.failures[bgp_speaker_id]
+        if not failures:
+            return 0
+        return min(2 ** (failures - 1), self.max_backoff)
+
+    def _push(self, bgp_speaker_id, resync):
+        heapq.heappush(self._queue, (resync['due'], resync['priority'],
+                                     next(self._sequence), bgp_speaker_id))
+
+    def schedule(self, bgp_speaker_id, reason, priority, delay=0):
+        if priority == RESYNC_PRIORITY_ERROR:
+            delay = max(delay, self._backoff(bgp_speaker_id))
+        due = timeutils.utcnow_ts(microsecond=True) + delay
+        resync = self.resyncs.get(bgp_speaker_id)
+        if resync is None:
+            resync = {'due': due, 'priority': priority, 'reasons': [],
+                      'error_due': None}
+            self.resyncs[bgp_speaker_id] = resync
+            self._push(bgp_speaker_id, resync)
+        elif due < resync['due'] or priority < resync['priority']:
+            resync['due'] = min(due, resync['due'])
+            resync['priority'] = min(priority, resync['priority'])
+            # The superseded entry of the queue is skipped when popped
+            self._push(bgp_speaker_id, resync)
+        if priority == RESYNC_PRIORITY_ERROR and (
+                resync['error_due'] is None or due < resync['error_due']):
+            resync['error_due'] = due
+        reason_text = six.text_type(reason)
+        if reason_text not in map(six.text_type, resync['reasons']):
+            resync['reasons'].append(reason)
+
+    def is_scheduled(self, bgp_speaker_id, priority=RESYNC_PRIORITY_REFRESH):
+        """Return the reasons of a resync of at least the given priority."""
+        resync = self.resyncs.get(bgp_speaker_id)
+        if resync and resync['priority'] <= priority:
+            return resync['reasons']
+
+    def pop_due(self):
+        """Pop the resyncs which are due, the most urgent first.
+
+        Return a list of (bgp_speaker_id, reasons) tuples.
+        """
+        now = timeutils.utcnow_ts(microsecond=True)
+        due_resyncs = []
+        while self._queue and self._queue[0][0] <= now:
+            due, priority, sequence, bgp_speaker_id = heapq.heappop(
+                                                                self._queue)
+            resync = self.resyncs.get(bgp_speaker_id)
+            if (not resync or resync['due'] != due or
+                    resync['priority'] != priority):
+                continue
+            del self.resyncs[bgp_speaker_id]
+            if (priority == RESYNC_PRIORITY_ERROR and
+                    due >= resync['error_due']):
+                self.failures[bgp_speaker_id] += 1
+            due_resyncs.append((priority, due, bgp_speaker_id,
+                                resync['reasons']))
+        due_resyncs.sort(key=lambda resync: resync[:2])
+        return [(bgp_speaker_id, reasons)
+                for priority, due, bgp_speaker_id, reasons in due_resyncs]
+
+    def reset_backoff(self, bgp_speaker_id):
+        self.failures.pop(bgp_speaker_id, None)
+
+    def cancel(self, bgp_speaker_id):
+        self.resyncs.pop(bgp_speaker_id, None)
+        self.reset_backoff(bgp_speaker_id)
+
 
 class BgpSpeakerCache(object):
     """Agent cache of the current BGP speaker state.
@@ -565,21 +1106,49 @@ class BgpSpeakerCache(object):
     This class is designed to support the advertisement for
     multiple BGP speaker via a single driver interface.
 
+    Advertised routes are indexed by destination and by next hop, so that
+    membership checks and withdrawals do not depend on the number of routes
+    advertised by a BGP speaker.
+
+    The route generation of the neutron server last applied for each BGP
+    speaker is tracked as well, so that resyncs can request only the
+    changes made since then.
+
+    Every change to the cache increments its change count, so that the
+    state of the BGP speakers is only exported again once it changed.
+
     Version history:
         1.0 - Initial version for caching the state of BGP speaker.
+        1.1 - Index advertised routes by destination and next hop.
+        1.2 - Track the route generation of each BGP speaker.
+        1.3 - Export the state of the BGP speakers for warm restarts.
+        1.4 - Summarize the advertised routes of the BGP speakers asking
+              for route aggregation.
+        1.5 - Track the EVPN VRFs of the BGP speakers and their routes.
+        1.6 - Count the changes to the cache.
     """
     def __init__(self):
         self.cache = {}
+        self.generations = {}
+        self.num_bgp_peers = 0
+        self.num_advertised_routes = 0
+        self.changes = 0
 
     def get_bgp_speaker_ids(self):
         return self.cache.keys()
 
     def put_bgp_speaker(self, bgp_speaker):
+        self.changes += 1
         if bgp_speaker['id'] in self.cache:
-            self.remove_bgp_speaker_by_id(self.cache[bgp_speaker['id']])
+            self.remove_bgp_speaker_by_id(bgp_speaker['id'])
         self.cache[bgp_speaker['id']] = {'bgp_speaker': bgp_speaker,
                                          'peers': {},
-                                         'advertised_routes': []}
+                                         'advertised_routes': {},
+                                         'next_hops': {}}
+        if bgp_speaker.get('aggregate_routes'):
+            self.cache[bgp_speaker['id']]['route_aggregator'] = (
+                                        route_aggregator.RouteAggregator())
+        self.set_generation(bgp_speaker['id'], bgp_speaker.get('generation'))
 
     def get_bgp_speaker_by_id(self, bgp_speaker_id):
         if bgp_speaker_id in self.cache:
@@ -594,14 +1163,36 @@ class BgpSpeakerCache(object):
         return self.get_bgp_speaker_by_id(bgp_speaker_id)
 
     def remove_bgp_speaker_by_id(self, bgp_speaker_id):
+        self.changes += 1
+        self.invalidate_generation(bgp_speaker_id)
         if bgp_speaker_id in self.cache:
-            del self.cache[bgp_speaker_id]
+            speaker_cache = self.cache.pop(bgp_speaker_id)
+            self.num_bgp_peers -= len(speaker_cache['peers'])
+            self.num_advertised_routes -= len(
+                                        speaker_cache['advertised_routes'])
+
+    def get_generations(self):
+        return dict((bgp_speaker_id, generation)
+                    for bgp_speaker_id, generation in self.generations.items()
+                    if bgp_speaker_id in self.cache)
+
+    def set_generation(self, bgp_speaker_id, generation):
+        self.changes += 1
+        if generation is None:
+            self.invalidate_generation(bgp_speaker_id)
+        else:
+            self.generations[bgp_speaker_id] = generation
+
+    def invalidate_generation(self, bgp_speaker_id):
+        self.changes += 1
+        self.generations.pop(bgp_speaker_id, None)
 
     def put_bgp_peer(self, bgp_speaker_id, bgp_peer):
-        if bgp_peer['peer_ip'] in self.get_bgp_peer_ips(bgp_speaker_id):
-            del self.cache[bgp_speaker_id]['peers'][bgp_peer['peer_ip']]
-
-        self.cache[bgp_speaker_id]['peers'][bgp_peer['peer_ip']] = bgp_peer
+        self.changes += 1
+        peers = self.cache[bgp_speaker_id]['peers']
+        if bgp_peer['peer_ip'] not in peers:
+            self.num_bgp_peers += 1
+        peers[bgp_peer['peer_ip']] = bgp_peer
 
     def is_bgp_peer_added(self, bgp_speaker_id, bgp_peer_ip):
         return self.get_bgp_peer_by_ip(bgp_speaker_id, bgp_peer_ip)
@@ -617,41 +1208,155 @@ class BgpSpeakerCache(object):
             return self.cache[bgp_speaker_id]['peers'].get(bgp_peer_ip)
 
     def remove_bgp_peer_by_ip(self, bgp_speaker_id, bgp_peer_ip):
-        if bgp_peer_ip in self.get_bgp_peer_ips(bgp_speaker_id):
-            del self.cache[bgp_speaker_id]['peers'][bgp_peer_ip]
+        self.changes += 1
+        peers = self.cache[bgp_speaker_id]['peers']
+        if peers.pop(bgp_peer_ip, None) is not None:
+            self.num_bgp_peers -= 1
 
     def put_adv_route(self, bgp_speaker_id, route):
-        self.cache[bgp_speaker_id]['advertised_routes'].append(route)
+        self.changes += 1
+        speaker_cache = self.cache[bgp_speaker_id]
+        destination = route['destination']
+        cached_route = speaker_cache['advertised_routes'].get(destination)
+        if cached_route:
+            self._unindex_next_hop(speaker_cache, cached_route)
+        else:
+            self.num_advertised_routes += 1
+        speaker_cache['advertised_routes'][destination] = route
+        speaker_cache['next_hops'].setdefault(route['next_hop'],
+                                              set()).add(destination)
 
     def is_route_advertised(self, bgp_speaker_id, route):
-        routes = self.cache[bgp_speaker_id]['advertised_routes']
-        for r in routes:
-            if r['destination'] == route['destination'] and (
-                    r['next_hop'] == route['next_hop']):
-                return True
-        return False
+        """Check whether the route is advertised by the BGP speaker.
+
+        A route without a next hop matches any next hop.
+        """
+        cached_route = self.cache[bgp_speaker_id]['advertised_routes'].get(
+                                                        route['destination'])
+        if not cached_route:
+            return False
+        next_hop = route.get('next_hop')
+        return next_hop is None or cached_route['next_hop'] == next_hop
 
     def remove_adv_route(self, bgp_speaker_id, route):
-        routes = self.cache[bgp_speaker_id]['advertised_routes']
-        updated_routes = [r for r in routes if (
-            r['destination'] != route['destination'])]
-        self.cache[bgp_speaker_id]['advertised_routes'] = updated_routes
+        self.changes += 1
+        speaker_cache = self.cache[bgp_speaker_id]
+        cached_route = speaker_cache['advertised_routes'].pop(
+                                                route['destination'], None)
+        if cached_route:
+            self._unindex_next_hop(speaker_cache, cached_route)
+            self.num_advertised_routes -= 1
+
+    def _unindex_next_hop(self, speaker_cache, route):
+        destinations = speaker_cache['next_hops'].get(route['next_hop'])
+        if destinations is not None:
+            destinations.discard(route['destination'])
+            if not destinations:
+                del speaker_cache['next_hops'][route['next_hop']]
 
     def get_adv_routes(self, bgp_speaker_id):
-        return self.cache[bgp_speaker_id]['advertised_routes']
+        return list(self.cache[bgp_speaker_id]['advertised_routes'].values())
+
+    def get_adv_route_by_destination(self, bgp_speaker_id, destination):
+        return self.cache[bgp_speaker_id]['advertised_routes'].get(
+                                                                destination)
+
+    def get_adv_routes_by_next_hop(self, bgp_speaker_id, next_hop):
+        speaker_cache = self.cache[bgp_speaker_id]
+        destinations = speaker_cache['next_hops'].get(next_hop, ())
+        return [speaker_cache['advertised_routes'][destination]
+                for destination in destinations]
+
+    def get_route_aggregator(self, bgp_speaker_id):
+        return self.cache[bgp_speaker_id].get('route_aggregator')
+
+    def set_route_aggregator(self, bgp_speaker_id, aggregator):
+        self.changes += 1
+        speaker_cache = self.cache[bgp_speaker_id]
+        speaker_cache['route_aggregator'] = aggregator
+        speaker_cache['bgp_speaker']['aggregate_routes'] = (
+                                                    aggregator is not None)
+
+    def is_evpn_enabled(self, bgp_speaker_id):
+        return self.cache[bgp_speaker_id].get('evpn_enabled', False)
+
+    def set_evpn_enabled(self, bgp_speaker_id, enabled):
+        self.changes += 1
+        self.cache[bgp_speaker_id]['evpn_enabled'] = enabled
+
+    def get_vrfs(self, bgp_speaker_id):
+        return list(self.cache[bgp_speaker_id].get('vrfs', {}).values())
+
+    def get_vrf(self, bgp_speaker_id, vrf_id):
+        return self.cache[bgp_speaker_id].get('vrfs', {}).get(vrf_id)
+
+    def put_vrf(self, bgp_speaker_id, vrf):
+        """Cache a VRF added to the driver, without its routes.
+
+        The routes of the cached VRF map their destination to their gateway.
+        """
+        self.changes += 1
+        vrfs = self.cache[bgp_speaker_id].setdefault('vrfs', {})
+        vrfs[vrf['id']] = dict(vrf, routes={})
+        return vrfs[vrf['id']]
+
+    def remove_vrf(self, bgp_speaker_id, vrf_id):
+        self.changes += 1
+        self.cache[bgp_speaker_id].get('vrfs', {}).pop(vrf_id, None)
+
+    def put_vrf_routes(self, bgp_speaker_id, vrf_id, routes):
+        self.changes += 1
+        vrf = self.get_vrf(bgp_speaker_id, vrf_id)
+        vrf['routes'].update((route['destination'], route['gateway_ip'])
+                             for route in routes)
+
+    def remove_vrf_routes(self, bgp_speaker_id, vrf_id, cidrs):
+        self.changes += 1
+        vrf = self.get_vrf(bgp_speaker_id, vrf_id)
+        for cidr in cidrs:
+            vrf['routes'].pop(cidr, None)
+
+    def get_adv_routes_diff(self, bgp_speaker_id, routes):
+        """Compare the advertised routes with the given routes.
+
+        Returns the advertised routes which are missing from, or have a
+        different next hop in, the given routes and the given routes which
+        are not advertised yet.
+        """
+        cached_routes = self.cache[bgp_speaker_id]['advertised_routes']
+        routes = dict((route['destination'], route) for route in routes)
+        stale_routes = [
+            cached_route for destination, cached_route in cached_routes.items()
+            if destination not in routes or (
+                routes[destination]['next_hop'] != cached_route['next_hop'])]
+        new_routes = [route for route in routes.values()
+                      if not self.is_route_advertised(bgp_speaker_id, route)]
+        return stale_routes, new_routes
+
+    def get_bgp_speakers_state(self):
+        """Return the cached BGP speakers in the BGP speaker info format."""
+        bgp_speakers = []
+        for bgp_speaker_id, speaker_cache in self.cache.items():
+            bgp_speaker = dict(speaker_cache['bgp_speaker'])
+            bgp_speaker.pop('withdrawn_routes', None)
+            bgp_speaker.pop('full_sync', None)
+            bgp_speaker['peers'] = list(speaker_cache['peers'].values())
+            bgp_speaker['advertised_routes'] = list(
+                                speaker_cache['advertised_routes'].values())
+            bgp_speaker['generation'] = self.generations.get(bgp_speaker_id)
+            bgp_speaker['vrfs'] = [
+                dict(vrf, routes=[{'destination': destination,
+                                   'gateway_ip': gateway_ip}
+                                  for destination, gateway_ip in
+                                  sorted(vrf['routes'].items())])
+                for vrf in self.get_vrfs(bgp_speaker_id)]
+            bgp_speakers.append(bgp_speaker)
+        return bgp_speakers
 
     def get_state(self):
-        bgp_speaker_ids = self.get_bgp_speaker_ids()
-        num_bgp_speakers = len(bgp_speaker_ids)
-        num_bgp_peers = 0
-        num_advertised_routes = 0
-        for bgp_speaker_id in bgp_speaker_ids:
-            bgp_speaker = self.get_bgp_speaker_by_id(bgp_speaker_id)
-            num_bgp_peers += len(bgp_speaker['peers'])
-            num_advertised_routes += len(bgp_speaker['advertised_routes'])
-        return {'bgp_speakers': num_bgp_speakers,
-                'bgp_peers': num_bgp_peers,
-                'advertise_routes': num_advertised_routes}
+        return {'bgp_speakers': len(self.cache),
+                'bgp_peers': self.num_bgp_peers,
+                'advertise_routes': self.num_advertised_routes}
 
 
 class BgpDrAgentWithStateReport(BgpDrAgent):
@@ -662,7 +1367,8 @@ class BgpDrAgentWithStateReport(BgpDrAgent):
         self.agent_state = {
             'agent_type': bgp_consts.AGENT_TYPE_BGP_ROUTING,
             'binary': 'neutron-bgp-dragent',
-            'configurations': {},
+            'configurations': {
+                'max_bgp_speakers': self.conf.max_bgp_speakers},
             'host': host,
             'topic': bgp_consts.BGP_DRAGENT,
             'start_flag': True}
@@ -25,5 +25,31 @@ BGP_DRIVER_OPTS = [
 BGP_PROTO_CONFIG_OPTS = [
     cfg.StrOpt('bgp_router_id',
                help=_("32-bit BGP identifier, typically an IPv4 address "
-                      "owned by the system running the BGP DrAgent."))
+                      "owned by the system running the BGP DrAgent.")),
+    cfg.IntOpt('max_bgp_speakers', default=1, min=1,
+               help=_("Maximum number of BGP speakers hosted by the BGP "
+                      "DrAgent. The Ryu driver runs each BGP speaker after "
+                      "the first one in a child process of the BGP "
+                      "DrAgent.")),
+]
+
+BGP_AGENT_OPTS = [
+    cfg.IntOpt('bgp_sync_workers', default=8, min=1,
+               help=_("Maximum number of BGP speakers the BGP DrAgent "
+                      "synchronizes with the neutron server concurrently.")),
+    cfg.StrOpt('bgp_state_file', default='$state_path/bgp-dragent.state',
+               help=_("File in which the BGP DrAgent periodically saves "
+                      "the BGP speakers, peers and routes it advertises. "
+                      "On restart they are restored from it and advertised "
+                      "before the first sync with the neutron server. "
+                      "Set to an empty value to disable.")),
+    cfg.IntOpt('bgp_route_refresh_interval', default=300, min=0,
+               help=_("Interval, in seconds, at which the BGP DrAgent "
+                      "resyncs a BGP speaker which is in sync with the "
+                      "neutron server. Resyncs caused by errors are not "
+                      "delayed by it. Set to 0 to disable.")),
+    cfg.IntOpt('bgp_resync_max_backoff', default=60, min=1,
+               help=_("Maximum delay, in seconds, between the resyncs of a "
+                      "BGP speaker whose resyncs keep failing. The delay "
+                      "doubles after every failure up to this value.")),
 ]
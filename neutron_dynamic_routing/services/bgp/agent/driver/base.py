@@ -48,7 +48,7 @@ class BgpDriverBase(object):
 
     @abc.abstractmethod
     def add_bgp_peer(self, speaker_as, peer_ip, peer_as,
-                     auth_type='none', password=None):
+                     auth_type='none', password=None, enable_evpn=False):
         """Add a new BGP peer.
 
         :param speaker_as: Specifies BGP Speaker autonomous system number.
@@ -65,6 +65,10 @@ class BgpDriverBase(object):
         :param password: Authentication password.By default, authentication
                          will be disabled.
         :type password: string
+        :param enable_evpn: Whether to negotiate the L2VPN EVPN address
+                            family with the peer, so that the routes of the
+                            VRFs of the BGP Speaker are exchanged.
+        :type enable_evpn: boolean
         :raises: BgpSpeakerNotAdded, InvalidParamType, InvalidParamRange,
                  InvaildAuthType, PasswordNotSpecified
         """
@@ -114,6 +118,111 @@ class BgpDriverBase(object):
         :raises: BgpSpeakerNotAdded, RouteNotAdvertised, InvalidParamType
         """
 
+    def advertise_routes(self, speaker_as, routes):
+        """Add new prefixes to advertise.
+
+        Drivers able to program several prefixes at once should override
+        this method. The default implementation advertises the prefixes one
+        at a time.
+
+        :param speaker_as: Specifies BGP Speaker autonomous system number.
+                           Must be an integer between MIN_ASNUM and MAX_ASNUM.
+        :type speaker_as: integer
+        :param routes: Prefixes to advertise, each a dict with the CIDR of
+                       the network as 'destination' and the next hop address
+                       as 'next_hop'.
+        :type routes: list of dict
+        :raises: BgpSpeakerNotAdded, InvalidParamType
+        """
+        for route in routes:
+            self.advertise_route(speaker_as, route['destination'],
+                                 route['next_hop'])
+
+    def withdraw_routes(self, speaker_as, cidrs):
+        """Withdraw advertised prefixes.
+
+        Drivers able to withdraw several prefixes at once should override
+        this method. The default implementation withdraws the prefixes one
+        at a time.
+
+        :param speaker_as: Specifies BGP Speaker autonomous system number.
+                           Must be an integer between MIN_ASNUM and MAX_ASNUM.
+        :type speaker_as: integer
+        :param cidrs: CIDRs of the networks to withdraw. Each must be the
+                      string representation of an IP network
+                      (e.g., 10.1.1.0/24)
+        :type cidrs: list of string
+        :raises: BgpSpeakerNotAdded, RouteNotAdvertised, InvalidParamType
+        """
+        for cidr in cidrs:
+            self.withdraw_route(speaker_as, cidr)
+
+    @abc.abstractmethod
+    def add_vrf(self, speaker_as, route_distinguisher, import_targets,
+                export_targets):
+        """Add an EVPN VRF.
+
+        :param speaker_as: Specifies BGP Speaker autonomous system number.
+                           Must be an integer between MIN_ASNUM and MAX_ASNUM.
+        :type speaker_as: integer
+        :param route_distinguisher: Route distinguisher of the VRF
+                                    (e.g., 65000:100)
+        :type route_distinguisher: string
+        :param import_targets: Route targets of the routes imported in the
+                               VRF.
+        :type import_targets: list of string
+        :param export_targets: Route targets of the routes advertised from
+                               the VRF.
+        :type export_targets: list of string
+        :raises: BgpSpeakerNotAdded, InvalidParamType
+        """
+
+    @abc.abstractmethod
+    def delete_vrf(self, speaker_as, route_distinguisher):
+        """Delete an EVPN VRF along with its routes.
+
+        :param speaker_as: Specifies BGP Speaker autonomous system number.
+                           Must be an integer between MIN_ASNUM and MAX_ASNUM.
+        :type speaker_as: integer
+        :param route_distinguisher: Route distinguisher of the VRF.
+        :type route_distinguisher: string
+        :raises: BgpSpeakerNotAdded, InvalidParamType
+        """
+
+    @abc.abstractmethod
+    def advertise_vrf_routes(self, speaker_as, route_distinguisher, routes,
+                             vni=None):
+        """Advertise prefixes from a VRF as EVPN IP prefix routes.
+
+        :param speaker_as: Specifies BGP Speaker autonomous system number.
+                           Must be an integer between MIN_ASNUM and MAX_ASNUM.
+        :type speaker_as: integer
+        :param route_distinguisher: Route distinguisher of the VRF.
+        :type route_distinguisher: string
+        :param routes: Prefixes to advertise, each a dict with the CIDR of
+                       the network as 'destination' and the address of its
+                       gateway as 'gateway_ip'.
+        :type routes: list of dict
+        :param vni: VXLAN network identifier of the VRF. The routes are
+                    advertised with an MPLS label instead when not given.
+        :type vni: integer
+        :raises: BgpSpeakerNotAdded, InvalidParamType
+        """
+
+    @abc.abstractmethod
+    def withdraw_vrf_routes(self, speaker_as, route_distinguisher, cidrs):
+        """Withdraw prefixes advertised from a VRF.
+
+        :param speaker_as: Specifies BGP Speaker autonomous system number.
+                           Must be an integer between MIN_ASNUM and MAX_ASNUM.
+        :type speaker_as: integer
+        :param route_distinguisher: Route distinguisher of the VRF.
+        :type route_distinguisher: string
+        :param cidrs: CIDRs of the networks to withdraw.
+        :type cidrs: list of string
+        :raises: BgpSpeakerNotAdded, InvalidParamType
+        """
+
     @abc.abstractmethod
     def get_bgp_speaker_statistics(self, speaker_as):
         """Collect BGP Speaker statistics.
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+
 from oslo_log import log as logging
 from oslo_utils import encodeutils
 from ryu.services.protocols.bgp import bgpspeaker
@@ -21,6 +23,7 @@ from ryu.services.protocols.bgp.rtconf.neighbors import CONNECT_MODE_ACTIVE
 from neutron_dynamic_routing._i18n import _LE, _LI
 from neutron_dynamic_routing.services.bgp.agent.driver import base
 from neutron_dynamic_routing.services.bgp.agent.driver import exceptions as bgp_driver_exc  # noqa
+from neutron_dynamic_routing.services.bgp.agent.driver.ryu import speaker_process  # noqa
 from neutron_dynamic_routing.services.bgp.agent.driver import utils
 
 LOG = logging.getLogger(__name__)
@@ -51,13 +54,17 @@ class RyuBgpDriver(base.BgpDriverBase):
 
     def __init__(self, cfg):
         LOG.info(_LI('Initializing Ryu driver for BGP Speaker functionality.'))
+        self.max_bgp_speakers = 1
         self._read_config(cfg)
 
-        # Note: Even though Ryu can only support one BGP speaker as of now,
-        # we have tried making the framework generic for the future purposes.
-        self.cache = utils.BgpMultiSpeakerCache()
+        # Ryu can only run one BGP speaker per process. The first BGP speaker
+        # runs in the BGP DrAgent, and the others in child processes.
+        self.cache = utils.BgpMultiSpeakerCache(self.max_bgp_speakers)
+        self.local_speaker_as = None
 
     def _read_config(self, cfg):
+        if cfg is not None:
+            self.max_bgp_speakers = cfg.max_bgp_speakers
         if cfg is None or cfg.bgp_router_id is None:
             # If either cfg or router_id is not specified, raise voice
             LOG.error(_LE('BGP router-id MUST be specified for the correct '
@@ -74,9 +81,9 @@ class RyuBgpDriver(base.BgpDriverBase):
                                                     current_as=speaker_as,
                                                     rtid=self.routerid)
 
-        # Ryu can only support One speaker
-        if self.cache.get_hosted_bgp_speakers_count() == 1:
-            raise bgp_driver_exc.BgpSpeakerMaxScheduled(count=1)
+        if self.cache.is_full():
+            raise bgp_driver_exc.BgpSpeakerMaxScheduled(
+                                                count=self.max_bgp_speakers)
 
         # Validate input parameters.
         # speaker_as must be an integer in the allowed range.
@@ -86,17 +93,33 @@ class RyuBgpDriver(base.BgpDriverBase):
         # Please note: Since, only the route-advertisement support is
         # implemented we are explicitly setting the bgp_server_port
         # attribute to 0 which disables listening on port 179.
-        curr_speaker = bgpspeaker.BGPSpeaker(as_number=speaker_as,
+        if self.local_speaker_as is None:
+            curr_speaker = bgpspeaker.BGPSpeaker(as_number=speaker_as,
                              router_id=self.routerid, bgp_server_port=0,
                              best_path_change_handler=best_path_change_cb,
                              peer_down_handler=bgp_peer_down_cb,
                              peer_up_handler=bgp_peer_up_cb)
+            self.local_speaker_as = speaker_as
+        else:
+            curr_speaker = speaker_process.BgpSpeakerProcess(
+                        as_number=speaker_as,
+                        router_id=self.routerid,
+                        on_exit=functools.partial(
+                            self._bgp_speaker_process_exited, speaker_as))
         LOG.info(_LI('Added BGP Speaker for local_as=%(as)d with '
                      'router_id= %(rtid)s.'),
                  {'as': speaker_as, 'rtid': self.routerid})
 
         self.cache.put_bgp_speaker(speaker_as, curr_speaker)
 
+    def _bgp_speaker_process_exited(self, speaker_as, curr_speaker):
+        # Forget the BGP speaker, so that the resync of the BGP DrAgent
+        # adds it again in a new process and programs it from scratch.
+        if self.cache.get_bgp_speaker(speaker_as) is curr_speaker:
+            LOG.error(_LE('BGP Speaker process for local_as=%d exited, the '
+                          'BGP Speaker is removed.'), speaker_as)
+            self.cache.remove_bgp_speaker(speaker_as)
+
     def delete_bgp_speaker(self, speaker_as):
         curr_speaker = self.cache.get_bgp_speaker(speaker_as)
         if not curr_speaker:
@@ -104,13 +127,15 @@ class RyuBgpDriver(base.BgpDriverBase):
                                                     rtid=self.routerid)
         # Notify Ryu about BGP Speaker deletion
         curr_speaker.shutdown()
+        if speaker_as == self.local_speaker_as:
+            self.local_speaker_as = None
         LOG.info(_LI('Removed BGP Speaker for local_as=%(as)d with '
                      'router_id=%(rtid)s.'),
                  {'as': speaker_as, 'rtid': self.routerid})
         self.cache.remove_bgp_speaker(speaker_as)
 
     def add_bgp_peer(self, speaker_as, peer_ip, peer_as,
-                     auth_type='none', password=None):
+                     auth_type='none', password=None, enable_evpn=False):
         curr_speaker = self.cache.get_bgp_speaker(speaker_as)
         if not curr_speaker:
             raise bgp_driver_exc.BgpSpeakerNotAdded(local_as=speaker_as,
@@ -127,7 +152,8 @@ class RyuBgpDriver(base.BgpDriverBase):
         curr_speaker.neighbor_add(address=peer_ip,
                                   remote_as=peer_as,
                                   password=password,
-                                  connect_mode=CONNECT_MODE_ACTIVE)
+                                  connect_mode=CONNECT_MODE_ACTIVE,
+                                  enable_evpn=enable_evpn)
         LOG.info(_LI('Added BGP Peer %(peer)s for remote_as=%(as)d to '
                      'BGP Speaker running for local_as=%(local_as)d.'),
                  {'peer': peer_ip, 'as': peer_as, 'local_as': speaker_as})
@@ -177,6 +203,146 @@ class RyuBgpDriver(base.BgpDriverBase):
                      'running for local_as=%(local_as)d.'),
                  {'prefix': cidr, 'local_as': speaker_as})
 
+    def advertise_routes(self, speaker_as, routes):
+        curr_speaker = self.cache.get_bgp_speaker(speaker_as)
+        if not curr_speaker:
+            raise bgp_driver_exc.BgpSpeakerNotAdded(local_as=speaker_as,
+                                                    rtid=self.routerid)
+
+        # Validate all prefixes before handing any of them to Ryu.
+        for route in routes:
+            utils.validate_string(route['destination'])
+            utils.validate_string(route['next_hop'])
+
+        # Notify Ryu about route advertisement
+        for route in routes:
+            curr_speaker.prefix_add(prefix=route['destination'],
+                                    next_hop=route['next_hop'])
+        LOG.info(_LI('%(count)d routes are advertised for BGP Speaker '
+                     'running for local_as=%(local_as)d.'),
+                 {'count': len(routes), 'local_as': speaker_as})
+
+    def withdraw_routes(self, speaker_as, cidrs):
+        curr_speaker = self.cache.get_bgp_speaker(speaker_as)
+        if not curr_speaker:
+            raise bgp_driver_exc.BgpSpeakerNotAdded(local_as=speaker_as,
+                                                    rtid=self.routerid)
+
+        # Validate all prefixes before handing any of them to Ryu.
+        for cidr in cidrs:
+            utils.validate_string(cidr)
+
+        # Notify Ryu about route withdrawal
+        for cidr in cidrs:
+            curr_speaker.prefix_del(prefix=cidr)
+        LOG.info(_LI('%(count)d routes are withdrawn from BGP Speaker '
+                     'running for local_as=%(local_as)d.'),
+                 {'count': len(cidrs), 'local_as': speaker_as})
+
+    def add_vrf(self, speaker_as, route_distinguisher, import_targets,
+                export_targets):
+        curr_speaker = self.cache.get_bgp_speaker(speaker_as)
+        if not curr_speaker:
+            raise bgp_driver_exc.BgpSpeakerNotAdded(local_as=speaker_as,
+                                                    rtid=self.routerid)
+
+        # Validate the route distinguisher and route targets. All must be
+        # strings.
+        utils.validate_string(route_distinguisher)
+        for route_target in import_targets + export_targets:
+            utils.validate_string(route_target)
+
+        # Notify Ryu about VRF addition
+        curr_speaker.vrf_add(route_dist=route_distinguisher,
+                             import_rts=import_targets,
+                             export_rts=export_targets,
+                             route_family=bgpspeaker.RF_L2_EVPN)
+        LOG.info(_LI('Added VRF %(rd)s to BGP Speaker running for '
+                     'local_as=%(local_as)d.'),
+                 {'rd': route_distinguisher, 'local_as': speaker_as})
+
+    def delete_vrf(self, speaker_as, route_distinguisher):
+        curr_speaker = self.cache.get_bgp_speaker(speaker_as)
+        if not curr_speaker:
+            raise bgp_driver_exc.BgpSpeakerNotAdded(local_as=speaker_as,
+                                                    rtid=self.routerid)
+        # Validate the route distinguisher. It must be a string.
+        utils.validate_string(route_distinguisher)
+
+        # Notify Ryu about VRF removal
+        curr_speaker.vrf_del(route_dist=route_distinguisher)
+        LOG.info(_LI('Removed VRF %(rd)s from BGP Speaker running for '
+                     'local_as=%(local_as)d.'),
+                 {'rd': route_distinguisher, 'local_as': speaker_as})
+
+    def advertise_vrf_routes(self, speaker_as, route_distinguisher, routes,
+                             vni=None):
+        curr_speaker = self.cache.get_bgp_speaker(speaker_as)
+        if not curr_speaker:
+            raise bgp_driver_exc.BgpSpeakerNotAdded(local_as=speaker_as,
+                                                    rtid=self.routerid)
+
+        # Validate all prefixes before handing any of them to Ryu.
+        utils.validate_string(route_distinguisher)
+        for route in routes:
+            utils.validate_string(route['destination'])
+            utils.validate_string(route['gateway_ip'])
+
+        calls = []
+        for route in routes:
+            kwargs = {'route_type': bgpspeaker.EVPN_IP_PREFIX_ROUTE,
+                      'route_dist': route_distinguisher,
+                      'ethernet_tag_id': 0,
+                      'ip_prefix': route['destination'],
+                      'gw_ip_addr': route['gateway_ip']}
+            if vni is not None:
+                kwargs['vni'] = vni
+                kwargs['tunnel_type'] = bgpspeaker.TUNNEL_TYPE_VXLAN
+            calls.append(kwargs)
+
+        # Notify Ryu about route advertisement
+        self._call_many(speaker_as, curr_speaker, 'evpn_prefix_add', calls)
+        LOG.info(_LI('%(count)d routes are advertised from VRF %(rd)s for '
+                     'BGP Speaker running for local_as=%(local_as)d.'),
+                 {'count': len(routes), 'rd': route_distinguisher,
+                  'local_as': speaker_as})
+
+    def withdraw_vrf_routes(self, speaker_as, route_distinguisher, cidrs):
+        curr_speaker = self.cache.get_bgp_speaker(speaker_as)
+        if not curr_speaker:
+            raise bgp_driver_exc.BgpSpeakerNotAdded(local_as=speaker_as,
+                                                    rtid=self.routerid)
+
+        # Validate all prefixes before handing any of them to Ryu.
+        utils.validate_string(route_distinguisher)
+        for cidr in cidrs:
+            utils.validate_string(cidr)
+
+        calls = [{'route_type': bgpspeaker.EVPN_IP_PREFIX_ROUTE,
+                  'route_dist': route_distinguisher,
+                  'ethernet_tag_id': 0,
+                  'ip_prefix': cidr}
+                 for cidr in cidrs]
+
+        # Notify Ryu about route withdrawal
+        self._call_many(speaker_as, curr_speaker, 'evpn_prefix_del', calls)
+        LOG.info(_LI('%(count)d routes are withdrawn from VRF %(rd)s of '
+                     'BGP Speaker running for local_as=%(local_as)d.'),
+                 {'count': len(cidrs), 'rd': route_distinguisher,
+                  'local_as': speaker_as})
+
+    def _call_many(self, speaker_as, curr_speaker, method, calls):
+        """Call a method of a Ryu BGP speaker with each set of arguments.
+
+        The calls to a BGP speaker running in a child process are all sent
+        to it at once.
+        """
+        if speaker_as == self.local_speaker_as:
+            for kwargs in calls:
+                getattr(curr_speaker, method)(**kwargs)
+        elif calls:
+            curr_speaker.call_many(method, calls)
+
     def get_bgp_speaker_statistics(self, speaker_as):
         LOG.info(_LI('Collecting BGP Speaker statistics for local_as=%d.'),
                  speaker_as)
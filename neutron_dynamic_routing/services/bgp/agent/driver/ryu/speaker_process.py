@@ -0,0 +1,232 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Ryu BGP speaker running in a child process of the BGP DrAgent.
+
+The BGP core of Ryu is a process wide singleton, so a process can only run
+one Ryu BGP speaker. The Ryu driver runs each additional BGP speaker in a
+child process, which it drives through BgpSpeakerProcess: every call is
+written as a line of JSON to the standard input of the child, which replies
+with a line of JSON on its standard output.
+
+The child keeps its standard output for the replies: anything else written to
+it, such as the logs of Ryu or of the driver callbacks, goes to its standard
+error instead. The child is given the configuration files of the BGP DrAgent,
+so that it logs the way the agent does.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import encodeutils
+import six
+
+from neutron_dynamic_routing._i18n import _
+
+LOG = logging.getLogger(__name__)
+
+
+class BgpSpeakerProcessError(Exception):
+    pass
+
+
+class BgpSpeakerProcess(object):
+    """Proxy to a Ryu BGPSpeaker running in a child process.
+
+    It implements the subset of the BGPSpeaker API used by the Ryu driver.
+    Once the child process has exited, every call fails, so on_exit is
+    called with the proxy to let its owner replace it.
+    """
+
+    def __init__(self, as_number, router_id, on_exit=None):
+        self._on_exit = on_exit
+        self._lock = threading.Lock()
+        self._process = subprocess.Popen(self._get_command(),
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         close_fds=True)
+        LOG.debug('Started BGP speaker process %(pid)d for '
+                  'local_as=%(as)d', {'pid': self._process.pid,
+                                      'as': as_number})
+        try:
+            self._call('start', as_number=as_number, router_id=router_id)
+        except BgpSpeakerProcessError:
+            self._stop()
+            raise
+
+    def _get_command(self):
+        command = [sys.executable, '-m', __name__]
+        try:
+            config_files = cfg.CONF.config_file or []
+        except cfg.NoSuchOptError:
+            # The configuration of the agent was not loaded
+            config_files = []
+        for config_file in config_files:
+            command.extend(['--config-file', config_file])
+        return command
+
+    def _call(self, method, **kwargs):
+        request = jsonutils.dumps({'method': method, 'kwargs': kwargs})
+        with self._lock:
+            try:
+                self._process.stdin.write(
+                    encodeutils.safe_encode(request + '\n'))
+                self._process.stdin.flush()
+                reply = self._process.stdout.readline()
+                error = _('BGP speaker process %d exited') % self._process.pid
+            except (IOError, OSError) as e:
+                reply = None
+                error = (_('BGP speaker process %(pid)d failed: %(err)s') %
+                         {'pid': self._process.pid, 'err': e})
+        if not reply:
+            self._exited()
+            raise BgpSpeakerProcessError(error)
+        reply = jsonutils.loads(reply)
+        if 'error' in reply:
+            raise BgpSpeakerProcessError(reply['error'])
+        return reply.get('result')
+
+    def _stop(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+    def _exited(self):
+        try:
+            self._stop()
+        except (IOError, OSError):
+            pass
+        if self._on_exit is not None:
+            self._on_exit(self)
+
+    def neighbor_add(self, address, remote_as, password=None,
+                     connect_mode=None, enable_evpn=False):
+        kwargs = {'address': address, 'remote_as': remote_as,
+                  'enable_evpn': enable_evpn}
+        if password is not None:
+            kwargs['password'] = encodeutils.safe_decode(password)
+        if connect_mode is not None:
+            kwargs['connect_mode'] = connect_mode
+        self._call('neighbor_add', **kwargs)
+
+    def neighbor_del(self, address):
+        self._call('neighbor_del', address=address)
+
+    def neighbor_state_get(self, address=None, format='json'):
+        return self._call('neighbor_state_get', address=address,
+                          format=format)
+
+    def prefix_add(self, prefix, next_hop=None):
+        self._call('prefix_add', prefix=prefix, next_hop=next_hop)
+
+    def prefix_del(self, prefix):
+        self._call('prefix_del', prefix=prefix)
+
+    def vrf_add(self, route_dist, import_rts, export_rts,
+                route_family=None):
+        kwargs = {'route_dist': route_dist, 'import_rts': import_rts,
+                  'export_rts': export_rts}
+        if route_family is not None:
+            kwargs['route_family'] = route_family
+        self._call('vrf_add', **kwargs)
+
+    def vrf_del(self, route_dist):
+        self._call('vrf_del', route_dist=route_dist)
+
+    def call_many(self, method, calls):
+        """Call a method with each set of keyword arguments in one go."""
+        self._call('call_many', method=method, calls=calls)
+
+    def shutdown(self):
+        try:
+            self._call('shutdown')
+        finally:
+            self._stop()
+
+
+def _start_speaker(as_number, router_id):
+    from ryu.services.protocols.bgp import bgpspeaker
+
+    from neutron_dynamic_routing.services.bgp.agent.driver.ryu import driver
+
+    return bgpspeaker.BGPSpeaker(
+                        as_number=as_number,
+                        router_id=router_id, bgp_server_port=0,
+                        best_path_change_handler=driver.best_path_change_cb,
+                        peer_down_handler=driver.bgp_peer_down_cb,
+                        peer_up_handler=driver.bgp_peer_up_cb)
+
+
+def _redirect_stdout():
+    """Keep the standard output for the replies to the BGP DrAgent.
+
+    Returns a file writing to the standard output, which is otherwise
+    redirected to the standard error, so that nothing else written by the
+    process can be mistaken for a reply.
+    """
+    sys.stdout.flush()
+    reply_file = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    return reply_file
+
+
+def main():
+    reply_file = _redirect_stdout()
+    import eventlet
+    from eventlet import tpool
+    eventlet.monkey_patch()
+    logging.register_options(cfg.CONF)
+    cfg.CONF(sys.argv[1:], project='neutron')
+    logging.setup(cfg.CONF, 'neutron-bgp-speaker')
+
+    speaker = None
+    while True:
+        # Read the calls from a native thread so that the green threads of
+        # the Ryu BGP core keep running meanwhile.
+        request = tpool.execute(sys.stdin.readline)
+        if not request:
+            break
+        request = jsonutils.loads(request)
+        method = request['method']
+        kwargs = request['kwargs']
+        try:
+            if method == 'start':
+                speaker = _start_speaker(**kwargs)
+                result = None
+            elif method == 'call_many':
+                for call_kwargs in kwargs['calls']:
+                    getattr(speaker, kwargs['method'])(**call_kwargs)
+                result = None
+            else:
+                if kwargs.get('password') is not None:
+                    kwargs['password'] = encodeutils.to_utf8(
+                                                        kwargs['password'])
+                result = getattr(speaker, method)(**kwargs)
+            reply = {'result': result}
+        except Exception as e:
+            reply = {'error': six.text_type(e)}
+        reply_file.write(jsonutils.dumps(reply) + '\n')
+        reply_file.flush()
+        if method == 'shutdown':
+            break
+
+
+if __name__ == '__main__':
+    main()
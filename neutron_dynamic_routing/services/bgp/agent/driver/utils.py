@@ -58,13 +58,18 @@ class BgpMultiSpeakerCache(object):
 
     Version history:
         1.0 - Initial version for caching multiple BGP speaker information.
+        1.1 - Bound the number of BGP speakers to max_speakers.
     """
-    def __init__(self):
+    def __init__(self, max_speakers=1):
         self.cache = {}
+        self.max_speakers = max_speakers
 
     def get_hosted_bgp_speakers_count(self):
         return len(self.cache)
 
+    def is_full(self):
+        return len(self.cache) >= self.max_speakers
+
     def put_bgp_speaker(self, local_as, speaker):
         self.cache[local_as] = speaker
 
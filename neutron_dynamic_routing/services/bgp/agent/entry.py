@@ -32,6 +32,7 @@ def register_options():
     config.register_root_helper(cfg.CONF)
     cfg.CONF.register_opts(bgp_dragent_config.BGP_DRIVER_OPTS, 'BGP')
     cfg.CONF.register_opts(bgp_dragent_config.BGP_PROTO_CONFIG_OPTS, 'BGP')
+    cfg.CONF.register_opts(bgp_dragent_config.BGP_AGENT_OPTS, 'BGP')
     cfg.CONF.register_opts(external_process.OPTS)
 
 
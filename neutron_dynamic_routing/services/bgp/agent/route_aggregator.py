@@ -0,0 +1,305 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+import collections
+
+import netaddr
+
+# Prefixes are handled as (ip_version, first address, prefix length) keys,
+# which sort by address and put a prefix before the prefixes it contains.
+ADDRESS_WIDTHS = {4: 32, 6: 128}
+
+
+def _make_key(destination):
+    net = netaddr.IPNetwork(destination)
+    return (net.version, net.first, net.prefixlen)
+
+
+def _make_destination(key):
+    version, first, prefixlen = key
+    return '%s/%d' % (netaddr.IPAddress(first, version), prefixlen)
+
+
+def _last(key):
+    version, first, prefixlen = key
+    return first + (1 << (ADDRESS_WIDTHS[version] - prefixlen)) - 1
+
+
+def _supernet(key, prefixlen):
+    version, first, _prefixlen = key
+    host_bits = ADDRESS_WIDTHS[version] - prefixlen
+    return (version, first >> host_bits << host_bits, prefixlen)
+
+
+def _sibling(key):
+    version, first, prefixlen = key
+    host_bits = ADDRESS_WIDTHS[version] - prefixlen
+    return (version, first ^ (1 << host_bits), prefixlen)
+
+
+def _contains(key, other):
+    return (key[0] == other[0] and key[2] <= other[2] and
+            _supernet(other, key[2]) == key)
+
+
+def _exclude(key, excluded):
+    """Return the prefixes covering key except the excluded prefix."""
+    pieces = []
+    while key != excluded:
+        version, first, prefixlen = key
+        lower = (version, first, prefixlen + 1)
+        upper = _sibling(lower)
+        if _contains(lower, excluded):
+            pieces.append(upper)
+            key = lower
+        else:
+            pieces.append(lower)
+            key = upper
+    return pieces
+
+
+def _merge(keys):
+    """Return the fewest prefixes covering the same addresses as keys."""
+    merged = []
+    for key in sorted(keys):
+        if merged and _contains(merged[-1], key):
+            continue
+        merged.append(key)
+        while (len(merged) > 1 and merged[-1][2] and
+               _sibling(merged[-1]) == merged[-2]):
+            upper = merged.pop()
+            merged[-1] = _supernet(upper, upper[2] - 1)
+    return merged
+
+
+def _range(index, key):
+    """Return the slice of a sorted index holding the keys within key."""
+    version = key[0]
+    return (bisect.bisect_left(index, key),
+            bisect.bisect_right(index, (version, _last(key),
+                                        ADDRESS_WIDTHS[version])))
+
+
+class RouteAggregator(object):
+    """Summarize the routes of a BGP speaker into fewer prefixes.
+
+    Routes sharing a next hop are merged into the fewest prefixes covering
+    the same addresses, e.g. four floating IP host routes 10.0.0.0/32 to
+    10.0.0.3/32 through one router become 10.0.0.0/30. A route overlapping
+    a route with another next hop is advertised as is, and so is the other
+    route, so that the summary never sends traffic to a different next hop
+    than the routes it replaces.
+
+    The summary is maintained incrementally: a route change only touches the
+    summary prefix covering the route.
+    """
+
+    def __init__(self):
+        # destination -> next hop of the routes
+        self._routes = {}
+        self._keys = {}
+        self._destinations = {}
+        self._route_index = []
+        # (ip_version, prefix length) -> number of routes
+        self._prefixlens = collections.Counter()
+        # destinations of the routes overlapping a route with another next
+        # hop, advertised as is
+        self._verbatim = set()
+        # key -> (destination, next hop) of the merged prefixes
+        self._blocks = {}
+        self._block_index = []
+        # destination -> next hop of the summary
+        self._summary = {}
+        # destination -> next hop in the summary before the current update
+        self._changes = {}
+
+    def get_routes(self):
+        """Return the routes of the summary."""
+        return [{'destination': destination, 'next_hop': next_hop}
+                for destination, next_hop in sorted(self._summary.items())]
+
+    def update(self, routes=(), withdrawn=()):
+        """Apply route changes and return the resulting summary changes.
+
+        :param routes: the routes advertised, or whose next hop changed.
+        :param withdrawn: the destinations of the routes withdrawn.
+        :returns: the destinations withdrawn from the summary and the routes
+                  advertised in the summary.
+        """
+        self._changes = {}
+        for destination in withdrawn:
+            self._remove_route(destination)
+        for route in routes:
+            destination = route['destination']
+            if self._routes.get(destination) != route['next_hop']:
+                self._remove_route(destination)
+                self._add_route(destination, route['next_hop'])
+
+        changes, self._changes = self._changes, {}
+        withdrawn = [destination for destination, next_hop in changes.items()
+                     if next_hop is not None and
+                     destination not in self._summary]
+        advertised = [{'destination': destination,
+                       'next_hop': self._summary[destination]}
+                      for destination, next_hop in changes.items()
+                      if destination in self._summary and
+                      self._summary[destination] != next_hop]
+        return (sorted(withdrawn),
+                sorted(advertised, key=lambda route: route['destination']))
+
+    def _add_route(self, destination, next_hop):
+        key = _make_key(destination)
+        self._routes[destination] = next_hop
+        self._keys[destination] = key
+        self._destinations[key] = destination
+        bisect.insort(self._route_index, key)
+        self._prefixlens[key[0], key[2]] += 1
+
+        conflicts = [other for other in self._get_overlapping_routes(key)
+                     if self._routes[other] != next_hop]
+        if not conflicts:
+            self._merge_route(key, next_hop)
+            return
+        # The conflicting routes are advertised as is once they are all out
+        # of the merged prefixes, which may have the same destinations.
+        unmerged = [other for other in conflicts
+                    if other not in self._verbatim]
+        self._verbatim.add(destination)
+        self._verbatim.update(unmerged)
+        for other in unmerged:
+            self._unmerge_route(self._keys[other], self._routes[other])
+        for other in unmerged + [destination]:
+            self._advertise(other, self._routes[other])
+
+    def _remove_route(self, destination):
+        next_hop = self._routes.pop(destination, None)
+        if next_hop is None:
+            return
+        key = self._keys.pop(destination)
+        del self._destinations[key]
+        del self._route_index[bisect.bisect_left(self._route_index, key)]
+        self._prefixlens[key[0], key[2]] -= 1
+        if not self._prefixlens[key[0], key[2]]:
+            del self._prefixlens[key[0], key[2]]
+
+        if destination not in self._verbatim:
+            self._unmerge_route(key, next_hop)
+            return
+        self._verbatim.remove(destination)
+        self._withdraw(destination)
+        # The routes overlapping it may no longer conflict with any other
+        merged = [other for other in self._get_overlapping_routes(key)
+                  if other in self._verbatim and
+                  not self._has_conflicts(other)]
+        for other in merged:
+            self._verbatim.remove(other)
+            self._withdraw(other)
+        for other in merged:
+            self._merge_route(self._keys[other], self._routes[other])
+
+    def _merge_route(self, key, next_hop):
+        """Add the addresses of a route to the merged prefixes."""
+        if self._get_covering_block(key) is not None:
+            return
+        start, end = _range(self._block_index, key)
+        for block in self._block_index[start:end]:
+            self._remove_block(block)
+        while key[2]:
+            sibling = _sibling(key)
+            if self._blocks.get(sibling, (None, None))[1] != next_hop:
+                break
+            self._remove_block(sibling)
+            key = _supernet(key, key[2] - 1)
+        self._add_block(key, next_hop)
+
+    def _unmerge_route(self, key, next_hop):
+        """Remove the addresses of a route from the merged prefixes.
+
+        The addresses still covered by other routes with the same next hop
+        are kept.
+        """
+        if any(self._is_merged(covering, next_hop)
+               for covering in self._get_covering_routes(key)):
+            return
+        start, end = _range(self._route_index, key)
+        new_blocks = [other for other in self._route_index[start:end]
+                      if other != key and self._is_merged(other, next_hop)]
+        block = self._get_covering_block(key)
+        if block is not None:
+            blocks = [block]
+            new_blocks.extend(_exclude(block, key))
+        else:
+            # The addresses of the route were split among several merged
+            # prefixes by unmerging another conflicting route first.
+            start, end = _range(self._block_index, key)
+            blocks = self._block_index[start:end]
+        for block in blocks:
+            self._remove_block(block)
+        for block in _merge(new_blocks):
+            self._add_block(block, next_hop)
+
+    def _is_merged(self, key, next_hop):
+        destination = self._destinations.get(key)
+        return (destination is not None and
+                destination not in self._verbatim and
+                self._routes[destination] == next_hop)
+
+    def _has_conflicts(self, destination):
+        next_hop = self._routes[destination]
+        return any(self._routes[other] != next_hop
+                   for other in self._get_overlapping_routes(
+                                                    self._keys[destination]))
+
+    def _get_covering_routes(self, key):
+        version, first, prefixlen = key
+        for route_version, route_prefixlen in list(self._prefixlens):
+            if route_version == version and route_prefixlen < prefixlen:
+                covering = _supernet(key, route_prefixlen)
+                if covering in self._destinations:
+                    yield covering
+
+    def _get_overlapping_routes(self, key):
+        start, end = _range(self._route_index, key)
+        overlapping = list(self._get_covering_routes(key))
+        overlapping.extend(other for other in self._route_index[start:end]
+                           if other != key)
+        return [self._destinations[other] for other in overlapping]
+
+    def _get_covering_block(self, key):
+        # The merged prefixes are disjoint, so the one covering key, if
+        # any, is the last one starting before it.
+        i = bisect.bisect_right(self._block_index, key)
+        if i and _contains(self._block_index[i - 1], key):
+            return self._block_index[i - 1]
+
+    def _add_block(self, key, next_hop):
+        destination = (self._destinations.get(key) or
+                       _make_destination(key))
+        self._blocks[key] = (destination, next_hop)
+        bisect.insort(self._block_index, key)
+        self._advertise(destination, next_hop)
+
+    def _remove_block(self, key):
+        destination, next_hop = self._blocks.pop(key)
+        del self._block_index[bisect.bisect_left(self._block_index, key)]
+        self._withdraw(destination)
+
+    def _advertise(self, destination, next_hop):
+        self._changes.setdefault(destination, self._summary.get(destination))
+        self._summary[destination] = next_hop
+
+    def _withdraw(self, destination):
+        self._changes.setdefault(destination, self._summary.get(destination))
+        del self._summary[destination]
@@ -17,6 +17,7 @@ from netaddr import IPAddress
 from neutron_lib import constants as n_const
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_service import loopingcall
 from oslo_utils import importutils
 
 from neutron.callbacks import events
@@ -26,6 +27,7 @@ from neutron.common import rpc as n_rpc
 from neutron import context
 from neutron.services import service_base
 
+from neutron_dynamic_routing._i18n import _, _LI
 from neutron_dynamic_routing.api.rpc.agentnotifiers import bgp_dr_rpc_agent_api  # noqa
 from neutron_dynamic_routing.api.rpc.handlers import bgp_speaker_rpc as bs_rpc
 from neutron_dynamic_routing.db import bgp_db
@@ -34,11 +36,24 @@ from neutron_dynamic_routing.db import bgp_vrf_db
 from neutron_dynamic_routing.extensions import bgp as bgp_ext
 from neutron_dynamic_routing.extensions import bgp_dragentscheduler as dras_ext
 from neutron_dynamic_routing.extensions import vrf as vrf_ext
+from neutron_dynamic_routing.services.bgp import callback_pool
 from neutron_dynamic_routing.services.bgp.common import constants as bgp_consts
+from neutron_dynamic_routing.services.bgp import route_batcher
 
 PLUGIN_NAME = bgp_ext.BGP_EXT_ALIAS + '_svc_plugin'
 LOG = logging.getLogger(__name__)
 
+BGP_PLUGIN_OPTS = [
+    cfg.IntOpt('bgp_stats_report_interval', default=0, min=0,
+               help=_("Seconds between the reports, in the log of each "
+                      "neutron server worker, of the hit and miss counts of "
+                      "the BGP route cache and BGPVRF router index and of "
+                      "the queue of the BGP callback workers. Set to 0 to "
+                      "disable the reports.")),
+]
+
+cfg.CONF.register_opts(BGP_PLUGIN_OPTS)
+
 
 class BgpPlugin(service_base.ServicePluginBase,
                 bgp_db.BgpDbMixin,
@@ -49,12 +64,22 @@ class BgpPlugin(service_base.ServicePluginBase,
                                    vrf_ext.BGPVRF_EXT_ALIAS,
                                    dras_ext.BGP_DRAGENT_SCHEDULER_EXT_ALIAS]
 
+    # The BGP speakers, peers and VRFs are paginated and sorted by the
+    # database
+    __native_pagination_support = True
+    __native_sorting_support = True
+
     def __init__(self):
         super(BgpPlugin, self).__init__()
         self.bgp_drscheduler = importutils.import_object(
             cfg.CONF.bgp_drscheduler_driver)
+        self._route_batcher = route_batcher.RouteNotificationBatcher(
+                                                self._notify_route_changes)
+        self._callback_pool = callback_pool.CallbackWorkerPool()
         self._setup_rpc()
         self._register_callbacks()
+        self.add_periodic_dragent_status_check()
+        self.add_periodic_stats_report()
 
     def get_plugin_name(self):
         return PLUGIN_NAME
@@ -98,6 +123,12 @@ class BgpPlugin(service_base.ServicePluginBase,
         registry.subscribe(self.router_gateway_callback,
                            resources.ROUTER_GATEWAY,
                            events.AFTER_DELETE)
+        registry.subscribe(self.agent_callback,
+                           resources.AGENT,
+                           events.AFTER_UPDATE)
+        registry.subscribe(self.agent_callback,
+                           resources.AGENT,
+                           events.BEFORE_DELETE)
 
     def get_bgp_speakers(self, context, filters=None, fields=None,
                          sorts=None, limit=None, marker=None,
@@ -158,7 +189,19 @@ class BgpPlugin(service_base.ServicePluginBase,
                                                       bgp_peer)
 
     def delete_bgp_peer(self, context, bgp_peer_id):
+        bgp_peer = self.get_bgp_peer(context, bgp_peer_id)
+        bgp_speaker_ids = self._get_bgp_speaker_ids_by_bgp_peer(context,
+                                                                bgp_peer_id)
+        hosted_bgp_dragents = self.get_dragents_by_bgp_speaker(
+                                                             context,
+                                                             bgp_speaker_ids)
         super(BgpPlugin, self).delete_bgp_peer(context, bgp_peer_id)
+        for bgp_speaker_id, agents in hosted_bgp_dragents.items():
+            for agent in agents:
+                self._bgp_rpc.bgp_peer_disassociated(context,
+                                                     bgp_speaker_id,
+                                                     bgp_peer['peer_ip'],
+                                                     agent.host)
 
     def add_bgp_peer(self, context, bgp_speaker_id, bgp_peer_info):
         ret_value = super(BgpPlugin, self).add_bgp_peer(context,
@@ -216,14 +259,111 @@ class BgpPlugin(service_base.ServicePluginBase,
                                                              bgp_speaker_id,
                                                              network_info)
 
-    def get_advertised_routes(self, context, bgp_speaker_id):
+    def get_advertised_routes(self, context, bgp_speaker_id, page_info=None):
         return super(BgpPlugin, self).get_advertised_routes(context,
-                                                            bgp_speaker_id)
+                                                            bgp_speaker_id,
+                                                            page_info)
+
+    def update_vrf(self, context, id, vrf):
+        ret_value = super(BgpPlugin, self).update_vrf(context, id, vrf)
+        self._notify_vrf_changes(
+                context, self._get_bgp_speaker_ids_by_vrf_ids(context, [id]))
+        return ret_value
+
+    def delete_vrf(self, context, id):
+        bgp_speaker_ids = self._get_bgp_speaker_ids_by_vrf_ids(context, [id])
+        ret_value = super(BgpPlugin, self).delete_vrf(context, id)
+        self._notify_vrf_changes(context, bgp_speaker_ids)
+        return ret_value
+
+    def add_vrf_router_assoc(self, context, vrf_id, router_association):
+        ret_value = super(BgpPlugin, self).add_vrf_router_assoc(
+                                                        context, vrf_id,
+                                                        router_association)
+        self._notify_vrf_changes(
+            context, self._get_bgp_speaker_ids_by_vrf_ids(context, [vrf_id]))
+        return ret_value
+
+    def remove_vrf_router_assoc(self, context, vrf_id, router_association):
+        ret_value = super(BgpPlugin, self).remove_vrf_router_assoc(
+                                                        context, vrf_id,
+                                                        router_association)
+        self._notify_vrf_changes(
+            context, self._get_bgp_speaker_ids_by_vrf_ids(context, [vrf_id]))
+        return ret_value
+
+    def add_vrf_speaker_assoc(self, context, vrf_id, speaker_association):
+        ret_value = super(BgpPlugin, self).add_vrf_speaker_assoc(
+                                                        context, vrf_id,
+                                                        speaker_association)
+        self._notify_vrf_changes(context, [ret_value['speaker_id']])
+        return ret_value
+
+    def remove_vrf_speaker_assoc(self, context, vrf_id, speaker_association):
+        ret_value = super(BgpPlugin, self).remove_vrf_speaker_assoc(
+                                                        context, vrf_id,
+                                                        speaker_association)
+        self._notify_vrf_changes(context, [ret_value['speaker_id']])
+        return ret_value
+
+    def _notify_vrf_changes(self, context, bgp_speaker_ids):
+        """Version a change to the VRFs of BgpSpeakers and tell the agents.
+
+        The change is recorded after it is made, so that a BgpDrAgent
+        syncing in between still fetches the VRFs with its next delta.
+        """
+        if not bgp_speaker_ids:
+            return
+        self._bump_bgp_speaker_vrf_generations(context, bgp_speaker_ids)
+        hosts = self.get_dragent_hosts_by_bgp_speaker(context,
+                                                      bgp_speaker_ids)
+        for bgp_speaker_id in bgp_speaker_ids:
+            for host in hosts.get(bgp_speaker_id, []):
+                self._bgp_rpc.bgp_speaker_vrfs_updated(context,
+                                                       bgp_speaker_id,
+                                                       host)
+
+    def _notify_router_vrf_changes(self, context, router_id):
+        self._notify_vrf_changes(
+            context, self._get_bgp_speaker_ids_by_router_vrfs(context,
+                                                              router_id))
+
+    def _submit_callback(self, key, func, *args, **kwargs):
+        # The work items outlive the API request, so they must not hold on
+        # to its context.
+        kwargs.pop('context', None)
+        self._callback_pool.submit(key, func, *args, **kwargs)
+
+    def get_callback_pool_stats(self):
+        """Return the queue and work item counts of the callback pool."""
+        return self._callback_pool.get_stats()
+
+    def get_bgp_stats(self):
+        """Return the counters of the caches and callback pool."""
+        return {'route_cache': self.get_bgp_route_cache_stats(),
+                'router_vrf_index': self.get_router_vrf_index_stats(),
+                'callback_pool': self.get_callback_pool_stats()}
+
+    def add_periodic_stats_report(self):
+        interval = cfg.CONF.bgp_stats_report_interval
+        if not interval:
+            return
+        self._stats_report = loopingcall.FixedIntervalLoopingCall(
+                                                        self._report_stats)
+        self._stats_report.start(interval=interval, initial_delay=interval)
+
+    def _report_stats(self):
+        LOG.info(_LI("BGP route cache: %(route_cache)s, BGPVRF router index: "
+                     "%(router_vrf_index)s, BGP callback pool: "
+                     "%(callback_pool)s"), self.get_bgp_stats())
 
     def floatingip_update_callback(self, resource, event, trigger, **kwargs):
         if event != events.AFTER_UPDATE:
             return
+        self._submit_callback(kwargs['floating_ip_address'],
+                              self._process_floatingip_update, **kwargs)
 
+    def _process_floatingip_update(self, **kwargs):
         ctx = context.get_admin_context()
         new_router_id = kwargs['router_id']
         last_router_id = kwargs['last_known_router_id']
@@ -234,19 +374,61 @@ class BgpPlugin(service_base.ServicePluginBase,
             kwargs['floating_network_id'],
             n_const.IP_VERSION_4)
 
-        if last_router_id and new_router_id != last_router_id:
-            for bgp_speaker in bgp_speakers:
-                self.stop_route_advertisements(ctx, self._bgp_rpc,
-                                               bgp_speaker.id, [dest])
-
-        if next_hop and new_router_id != last_router_id:
-            new_host_route = {'destination': dest, 'next_hop': next_hop}
-            for bgp_speaker in bgp_speakers:
-                self.start_route_advertisements(ctx, self._bgp_rpc,
-                                                bgp_speaker.id,
-                                                [new_host_route])
+        if new_router_id == last_router_id:
+            return
+        new_host_route = {'destination': dest, 'next_hop': next_hop}
+        for bgp_speaker in bgp_speakers:
+            withdraw = bool(last_router_id)
+            advertise = bool(
+                next_hop and bgp_speaker.advertise_floating_ip_host_routes)
+            if not (withdraw or advertise):
+                continue
+            # The withdrawal and advertisement of the moved floating IP are
+            # recorded at the same generation, so that the row of the
+            # BgpSpeaker is only locked once, and notified once committed.
+            with ctx.session.begin(subtransactions=True):
+                generation = self._bump_bgp_speaker_generation(
+                                                            ctx,
+                                                            bgp_speaker.id)
+                if withdraw:
+                    self._remove_bgp_speaker_routes(ctx, bgp_speaker.id,
+                                                    [dest],
+                                                    generation=generation)
+                if advertise:
+                    new_destinations = self._save_bgp_speaker_routes(
+                                                    ctx, bgp_speaker.id,
+                                                    [new_host_route],
+                                                    generation=generation)
+            if withdraw:
+                self._queue_route_withdrawals(ctx, self._bgp_rpc,
+                                              bgp_speaker.id, [dest])
+            if advertise:
+                self._queue_route_advertisements(ctx, self._bgp_rpc,
+                                                 bgp_speaker.id,
+                                                 [new_host_route],
+                                                 new_destinations)
+
+    def agent_callback(self, resource, event, trigger, **kwargs):
+        # The bindings of a deleted BgpDrAgent are deleted with it, only its
+        # cached host has to be dropped.
+        agent = kwargs.get('agent') or {}
+        if agent.get('agent_type') != bgp_consts.AGENT_TYPE_BGP_ROUTING:
+            return
+        self.invalidate_dragent_hosts(host=agent.get('host'))
 
     def router_interface_callback(self, resource, event, trigger, **kwargs):
+        if event in (events.AFTER_CREATE, events.AFTER_DELETE):
+            self._submit_callback(kwargs.get('router_id'),
+                                  self._process_router_interface_event,
+                                  event, **kwargs)
+
+    def _process_router_interface_event(self, event, **kwargs):
+        # The EVPN routes of the VRFs of the router follow its subnets
+        router_id = (kwargs.get('router_id') or
+                     (kwargs.get('port') or {}).get('device_id'))
+        if router_id:
+            self._notify_router_vrf_changes(context.get_admin_context(),
+                                            router_id)
         if event == events.AFTER_CREATE:
             self._handle_router_interface_after_create(**kwargs)
         if event == events.AFTER_DELETE:
@@ -274,6 +456,8 @@ class BgpPlugin(service_base.ServicePluginBase,
                                                     kwargs['gateway_ips'])
 
             for speaker in speakers:
+                if not speaker.advertise_tenant_networks:
+                    continue
                 prefixes = self._tenant_prefixes_by_router(
                                                       ctx,
                                                       kwargs['router_id'],
@@ -288,6 +472,12 @@ class BgpPlugin(service_base.ServicePluginBase,
                                                     rl)
 
     def router_gateway_callback(self, resource, event, trigger, **kwargs):
+        if event in (events.AFTER_CREATE, events.AFTER_DELETE):
+            self._submit_callback(kwargs.get('router_id'),
+                                  self._process_router_gateway_event,
+                                  event, **kwargs)
+
+    def _process_router_gateway_event(self, event, **kwargs):
         if event == events.AFTER_CREATE:
             self._handle_router_gateway_after_create(**kwargs)
         if event == events.AFTER_DELETE:
@@ -318,6 +508,8 @@ class BgpPlugin(service_base.ServicePluginBase,
             next_hops = self._next_hops_from_gateway_ips(kwargs['gw_ips'])
 
             for speaker in speakers:
+                if not speaker.advertise_tenant_networks:
+                    continue
                 if speaker.ip_version in next_hops:
                     next_hop = next_hops[speaker.ip_version]
                     prefixes = self._tenant_prefixes_by_router(ctx,
@@ -344,28 +536,48 @@ class BgpPlugin(service_base.ServicePluginBase,
 
     def start_route_advertisements(self, ctx, bgp_rpc,
                                    bgp_speaker_id, routes):
-        agents = self.list_dragent_hosting_bgp_speaker(ctx, bgp_speaker_id)
-        for agent in agents['agents']:
-            bgp_rpc.bgp_routes_advertisement(ctx,
-                                             bgp_speaker_id,
-                                             routes,
-                                             agent['host'])
+        new_destinations = self._save_bgp_speaker_routes(ctx,
+                                                         bgp_speaker_id,
+                                                         routes)
+        self._queue_route_advertisements(ctx, bgp_rpc, bgp_speaker_id,
+                                         routes, new_destinations)
+
+    def stop_route_advertisements(self, ctx, bgp_rpc,
+                                  bgp_speaker_id, routes):
+        self._remove_bgp_speaker_routes(ctx, bgp_speaker_id, routes)
+        self._queue_route_withdrawals(ctx, bgp_rpc, bgp_speaker_id, routes)
+
+    def _queue_route_advertisements(self, ctx, bgp_rpc, bgp_speaker_id,
+                                    routes, new_destinations):
+        self._route_batcher.advertise_routes(
+                                    ctx, bgp_rpc, bgp_speaker_id, routes,
+                                    new_destinations=new_destinations)
 
         msg = "Starting route advertisements for %s on BgpSpeaker %s"
         self._debug_log_for_routes(msg, routes, bgp_speaker_id)
 
-    def stop_route_advertisements(self, ctx, bgp_rpc,
-                                  bgp_speaker_id, routes):
-        agents = self.list_dragent_hosting_bgp_speaker(ctx, bgp_speaker_id)
-        for agent in agents['agents']:
-            bgp_rpc.bgp_routes_withdrawal(ctx,
-                                          bgp_speaker_id,
-                                          routes,
-                                          agent['host'])
+    def _queue_route_withdrawals(self, ctx, bgp_rpc, bgp_speaker_id, routes):
+        self._route_batcher.withdraw_routes(ctx, bgp_rpc,
+                                            bgp_speaker_id, routes)
 
         msg = "Stopping route advertisements for %s on BgpSpeaker %s"
         self._debug_log_for_routes(msg, routes, bgp_speaker_id)
 
+    def _notify_route_changes(self, ctx, bgp_rpc, bgp_speaker_id,
+                              advertised_routes, withdrawn_routes):
+        hosts = self.get_dragent_hosts_by_bgp_speaker(ctx, [bgp_speaker_id])
+        for host in hosts[bgp_speaker_id]:
+            if withdrawn_routes:
+                bgp_rpc.bgp_routes_withdrawal(ctx,
+                                              bgp_speaker_id,
+                                              withdrawn_routes,
+                                              host)
+            if advertised_routes:
+                bgp_rpc.bgp_routes_advertisement(ctx,
+                                                 bgp_speaker_id,
+                                                 advertised_routes,
+                                                 host)
+
     def _debug_log_for_routes(self, msg, routes, bgp_speaker_id):
 
         # Could have a large number of routes passed, check log level first
@@ -0,0 +1,112 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+from eventlet import queue
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from neutron_dynamic_routing._i18n import _, _LE
+
+LOG = logging.getLogger(__name__)
+
+BGP_CALLBACK_POOL_OPTS = [
+    cfg.IntOpt('bgp_callback_workers', default=4, min=0,
+               help=_("Number of green threads processing the BGP work "
+                      "triggered by floating IP and router updates, after "
+                      "the API requests which triggered it have returned. "
+                      "Set to 0 to process it within the API requests.")),
+    cfg.IntOpt('bgp_callback_queue_size', default=1000, min=1,
+               help=_("Maximum number of pending BGP work items per "
+                      "worker. API requests queuing work for a full worker "
+                      "wait for it to catch up.")),
+]
+
+cfg.CONF.register_opts(BGP_CALLBACK_POOL_OPTS)
+
+
+class CallbackWorkerPool(object):
+    """Process registry callbacks of the BGP plugin in green threads.
+
+    Each work item is queued for the worker picked by hashing its key, so
+    that the items sharing a key are processed one at a time, in the order
+    they were submitted. Submitting to a full queue blocks until the worker
+    catches up, which throttles the API requests producing the work.
+
+    With no workers, the items are processed synchronously by submit.
+    """
+
+    def __init__(self, workers=None, queue_size=None):
+        """Initialize the pool.
+
+        :param workers: number of green threads. Defaults to
+                        bgp_callback_workers.
+        :param queue_size: maximum number of pending items per worker.
+                           Defaults to bgp_callback_queue_size.
+        """
+        if workers is None:
+            workers = cfg.CONF.bgp_callback_workers
+        if queue_size is None:
+            queue_size = cfg.CONF.bgp_callback_queue_size
+        self.workers = workers
+        self.queue_size = queue_size
+        self.processed = 0
+        self.failed = 0
+        self.throttled = 0
+        self.max_queued = 0
+        self._queues = []
+
+    def submit(self, key, func, *args, **kwargs):
+        if self.workers <= 0:
+            func(*args, **kwargs)
+            self.processed += 1
+            return
+
+        if not self._queues:
+            self._start()
+        work_queue = self._queues[hash(key) % self.workers]
+        if work_queue.full():
+            self.throttled += 1
+        work_queue.put((func, args, kwargs))
+        self.max_queued = max(self.max_queued, self.get_queued())
+
+    def _start(self):
+        # The workers are only spawned once there is work for them.
+        for i in range(self.workers):
+            work_queue = queue.LightQueue(self.queue_size)
+            self._queues.append(work_queue)
+            eventlet.spawn_n(self._run, work_queue)
+
+    def _run(self, work_queue):
+        while True:
+            func, args, kwargs = work_queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                self.failed += 1
+                LOG.exception(_LE("Failed to process BGP work item %s"),
+                              getattr(func, '__name__', func))
+            else:
+                self.processed += 1
+
+    def get_queued(self):
+        return sum(work_queue.qsize() for work_queue in self._queues)
+
+    def get_stats(self):
+        return {'workers': self.workers,
+                'queued': self.get_queued(),
+                'max_queued': self.max_queued,
+                'processed': self.processed,
+                'failed': self.failed,
+                'throttled': self.throttled}
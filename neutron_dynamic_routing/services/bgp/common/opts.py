@@ -25,6 +25,8 @@ def list_bgp_agent_opts():
              neutron_dynamic_routing.services.bgp.agent.
              config.BGP_DRIVER_OPTS,
              neutron_dynamic_routing.services.bgp.agent.
-             config.BGP_PROTO_CONFIG_OPTS)
+             config.BGP_PROTO_CONFIG_OPTS,
+             neutron_dynamic_routing.services.bgp.agent.
+             config.BGP_AGENT_OPTS)
          )
     ]
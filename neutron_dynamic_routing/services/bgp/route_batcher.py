@@ -0,0 +1,140 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+
+import eventlet
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from neutron_dynamic_routing._i18n import _, _LE
+
+LOG = logging.getLogger(__name__)
+
+BGP_ROUTE_BATCHER_OPTS = [
+    cfg.FloatOpt('bgp_route_notification_interval', default=0.5, min=0,
+                 help=_("Seconds during which route advertisements and "
+                        "withdrawals of a BGP speaker are accumulated "
+                        "before being sent to the BGP DRAgents hosting it. "
+                        "Set to 0 to notify the agents immediately.")),
+]
+
+cfg.CONF.register_opts(BGP_ROUTE_BATCHER_OPTS)
+
+
+class _PendingRouteChanges(object):
+
+    def __init__(self, context, bgp_rpc):
+        self.context = context
+        self.bgp_rpc = bgp_rpc
+        self.advertisements = collections.OrderedDict()
+        self.withdrawals = collections.OrderedDict()
+        # Destinations first advertised within the window
+        self.new_destinations = set()
+
+    def advertise(self, route, new=False):
+        destination = route['destination']
+        if new and destination not in self.withdrawals:
+            self.new_destinations.add(destination)
+        self.advertisements[destination] = route
+
+    def withdraw(self, route):
+        destination = route['destination']
+        self.advertisements.pop(destination, None)
+        # The agents only know of a route advertised before the window, so
+        # only the withdrawal of a route new within the window is dropped.
+        if destination in self.new_destinations:
+            self.new_destinations.discard(destination)
+        else:
+            self.withdrawals[destination] = route
+
+
+class RouteNotificationBatcher(object):
+    """Coalesce route notifications to BgpDrAgents per BGP speaker.
+
+    Route advertisements and withdrawals queued for a BGP speaker within
+    the configured interval are sent to each hosting BgpDrAgent as at most
+    one withdrawal and one advertisement cast, withdrawals first. A route
+    first advertised and then withdrawn within the interval is not sent at
+    all, whereas a route already known to the agents is withdrawn.
+
+    The routes are recorded in the database before being queued, so that
+    notifications lost here are repaired by the next resync of the agents.
+    """
+
+    def __init__(self, notify, interval=None):
+        """Initialize the batcher.
+
+        :param notify: callable invoked with the context, the notifier, the
+                       BGP speaker ID and the lists of routes to advertise
+                       and to withdraw.
+        :param interval: seconds during which notifications are accumulated.
+                         Defaults to bgp_route_notification_interval.
+        """
+        self.notify = notify
+        if interval is None:
+            interval = cfg.CONF.bgp_route_notification_interval
+        self.interval = interval
+        self._pending = {}
+
+    def advertise_routes(self, context, bgp_rpc, bgp_speaker_id, routes,
+                         new_destinations=None):
+        """Queue the advertisement of routes.
+
+        :param new_destinations: destinations of the routes which were not
+                                 advertised by the BGP speaker before. Only
+                                 their withdrawal within the interval can
+                                 be dropped.
+        """
+        new_destinations = new_destinations or set()
+        pending = self._get_pending(context, bgp_rpc, bgp_speaker_id)
+        for route in routes:
+            pending.advertise(route,
+                              new=route['destination'] in new_destinations)
+        self._schedule_flush(bgp_speaker_id)
+
+    def withdraw_routes(self, context, bgp_rpc, bgp_speaker_id, routes):
+        """Queue the withdrawal of routes given as dicts or destinations."""
+        pending = self._get_pending(context, bgp_rpc, bgp_speaker_id)
+        for route in routes:
+            if not isinstance(route, dict):
+                route = {'destination': route}
+            pending.withdraw(route)
+        self._schedule_flush(bgp_speaker_id)
+
+    def _get_pending(self, context, bgp_rpc, bgp_speaker_id):
+        pending = self._pending.get(bgp_speaker_id)
+        if pending is None:
+            pending = _PendingRouteChanges(context, bgp_rpc)
+            self._pending[bgp_speaker_id] = pending
+            if self.interval > 0:
+                eventlet.spawn_after(self.interval, self.flush,
+                                     bgp_speaker_id)
+        return pending
+
+    def _schedule_flush(self, bgp_speaker_id):
+        if self.interval <= 0:
+            self.flush(bgp_speaker_id)
+
+    def flush(self, bgp_speaker_id):
+        pending = self._pending.pop(bgp_speaker_id, None)
+        if not pending or not (pending.advertisements or pending.withdrawals):
+            return
+        try:
+            self.notify(pending.context, pending.bgp_rpc, bgp_speaker_id,
+                        list(pending.advertisements.values()),
+                        list(pending.withdrawals.values()))
+        except Exception:
+            LOG.exception(_LE("Failed to notify route changes of BGP "
+                              "speaker %s"), bgp_speaker_id)
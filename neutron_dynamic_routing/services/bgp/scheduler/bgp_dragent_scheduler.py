@@ -13,8 +13,12 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+
+from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_log import log as logging
+from sqlalchemy import func
 from sqlalchemy.orm import exc
 from sqlalchemy import sql
 
@@ -28,7 +32,6 @@ from neutron_dynamic_routing.db import bgp_dragentscheduler_db as bgp_dras_db
 from neutron_dynamic_routing.services.bgp.common import constants as bgp_consts
 
 LOG = logging.getLogger(__name__)
-BGP_SPEAKER_PER_DRAGENT = 1
 
 
 class BgpDrAgentFilter(base_resource_filter.BaseResourceFilter):
@@ -88,11 +91,14 @@ class BgpDrAgentFilter(base_resource_filter.BaseResourceFilter):
            the given BgpSpeaker and a list of BgpDrAgents which can host the
            given BgpSpeaker
         """
-        # only one BgpSpeaker can be hosted by a BgpDrAgent for now.
-        dragents_per_bgp_speaker = BGP_SPEAKER_PER_DRAGENT
+        dragents_per_bgp_speaker = cfg.CONF.dragents_per_bgp_speaker
         dragent_bindings = plugin.get_dragent_bgp_speaker_bindings(context)
         agents_hosting = [dragent_binding.agent_id
-                          for dragent_binding in dragent_bindings]
+                          for dragent_binding in dragent_bindings
+                          if dragent_binding.bgp_speaker_id ==
+                          bgp_speaker['id']]
+        num_bgp_speakers_hosted = collections.Counter(
+            dragent_binding.agent_id for dragent_binding in dragent_bindings)
 
         num_dragents_hosting_bgp_speaker = (
             self._get_num_dragents_hosting_bgp_speaker(bgp_speaker['id'],
@@ -106,8 +112,10 @@ class BgpDrAgentFilter(base_resource_filter.BaseResourceFilter):
         active_dragents = self._get_active_dragents(plugin, context)
         hostable_dragents = [
             agent for agent in set(active_dragents)
-            if agent.id not in agents_hosting and plugin.is_eligible_agent(
-                active=True, agent=agent)
+            if agent.id not in agents_hosting and
+            num_bgp_speakers_hosted[agent.id] <
+            bgp_dras_db.get_max_bgp_speakers(agent) and
+            plugin.is_eligible_agent(active=True, agent=agent)
         ]
         if not hostable_dragents:
             return {'n_agents': 0,
@@ -144,37 +152,48 @@ class BgpDrAgentSchedulerBase(BgpDrAgentFilter):
                 LOG.warning(_LW('BgpDrAgent %s is down'), bgp_dragent.id)
                 return False
 
-            if self._is_bgp_speaker_hosted(context, bgp_dragent['id']):
-                # One BgpDrAgent can only host one BGP speaker
-                LOG.debug('BgpDrAgent already hosting a speaker on host %s. '
-                          'Cannot schedule an another one', host)
+            num_bgp_speakers = (
+                bgp_dras_db.get_max_bgp_speakers(bgp_dragent) -
+                self._get_num_bgp_speakers_hosted(context, bgp_dragent['id']))
+            if num_bgp_speakers <= 0:
+                LOG.debug('BgpDrAgent on host %s already hosts its maximum '
+                          'number of BGP speakers. Cannot schedule another '
+                          'one', host)
                 return False
 
-            unscheduled_speakers = self._get_unscheduled_bgp_speakers(context)
+            unscheduled_speakers = self._get_unscheduled_bgp_speakers(
+                                                    context, bgp_dragent.id)
             if not unscheduled_speakers:
                 LOG.debug('Nothing to auto-schedule on host %s', host)
                 return False
 
-            self.bind(context, [bgp_dragent], unscheduled_speakers[0])
+            for bgp_speaker_id in unscheduled_speakers[:num_bgp_speakers]:
+                self.bind(context, [bgp_dragent], bgp_speaker_id)
         return True
 
-    def _is_bgp_speaker_hosted(self, context, agent_id):
+    def _get_num_bgp_speakers_hosted(self, context, agent_id):
         speaker_binding_model = bgp_dras_db.BgpSpeakerDrAgentBinding
 
         query = context.session.query(speaker_binding_model)
         query = query.filter(speaker_binding_model.agent_id == agent_id)
 
-        return query.count() > 0
+        return query.count()
 
-    def _get_unscheduled_bgp_speakers(self, context):
+    def _get_unscheduled_bgp_speakers(self, context, agent_id):
         """BGP speakers that needs to be scheduled.
-        """
 
-        no_agent_binding = ~sql.exists().where(
-            bgp_db.BgpSpeaker.id ==
-            bgp_dras_db.BgpSpeakerDrAgentBinding.bgp_speaker_id)
+        These are the BGP speakers hosted by fewer than
+        dragents_per_bgp_speaker BgpDrAgents, none of them being agent_id.
+        """
+        binding_model = bgp_dras_db.BgpSpeakerDrAgentBinding
+        num_dragents = sql.select([func.count(binding_model.agent_id)]).where(
+            binding_model.bgp_speaker_id == bgp_db.BgpSpeaker.id).as_scalar()
+        hosted_by_agent = sql.exists().where(sql.and_(
+            binding_model.bgp_speaker_id == bgp_db.BgpSpeaker.id,
+            binding_model.agent_id == agent_id))
         query = context.session.query(bgp_db.BgpSpeaker.id).filter(
-            no_agent_binding)
+            num_dragents < cfg.CONF.dragents_per_bgp_speaker,
+            ~hosted_by_agent)
         return [bgp_speaker_id_[0] for bgp_speaker_id_ in query]
 
 
@@ -190,3 +209,69 @@ class WeightScheduler(base_scheduler.BaseWeightScheduler,
 
     def __init__(self):
         super(WeightScheduler, self).__init__(self)
+
+
+class LoadScheduler(base_scheduler.BaseWeightScheduler,
+                    BgpDrAgentSchedulerBase):
+    """Schedule BgpSpeakers to the least loaded BgpDrAgents.
+
+    The load of a BgpDrAgent is the number of routes it advertises, then the
+    number of BGP peers and of BgpSpeakers it hosts. Each count is the
+    larger of the one reported by the BgpDrAgent in its state and the one
+    derived from the BgpSpeakers bound to it, so that BgpSpeakers which the
+    BgpDrAgent has not synced yet are accounted for.
+    """
+
+    LOAD_KEYS = ('advertise_routes', 'bgp_peers', 'bgp_speakers')
+
+    def __init__(self):
+        super(LoadScheduler, self).__init__(self)
+
+    def select(self, plugin, context, resource_hostable_agents,
+               resource_hosted_agents, num_agents_needed):
+        loads = self._get_dragent_loads(plugin, context,
+                                        resource_hostable_agents)
+        chosen_agents = sorted(resource_hostable_agents,
+                               key=lambda agent: loads[agent.id])
+        return chosen_agents[:num_agents_needed]
+
+    def _get_dragent_loads(self, plugin, context, agents):
+        """Return the load of each BgpDrAgent, by agent ID."""
+        agent_ids = [agent.id for agent in agents]
+        bound_loads = self._get_bound_loads(context, agent_ids)
+        loads = {}
+        for agent in agents:
+            reported = plugin.get_configuration_dict(agent)
+            bound = bound_loads.get(agent.id, {})
+            loads[agent.id] = tuple(max(reported.get(key) or 0,
+                                        bound.get(key, 0))
+                                    for key in self.LOAD_KEYS)
+        return loads
+
+    def _get_bound_loads(self, context, agent_ids):
+        """Count the routes, peers and BgpSpeakers bound to BgpDrAgents."""
+        if not agent_ids:
+            return {}
+        binding = bgp_dras_db.BgpSpeakerDrAgentBinding
+        counted_models = {
+            'advertise_routes': (bgp_db.BgpSpeakerRoute,
+                                 bgp_db.BgpSpeakerRoute.bgp_speaker_id),
+            'bgp_peers': (bgp_db.BgpSpeakerPeerBinding,
+                          bgp_db.BgpSpeakerPeerBinding.bgp_speaker_id)}
+        loads = {}
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(binding.agent_id,
+                                          func.count(binding.bgp_speaker_id))
+            query = query.filter(binding.agent_id.in_(agent_ids))
+            for agent_id, count in query.group_by(binding.agent_id):
+                loads.setdefault(agent_id, {})['bgp_speakers'] = count
+            for key, (model, bgp_speaker_id) in counted_models.items():
+                query = context.session.query(binding.agent_id,
+                                              func.count())
+                query = query.join(
+                            model,
+                            bgp_speaker_id == binding.bgp_speaker_id)
+                query = query.filter(binding.agent_id.in_(agent_ids))
+                for agent_id, count in query.group_by(binding.agent_id):
+                    loads.setdefault(agent_id, {})[key] = count
+        return loads
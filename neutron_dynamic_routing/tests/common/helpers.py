@@ -18,20 +18,20 @@ from neutron.tests.common import helpers
 from neutron_dynamic_routing.services.bgp.common import constants as bgp_const
 
 
-def _get_bgp_dragent_dict(host):
+def _get_bgp_dragent_dict(host, configurations=None):
     agent = {
         'binary': 'neutron-bgp-dragent',
         'host': host,
         'topic': 'q-bgp_dragent',
         'agent_type': bgp_const.AGENT_TYPE_BGP_ROUTING,
-        'configurations': {'bgp_speakers': 1}}
+        'configurations': configurations or {'bgp_speakers': 1}}
     return agent
 
 
 def register_bgp_dragent(host=helpers.HOST, admin_state_up=True,
-                        alive=True):
+                        alive=True, configurations=None):
     agent = helpers._register_agent(
-        _get_bgp_dragent_dict(host))
+        _get_bgp_dragent_dict(host, configurations))
 
     if not admin_state_up:
         helpers.set_agent_admin_state(agent['id'])
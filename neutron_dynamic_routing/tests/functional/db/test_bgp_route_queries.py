@@ -0,0 +1,287 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmarks of the route queries of the BGP service plugin.
+
+Each scenario generates a synthetic topology of routers, tenant subnets in a
+shared address scope and floating IPs behind a single gateway network, then
+times the route queries of bgp_db against it. The tests run against SQLite,
+and against MySQL and PostgreSQL when an opportunistic database is available.
+
+The topology is scaled by the BGP_BENCHMARK_SCALE environment variable, and
+each query is run BGP_BENCHMARK_REPEAT times. The timings are attached to
+the test results as JSON, and appended to the file named by the
+BGP_BENCHMARK_RESULTS environment variable when it is set.
+"""
+
+import os
+import timeit
+
+from neutron_lib import constants as n_const
+from oslo_serialization import jsonutils
+from oslo_utils import uuidutils
+from testtools import content
+import testscenarios
+
+from neutron.extensions import external_net
+from neutron.extensions import portbindings
+from neutron import manager
+from neutron.plugins.common import constants as p_const
+from neutron.tests.unit.plugins.ml2 import test_plugin
+from neutron.tests.unit import testlib_api
+
+from neutron_dynamic_routing.services.bgp import bgp_plugin
+from neutron_dynamic_routing.tests.unit.db import test_bgp_db
+
+# Required to generate tests from scenarios. Not compatible with nose.
+load_tests = testscenarios.load_tests_apply_scenarios
+
+_uuid = uuidutils.generate_uuid
+
+GW_PREFIX = '172.16.0.0/16'
+TENANT_PREFIX = '10.0.0.0/8'
+COMPUTE_HOSTS = 4
+
+
+class RouteQueryBenchmarkMixin(test_bgp_db.BgpEntityCreationMixin):
+    """Time the bgp_db route queries against a synthetic topology.
+
+        Below is the brief description of the scenario variables
+        --------------------------------------------------------
+        router_count
+            number of routers with a gateway on the BGP gateway network.
+
+        subnet_count
+            number of tenant subnets of the address scope attached to each
+            router.
+
+        fip_count
+            number of floating IPs, spread over the routers.
+
+        distributed
+            whether the routers are DVR routers, in which case the floating
+            IPs are advertised through the FIP agent gateway of their host.
+    """
+
+    fmt = 'json'
+
+    scenarios = [
+        ('Centralized routers',
+         dict(router_count=4,
+              subnet_count=2,
+              fip_count=16,
+              distributed=False)),
+
+        ('Distributed routers',
+         dict(router_count=4,
+              subnet_count=2,
+              fip_count=16,
+              distributed=True)),
+    ]
+
+    def setup_parent(self):
+        self.l3_plugin = ('neutron_dynamic_routing.tests.unit.db.test_bgp_db.'
+                          'TestL3Plugin')
+        super(RouteQueryBenchmarkMixin, self).setup_parent()
+
+    def setUp(self):
+        super(RouteQueryBenchmarkMixin, self).setUp()
+        self.l3plugin = manager.NeutronManager.get_service_plugins().get(
+            p_const.L3_ROUTER_NAT)
+        self.bgp_plugin = bgp_plugin.BgpPlugin()
+        self.plugin = manager.NeutronManager.get_plugin()
+        self.tenant_id = _uuid()
+        scale = int(os.environ.get('BGP_BENCHMARK_SCALE', 1))
+        self.repeat = int(os.environ.get('BGP_BENCHMARK_REPEAT', 3))
+        self.router_count *= scale
+        self.fip_count *= scale
+
+    def _create_topology(self):
+        """Create the routers, tenant subnets and floating IPs."""
+        scope_data = {'tenant_id': self.tenant_id, 'ip_version': 4,
+                      'shared': True, 'name': 'bgp-scope'}
+        scope = self.plugin.create_address_scope(
+                                                self.context,
+                                                {'address_scope': scope_data})
+        pool = self._make_subnetpool(self.fmt, [GW_PREFIX, TENANT_PREFIX],
+                                     admin=True, tenant_id=self.tenant_id,
+                                     name='bgp-pool',
+                                     address_scope_id=scope['id'])
+        pool_id = pool['subnetpool']['id']
+        ext_net = self._make_network(self.fmt, 'ext-net', True)
+        self.gw_net_id = ext_net['network']['id']
+        self._make_subnet(self.fmt, ext_net, '172.16.0.1', GW_PREFIX,
+                          subnetpool_id=pool_id)
+        self._update('networks', self.gw_net_id,
+                     {'network': {external_net.EXTERNAL: True}})
+        if self.distributed:
+            self._create_fip_agent_gateways()
+
+        self.router_ids = []
+        tenant_net_ids = []
+        for router_index in range(self.router_count):
+            router = self.l3plugin.create_router(
+                self.context,
+                {'router': {'tenant_id': self.tenant_id,
+                            'name': 'router-%d' % router_index,
+                            'admin_state_up': True,
+                            'distributed': self.distributed,
+                            'external_gateway_info': {
+                                'network_id': self.gw_net_id}}})
+            self.router_ids.append(router['id'])
+            for subnet_index in range(self.subnet_count):
+                cidr = '10.%d.%d.0/24' % divmod(
+                    router_index * self.subnet_count + subnet_index, 256)
+                int_net = self._make_network(self.fmt, 'int-net', True)
+                subnet = self._make_subnet(self.fmt, int_net,
+                                           cidr.replace('0/24', '1'), cidr,
+                                           subnetpool_id=pool_id)
+                self.l3plugin.add_router_interface(
+                    self.context, router['id'],
+                    {'subnet_id': subnet['subnet']['id']})
+                if subnet_index == 0:
+                    tenant_net_ids.append(int_net['network']['id'])
+
+        for fip_index in range(self.fip_count):
+            router_index = fip_index % self.router_count
+            port_data = {'name': 'vm-%d' % fip_index,
+                         'network_id': tenant_net_ids[router_index],
+                         'tenant_id': self.tenant_id,
+                         'admin_state_up': True,
+                         'device_id': _uuid(),
+                         'device_owner': 'compute:nova',
+                         'mac_address': n_const.ATTR_NOT_SPECIFIED,
+                         'fixed_ips': n_const.ATTR_NOT_SPECIFIED}
+            if self.distributed:
+                port_data[portbindings.HOST_ID] = self._compute_host(
+                                                                fip_index)
+            port = self.plugin.create_port(self.context, {'port': port_data})
+            self.l3plugin.create_floatingip(
+                self.context,
+                {'floatingip': {'floating_network_id': self.gw_net_id,
+                                'tenant_id': self.tenant_id,
+                                'port_id': port['id']}})
+
+    def _compute_host(self, index):
+        return 'compute-%d' % (index % COMPUTE_HOSTS)
+
+    def _create_fip_agent_gateways(self):
+        for index in range(COMPUTE_HOSTS):
+            host = self._compute_host(index)
+            self.plugin._create_or_update_agent(self.context,
+                                                {'agent_type': 'L3 agent',
+                                                 'host': host,
+                                                 'binary': 'neutron-l3-agent',
+                                                 'topic': 'test'})
+            self.l3plugin.create_fip_agent_gw_port_if_not_exists(
+                                                            self.context,
+                                                            self.gw_net_id,
+                                                            host)
+
+    def _time(self, func):
+        timings = []
+        for i in range(self.repeat):
+            start = timeit.default_timer()
+            result = list(func())
+            timings.append(timeit.default_timer() - start)
+        return result, {'min': min(timings),
+                        'mean': sum(timings) / len(timings),
+                        'max': max(timings)}
+
+    def _report(self, timings):
+        results = {'test': self.id(),
+                   'backend': self.context.session.get_bind().dialect.name,
+                   'topology': {'router_count': self.router_count,
+                                'subnet_count': self.subnet_count,
+                                'fip_count': self.fip_count,
+                                'distributed': self.distributed},
+                   'repeat': self.repeat,
+                   'timings': timings}
+        self.addDetail('benchmark', content.json_content(results))
+        results_file = os.environ.get('BGP_BENCHMARK_RESULTS')
+        if results_file:
+            with open(results_file, 'a') as f:
+                f.write(jsonutils.dumps(results) + '\n')
+
+    def test_route_queries(self):
+        self._create_topology()
+        with self.bgp_speaker(4, 1234, networks=[self.gw_net_id]) as speaker:
+            bgp_speaker_id = speaker['id']
+            router_id = self.router_ids[0]
+            plugin = self.bgp_plugin
+            timings = {}
+
+            def compute_routes():
+                return plugin._compute_routes_by_bgp_speaker_ids(
+                                                    self.context,
+                                                    [bgp_speaker_id])[
+                                                            bgp_speaker_id]
+
+            def stored_routes():
+                return plugin.get_routes_by_bgp_speaker_id(self.context,
+                                                           bgp_speaker_id)
+
+            def advertised_routes():
+                return plugin.get_advertised_routes(
+                    self.context, bgp_speaker_id)['advertised_routes']
+
+            def router_routes():
+                return plugin._get_routes_by_router(
+                    self.context, router_id).get(bgp_speaker_id, [])
+
+            def router_prefixes():
+                return plugin._tenant_prefixes_by_router(self.context,
+                                                         router_id,
+                                                         bgp_speaker_id)
+
+            route_count = (self.router_count * self.subnet_count +
+                           self.fip_count)
+            router_fip_count = len(range(0, self.fip_count,
+                                         self.router_count))
+
+            routes, timings['_compute_routes_by_bgp_speaker_ids'] = (
+                self._time(compute_routes))
+            self.assertEqual(route_count, len(routes))
+            routes, timings['get_routes_by_bgp_speaker_id'] = (
+                self._time(stored_routes))
+            self.assertEqual(route_count, len(routes))
+            routes, timings['get_advertised_routes'] = (
+                self._time(advertised_routes))
+            self.assertEqual(route_count, len(routes))
+            routes, timings['_get_routes_by_router'] = (
+                self._time(router_routes))
+            self.assertEqual(self.subnet_count + router_fip_count,
+                             len(routes))
+            prefixes, timings['_tenant_prefixes_by_router'] = (
+                self._time(router_prefixes))
+            self.assertEqual(self.subnet_count, len(prefixes))
+
+            self._report(timings)
+
+
+class RouteQueryBenchmarkSQLite(RouteQueryBenchmarkMixin,
+                                test_plugin.Ml2PluginV2TestCase):
+    pass
+
+
+class RouteQueryBenchmarkMySQL(testlib_api.MySQLTestCaseMixin,
+                               RouteQueryBenchmarkMixin,
+                               test_plugin.Ml2PluginV2TestCase):
+    pass
+
+
+class RouteQueryBenchmarkPostgreSQL(testlib_api.PostgreSQLTestCaseMixin,
+                                    RouteQueryBenchmarkMixin,
+                                    test_plugin.Ml2PluginV2TestCase):
+    pass
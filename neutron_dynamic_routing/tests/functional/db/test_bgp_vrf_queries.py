@@ -0,0 +1,246 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmarks of the VRF queries of the BGP service plugin.
+
+Each scenario creates VRFs associated to several routers each, then counts
+and times the SQL statements issued by the VRF listing queries of
+bgp_vrf_db. The number of statements must not grow with the number of VRFs.
+The BGPVRFs of the routers are looked up both from the loaded router index
+of the worker and with the index loaded again.
+The tests run against SQLite, and against MySQL and PostgreSQL when an
+opportunistic database is available.
+
+The VRFs are scaled by the BGP_BENCHMARK_SCALE environment variable, and
+each query is run BGP_BENCHMARK_REPEAT times. The results are attached to
+the test results as JSON, and appended to the file named by the
+BGP_BENCHMARK_RESULTS environment variable when it is set.
+"""
+
+import os
+import timeit
+
+from oslo_serialization import jsonutils
+from oslo_utils import uuidutils
+import sqlalchemy as sa
+from testtools import content
+import testscenarios
+
+from neutron import manager
+from neutron.plugins.common import constants as p_const
+from neutron.tests.unit.plugins.ml2 import test_plugin
+from neutron.tests.unit import testlib_api
+
+from neutron_dynamic_routing.services.bgp import bgp_plugin
+from neutron_dynamic_routing.tests.unit.db import test_bgp_db
+
+# Required to generate tests from scenarios. Not compatible with nose.
+load_tests = testscenarios.load_tests_apply_scenarios
+
+_uuid = uuidutils.generate_uuid
+
+
+class VrfQueryBenchmarkMixin(test_bgp_db.BgpEntityCreationMixin):
+    """Count and time the bgp_vrf_db queries against many VRFs.
+
+        Below is the brief description of the scenario variables
+        --------------------------------------------------------
+        vrf_count
+            number of VRFs of the tenant.
+
+        routers_per_vrf
+            number of routers associated to each VRF.
+
+        page_size
+            number of VRFs of each page of the paginated listing.
+    """
+
+    scenarios = [
+        ('Few router associations',
+         dict(vrf_count=16,
+              routers_per_vrf=1,
+              page_size=5)),
+
+        ('Many router associations',
+         dict(vrf_count=16,
+              routers_per_vrf=8,
+              page_size=5)),
+    ]
+
+    def setup_parent(self):
+        self.l3_plugin = ('neutron_dynamic_routing.tests.unit.db.test_bgp_db.'
+                          'TestL3Plugin')
+        super(VrfQueryBenchmarkMixin, self).setup_parent()
+
+    def setUp(self):
+        super(VrfQueryBenchmarkMixin, self).setUp()
+        self.l3plugin = manager.NeutronManager.get_service_plugins().get(
+            p_const.L3_ROUTER_NAT)
+        self.bgp_plugin = bgp_plugin.BgpPlugin()
+        self.tenant_id = _uuid()
+        scale = int(os.environ.get('BGP_BENCHMARK_SCALE', 1))
+        self.repeat = int(os.environ.get('BGP_BENCHMARK_REPEAT', 3))
+        self.vrf_count *= scale
+
+    def _create_vrfs(self, first, last):
+        """Create VRFs, each associated to routers_per_vrf routers."""
+        for vrf_index in range(first, last):
+            vrf = self.bgp_plugin.create_vrf(
+                self.context,
+                {'vrf': {'tenant_id': self.tenant_id,
+                         'name': 'vrf-%06d' % vrf_index,
+                         'type': 'evpn',
+                         'import_targets': ['64512:%d' % vrf_index],
+                         'export_targets': ['64512:%d' % vrf_index],
+                         'segmentation_id': str(vrf_index + 1)}})
+            for router_index in range(self.routers_per_vrf):
+                router = self.l3plugin.create_router(
+                    self.context,
+                    {'router': {'tenant_id': self.tenant_id,
+                                'name': 'router-%d-%d' % (vrf_index,
+                                                          router_index),
+                                'admin_state_up': True}})
+                self.bgp_plugin.add_vrf_router_assoc(
+                    self.context, vrf['id'], {'router_id': router['id']})
+        self.router_id = router['id']
+
+    def _count_queries(self, func):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = self.context.session.get_bind()
+        sa.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            # Expire the session so that no VRF is served from it
+            self.context.session.expire_all()
+            result = func()
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', count)
+        return result, len(statements)
+
+    def _time(self, func):
+        timings = []
+        for i in range(self.repeat):
+            self.context.session.expire_all()
+            start = timeit.default_timer()
+            func()
+            timings.append(timeit.default_timer() - start)
+        return {'min': min(timings),
+                'mean': sum(timings) / len(timings),
+                'max': max(timings)}
+
+    def _report(self, query_counts, timings):
+        results = {'test': self.id(),
+                   'backend': self.context.session.get_bind().dialect.name,
+                   'vrfs': {'vrf_count': self.vrf_count,
+                            'routers_per_vrf': self.routers_per_vrf,
+                            'page_size': self.page_size},
+                   'repeat': self.repeat,
+                   'query_counts': query_counts,
+                   'timings': timings}
+        self.addDetail('benchmark', content.json_content(results))
+        results_file = os.environ.get('BGP_BENCHMARK_RESULTS')
+        if results_file:
+            with open(results_file, 'a') as f:
+                f.write(jsonutils.dumps(results) + '\n')
+
+    def _paginate(self):
+        """Walk the VRFs of the tenant one page at a time."""
+        vrfs = []
+        marker = None
+        while True:
+            page = self.bgp_plugin._get_vrfs_for_tenant(
+                self.context, self.tenant_id,
+                sorts=[('name', True), ('id', True)],
+                limit=self.page_size, marker=marker)
+            vrfs.extend(page)
+            if len(page) < self.page_size:
+                return vrfs
+            marker = page[-1]['id']
+
+    def _find_vrfs_for_router_loading_index(self):
+        # Drop the router index so that it is loaded again from the database
+        self.bgp_plugin._router_vrf_index = None
+        return self.bgp_plugin.find_vrfs_for_router(self.context,
+                                                    self.router_id)
+
+    def test_vrf_queries(self):
+        plugin = self.bgp_plugin
+        queries = {
+            'get_vrfs': lambda: plugin.get_vrfs(self.context),
+            '_get_vrfs_for_tenant':
+                lambda: plugin._get_vrfs_for_tenant(self.context,
+                                                    self.tenant_id),
+            'find_vrfs_for_router':
+                lambda: plugin.find_vrfs_for_router(self.context,
+                                                    self.router_id),
+            'find_vrfs_for_router loading the router index':
+                self._find_vrfs_for_router_loading_index,
+        }
+
+        # The statement counts with a single VRF are the baseline that the
+        # listing of all the VRFs must match. Each query is run once first,
+        # so that the router index is loaded before being counted.
+        self._create_vrfs(0, 1)
+        baseline = {}
+        for name, func in queries.items():
+            func()
+            result, baseline[name] = self._count_queries(func)
+            self.assertEqual(1, len(result))
+
+        self._create_vrfs(1, self.vrf_count)
+        results = {}
+        query_counts = {}
+        timings = {}
+        for name, func in queries.items():
+            func()
+            results[name], query_counts[name] = self._count_queries(func)
+            self.assertEqual(baseline[name], query_counts[name])
+            timings[name] = self._time(func)
+
+        self.assertEqual(self.vrf_count, len(results['get_vrfs']))
+        for vrf in results['get_vrfs']:
+            self.assertEqual(self.routers_per_vrf, len(vrf['routers']))
+        self.assertEqual(self.vrf_count,
+                         len(results['_get_vrfs_for_tenant']))
+        self.assertEqual(1, len(results['find_vrfs_for_router']))
+        self.assertEqual(
+            1, len(results['find_vrfs_for_router loading the router index']))
+
+        vrfs = self._paginate()
+        self.assertEqual(sorted(vrf['name'] for vrf in vrfs),
+                         [vrf['name'] for vrf in vrfs])
+        self.assertEqual(self.vrf_count, len(vrfs))
+        timings['paginated _get_vrfs_for_tenant'] = self._time(self._paginate)
+
+        self._report(query_counts, timings)
+
+
+class VrfQueryBenchmarkSQLite(VrfQueryBenchmarkMixin,
+                              test_plugin.Ml2PluginV2TestCase):
+    pass
+
+
+class VrfQueryBenchmarkMySQL(testlib_api.MySQLTestCaseMixin,
+                             VrfQueryBenchmarkMixin,
+                             test_plugin.Ml2PluginV2TestCase):
+    pass
+
+
+class VrfQueryBenchmarkPostgreSQL(testlib_api.PostgreSQLTestCaseMixin,
+                                  VrfQueryBenchmarkMixin,
+                                  test_plugin.Ml2PluginV2TestCase):
+    pass
@@ -82,3 +82,10 @@ class TestBgpDrAgentNotifyApi(base.BaseTestCase):
                                           self.host)
         self.assertEqual(1, self.mock_cast.call_count)
         self.assertEqual(0, self.mock_call.call_count)
+
+    def test_notify_bgp_speaker_vrfs_updated(self):
+        bgp_speaker_id = 'bgp-speaker-1'
+        self.notifier.bgp_speaker_vrfs_updated(self.context, bgp_speaker_id,
+                                               self.host)
+        self.assertEqual(1, self.mock_cast.call_count)
+        self.assertEqual(0, self.mock_call.call_count)
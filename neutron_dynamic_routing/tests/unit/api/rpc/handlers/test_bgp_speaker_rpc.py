@@ -39,7 +39,18 @@ class TestBgpSpeakerRpcCallback(base.BaseTestCase):
                                         bgp_peer_id='id1')
         self.assertIsNotNone(len(self.plugin.mock_calls))
 
+    def test_get_bgp_peers_info(self):
+        self.callback.get_bgp_peers_info(mock.Mock(),
+                                         bgp_peer_ids=['id1', 'id2'])
+        self.assertIsNotNone(len(self.plugin.mock_calls))
+
     def test_get_bgp_speakers(self):
         self.callback.get_bgp_speakers(mock.Mock(),
                                        host='host')
         self.assertIsNotNone(len(self.plugin.mock_calls))
+
+    def test_get_bgp_speakers_delta(self):
+        self.callback.get_bgp_speakers_delta(mock.Mock(),
+                                             host='host',
+                                             generations={'id1': 3})
+        self.assertIsNotNone(len(self.plugin.mock_calls))
@@ -13,6 +13,7 @@
 # under the License.
 
 import contextlib
+import mock
 import netaddr
 from oslo_config import cfg
 
@@ -29,6 +30,8 @@ from neutron.plugins.common import constants as p_const
 from neutron.tests.unit.extensions import test_l3
 from neutron.tests.unit.plugins.ml2 import test_plugin
 
+from neutron_dynamic_routing.db import bgp_db
+from neutron_dynamic_routing.db import bgp_vrf_db
 from neutron_dynamic_routing.extensions import bgp
 from neutron_dynamic_routing.services.bgp import bgp_plugin
 
@@ -170,6 +173,8 @@ class BgpTests(test_plugin.Ml2PluginV2TestCase,
         super(BgpTests, self).setUp()
         self.l3plugin = manager.NeutronManager.get_service_plugins().get(
             p_const.L3_ROUTER_NAT)
+        cfg.CONF.set_override('bgp_route_notification_interval', 0)
+        cfg.CONF.set_override('bgp_callback_workers', 0)
         self.bgp_plugin = bgp_plugin.BgpPlugin()
         self.plugin = manager.NeutronManager.get_plugin()
 
@@ -550,6 +555,49 @@ class BgpTests(test_plugin.Ml2PluginV2TestCase,
                 self.assertEqual(tenant_prefix, routes[0]['destination'])
                 self.assertEqual(next_hop, routes[0]['next_hop'])
 
+    def test_get_advertised_routes_never_stored(self):
+        gw_prefix = '172.16.10.0/24'
+        tenant_prefix = '10.10.10.0/24'
+        tenant_id = _uuid()
+        scope_data = {'tenant_id': tenant_id, 'ip_version': 4,
+                      'shared': True, 'name': 'bgp-scope'}
+        scope = self.plugin.create_address_scope(
+                                                self.context,
+                                                {'address_scope': scope_data})
+        with self.router_with_external_and_tenant_networks(
+                                               tenant_id=tenant_id,
+                                               gw_prefix=gw_prefix,
+                                               tenant_prefix=tenant_prefix,
+                                               address_scope=scope) as res:
+            router, ext_net, int_net = res
+            ext_gw_info = router['external_gateway_info']
+            gw_net_id = ext_net['network']['id']
+            with self.bgp_speaker(4, 1234,
+                                  networks=[gw_net_id]) as speaker:
+                bgp_speaker_id = speaker['id']
+                # Get the BgpSpeaker back to its state right after the
+                # bgp_speaker_routes table is created
+                session = self.context.session
+                with session.begin(subtransactions=True):
+                    session.query(bgp_db.BgpSpeakerRoute).delete()
+                    session.query(bgp_db.BgpSpeaker).update(
+                        {bgp_db.BgpSpeaker.generation: 0,
+                         bgp_db.BgpSpeaker.base_generation: 0})
+                next_hop = ext_gw_info['external_fixed_ips'][0]['ip_address']
+                routes = self.bgp_plugin.get_advertised_routes(
+                                                          self.context,
+                                                          bgp_speaker_id,
+                                                          {'limit': 10})
+                self.assertEqual([{'destination': tenant_prefix,
+                                   'next_hop': next_hop}],
+                                 routes['advertised_routes'])
+                delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                              self.context,
+                                                              bgp_speaker_id,
+                                                              0)
+                self.assertTrue(delta['full_sync'])
+                self.assertEqual(1, delta['generation'])
+
     def test_get_routes_by_binding_network(self):
         gw_prefix = '172.16.10.0/24'
         tenant_prefix = '10.10.10.0/24'
@@ -774,6 +822,121 @@ class BgpTests(test_plugin.Ml2PluginV2TestCase,
                 self.assertTrue(tenant_prefix_found)
                 self.assertTrue(fip_prefix_found)
 
+    def test__compute_routes_by_bgp_speaker_ids(self):
+        gw_prefix = '172.16.10.0/24'
+        tenant_prefix = '10.10.10.0/24'
+        tenant_id = _uuid()
+        scope_data = {'tenant_id': tenant_id, 'ip_version': 4,
+                      'shared': True, 'name': 'bgp-scope'}
+        scope = self.plugin.create_address_scope(
+                                                self.context,
+                                                {'address_scope': scope_data})
+        with self.router_with_external_and_tenant_networks(
+                                               tenant_id=tenant_id,
+                                               gw_prefix=gw_prefix,
+                                               tenant_prefix=tenant_prefix,
+                                               address_scope=scope) as res:
+            router, ext_net, int_net = res
+            gw_net_id = ext_net['network']['id']
+            tenant_net_id = int_net['network']['id']
+            fixed_port_data = {'port':
+                               {'name': 'test',
+                                'network_id': tenant_net_id,
+                                'tenant_id': tenant_id,
+                                'admin_state_up': True,
+                                'device_id': _uuid(),
+                                'device_owner': 'compute:nova',
+                                'mac_address': n_const.ATTR_NOT_SPECIFIED,
+                                'fixed_ips': n_const.ATTR_NOT_SPECIFIED}}
+            fixed_port = self.plugin.create_port(self.context,
+                                                 fixed_port_data)
+            fip_data = {'floatingip': {'floating_network_id': gw_net_id,
+                                       'tenant_id': tenant_id,
+                                       'port_id': fixed_port['id']}}
+            fip = self.l3plugin.create_floatingip(self.context, fip_data)
+            fip_prefix = fip['floating_ip_address'] + '/32'
+            with self.bgp_speaker(4, 1234, networks=[gw_net_id]) as speaker,\
+                    self.bgp_speaker(4, 4321, name='other-speaker',
+                                     advertise_fip_host_routes=False,
+                                     networks=[gw_net_id]) as other:
+                bgp_speaker_ids = [speaker['id'], other['id']]
+                routes = self.bgp_plugin._compute_routes_by_bgp_speaker_ids(
+                                                               self.context,
+                                                               bgp_speaker_ids)
+                self.assertItemsEqual(bgp_speaker_ids, routes.keys())
+                self.assertItemsEqual(
+                    [tenant_prefix, fip_prefix],
+                    [route['destination'] for route in routes[speaker['id']]])
+                self.assertEqual(
+                    [tenant_prefix],
+                    [route['destination'] for route in routes[other['id']]])
+
+                stored = self.bgp_plugin.rebuild_bgp_speakers_routes(
+                                                               self.context,
+                                                               bgp_speaker_ids)
+                for bgp_speaker_id in bgp_speaker_ids:
+                    self.assertItemsEqual(routes[bgp_speaker_id],
+                                          stored[bgp_speaker_id])
+                results = self.bgp_plugin.verify_bgp_speakers_routes(
+                                                               self.context,
+                                                               bgp_speaker_ids)
+                for bgp_speaker_id in bgp_speaker_ids:
+                    self.assertEqual({'missing_routes': [],
+                                      'stale_routes': []},
+                                     results[bgp_speaker_id])
+
+    def test__get_routes_by_router_with_dvr_fip(self):
+        gw_prefix = '172.16.10.0/24'
+        tenant_prefix = '10.10.10.0/24'
+        tenant_id = _uuid()
+        scope_data = {'tenant_id': tenant_id, 'ip_version': 4,
+                      'shared': True, 'name': 'bgp-scope'}
+        scope = self.plugin.create_address_scope(
+                                                self.context,
+                                                {'address_scope': scope_data})
+        with self.router_with_external_and_tenant_networks(
+                                               tenant_id=tenant_id,
+                                               gw_prefix=gw_prefix,
+                                               tenant_prefix=tenant_prefix,
+                                               address_scope=scope,
+                                               distributed=True) as res:
+            router, ext_net, int_net = res
+            gw_net_id = ext_net['network']['id']
+            tenant_net_id = int_net['network']['id']
+            fixed_port_data = {'port':
+                               {'name': 'test',
+                                'network_id': tenant_net_id,
+                                'tenant_id': tenant_id,
+                                'admin_state_up': True,
+                                'device_id': _uuid(),
+                                'device_owner': 'compute:nova',
+                                'mac_address': n_const.ATTR_NOT_SPECIFIED,
+                                'fixed_ips': n_const.ATTR_NOT_SPECIFIED,
+                                portbindings.HOST_ID: 'test-host'}}
+            fixed_port = self.plugin.create_port(self.context,
+                                                 fixed_port_data)
+            self.plugin._create_or_update_agent(self.context,
+                                                {'agent_type': 'L3 agent',
+                                                 'host': 'test-host',
+                                                 'binary': 'neutron-l3-agent',
+                                                 'topic': 'test'})
+            fip_gw = self.l3plugin.create_fip_agent_gw_port_if_not_exists(
+                                                                 self.context,
+                                                                 gw_net_id,
+                                                                 'test-host')
+            fip_data = {'floatingip': {'floating_network_id': gw_net_id,
+                                       'tenant_id': tenant_id,
+                                       'port_id': fixed_port['id']}}
+            fip = self.l3plugin.create_floatingip(self.context, fip_data)
+            fip_prefix = fip['floating_ip_address'] + '/32'
+            with self.bgp_speaker(4, 1234, networks=[gw_net_id]) as speaker:
+                routes = self.bgp_plugin._get_routes_by_router(self.context,
+                                                               router['id'])
+                dvr_gw_ip = fip_gw['fixed_ips'][0]['ip_address']
+                self.assertIn({'destination': fip_prefix,
+                               'next_hop': dvr_gw_ip},
+                              routes[speaker['id']])
+
     def test_get_routes_by_bgp_speaker_id_with_fip(self):
         gw_prefix = '172.16.10.0/24'
         tenant_prefix = '10.10.10.0/24'
@@ -827,6 +990,292 @@ class BgpTests(test_plugin.Ml2PluginV2TestCase,
                 self.assertTrue(tenant_prefix_found)
                 self.assertTrue(fip_prefix_found)
 
+    def test_verify_and_rebuild_bgp_speaker_routes(self):
+        tenant_cidr = '172.16.10.0/24'
+        binding_cidr = '20.10.1.0/24'
+        tenant_id = _uuid()
+        scope_data = {'tenant_id': tenant_id, 'ip_version': 4,
+                      'shared': True, 'name': 'bgp-scope'}
+        scope = self.plugin.create_address_scope(
+                                                self.context,
+                                                {'address_scope': scope_data})
+        with self.router_with_external_and_tenant_networks(
+                                               tenant_id=tenant_id,
+                                               gw_prefix=binding_cidr,
+                                               tenant_prefix=tenant_cidr,
+                                               address_scope=scope) as res:
+            router, ext_net, int_net = res
+            gw_net_id = ext_net['network']['id']
+            with self.bgp_speaker(4, 1234, networks=[gw_net_id]) as speaker:
+                bgp_speaker_id = speaker['id']
+                result = self.bgp_plugin.verify_bgp_speaker_routes(
+                                                               self.context,
+                                                               bgp_speaker_id)
+                self.assertEqual([], result['missing_routes'])
+                self.assertEqual([], result['stale_routes'])
+
+                stale_route = {'destination': '30.0.0.0/24',
+                               'next_hop': '1.1.1.1'}
+                self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                         bgp_speaker_id,
+                                                         [stale_route])
+                self.bgp_plugin._remove_bgp_speaker_routes(self.context,
+                                                           bgp_speaker_id,
+                                                           [tenant_cidr])
+                result = self.bgp_plugin.verify_bgp_speaker_routes(
+                                                               self.context,
+                                                               bgp_speaker_id)
+                self.assertEqual([tenant_cidr],
+                                 [r['destination']
+                                  for r in result['missing_routes']])
+                self.assertEqual([stale_route], result['stale_routes'])
+
+                self.bgp_plugin.rebuild_bgp_speaker_routes(self.context,
+                                                           bgp_speaker_id)
+                routes = list(self.bgp_plugin.get_routes_by_bgp_speaker_id(
+                                                               self.context,
+                                                               bgp_speaker_id))
+                self.assertEqual([tenant_cidr],
+                                 [r['destination'] for r in routes])
+
+    def test_save_bgp_speaker_routes_replaces_next_hop(self):
+        with self.bgp_speaker(4, 1234) as speaker:
+            bgp_speaker_id = speaker['id']
+            route = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+            new = self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                           bgp_speaker_id,
+                                                           [route])
+            self.assertEqual({'10.0.0.0/24'}, new)
+            route = {'destination': '10.0.0.0/24', 'next_hop': '2.2.2.2'}
+            new = self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                           bgp_speaker_id,
+                                                           [route])
+            self.assertEqual(set(), new)
+            routes = list(self.bgp_plugin.get_routes_by_bgp_speaker_id(
+                                                               self.context,
+                                                               bgp_speaker_id))
+            self.assertEqual([route], routes)
+
+    def test_save_and_remove_bgp_speaker_routes_at_generation(self):
+        with self.bgp_speaker(4, 1234) as speaker:
+            bgp_speaker_id = speaker['id']
+            route_1 = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+            route_2 = {'destination': '20.0.0.0/24', 'next_hop': '1.1.1.1'}
+            self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                     bgp_speaker_id,
+                                                     [route_1])
+            full = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                               self.context,
+                                                               bgp_speaker_id,
+                                                               None)
+            with self.context.session.begin(subtransactions=True):
+                generation = self.bgp_plugin._bump_bgp_speaker_generation(
+                                                            self.context,
+                                                            bgp_speaker_id)
+                self.bgp_plugin._remove_bgp_speaker_routes(
+                                                    self.context,
+                                                    bgp_speaker_id,
+                                                    [route_1],
+                                                    generation=generation)
+                self.bgp_plugin._save_bgp_speaker_routes(
+                                                    self.context,
+                                                    bgp_speaker_id,
+                                                    [route_2],
+                                                    generation=generation)
+            delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                        self.context,
+                                                        bgp_speaker_id,
+                                                        full['generation'])
+            self.assertEqual(full['generation'] + 1, delta['generation'])
+            self.assertEqual([route_2], delta['advertised_routes'])
+            self.assertEqual([{'destination': route_1['destination']}],
+                             delta['withdrawn_routes'])
+
+    def test_get_advertised_routes_paginated(self):
+        with self.bgp_speaker(4, 1234) as speaker:
+            bgp_speaker_id = speaker['id']
+            routes = [{'destination': '10.0.%d.0/24' % i,
+                       'next_hop': '1.1.1.1'} for i in range(5)]
+            self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                     bgp_speaker_id,
+                                                     routes)
+            page = self.bgp_plugin.get_advertised_routes(
+                                                    self.context,
+                                                    bgp_speaker_id,
+                                                    {'limit': 2})
+            self.assertEqual(routes[:2], page['advertised_routes'])
+            page = self.bgp_plugin.get_advertised_routes(
+                                    self.context,
+                                    bgp_speaker_id,
+                                    {'limit': 2,
+                                     'marker': routes[1]['destination']})
+            self.assertEqual(routes[2:4], page['advertised_routes'])
+            page = self.bgp_plugin.get_advertised_routes(
+                                    self.context,
+                                    bgp_speaker_id,
+                                    {'limit': 2,
+                                     'marker': routes[4]['destination'],
+                                     'page_reverse': True})
+            self.assertEqual(routes[2:4], page['advertised_routes'])
+            page = self.bgp_plugin.get_advertised_routes(self.context,
+                                                         bgp_speaker_id)
+            self.assertEqual(routes, page['advertised_routes'])
+            self.assertRaises(n_exc.BadRequest,
+                              self.bgp_plugin.get_advertised_routes,
+                              self.context, bgp_speaker_id, {'limit': -1})
+
+    def test_iter_routes_by_bgp_speaker_id(self):
+        with self.bgp_speaker(4, 1234) as speaker:
+            bgp_speaker_id = speaker['id']
+            routes = [{'destination': '10.0.%d.0/24' % i,
+                       'next_hop': '1.1.1.1'} for i in range(5)]
+            self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                     bgp_speaker_id,
+                                                     routes)
+            get_page = mock.patch.object(
+                self.bgp_plugin, '_get_bgp_speaker_routes_page',
+                wraps=self.bgp_plugin._get_bgp_speaker_routes_page).start()
+            routes_iter = self.bgp_plugin.iter_routes_by_bgp_speaker_id(
+                                                        self.context,
+                                                        bgp_speaker_id,
+                                                        batch_size=2)
+            self.assertEqual(routes, list(routes_iter))
+            self.assertEqual(3, get_page.call_count)
+
+    def test_get_routes_by_bgp_speaker_id_cached(self):
+        with self.bgp_speaker(4, 1234) as speaker:
+            bgp_speaker_id = speaker['id']
+            route_1 = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+            route_2 = {'destination': '20.0.0.0/24', 'next_hop': '1.1.1.1'}
+            self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                     bgp_speaker_id,
+                                                     [route_1])
+            for i in range(2):
+                routes = self.bgp_plugin.get_routes_by_bgp_speaker_id(
+                                                               self.context,
+                                                               bgp_speaker_id)
+                self.assertEqual((route_1,), routes)
+            stats = self.bgp_plugin.get_bgp_route_cache_stats()
+            self.assertEqual(1, stats['misses'])
+            self.assertEqual(1, stats['hits'])
+
+            self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                     bgp_speaker_id,
+                                                     [route_2])
+            routes = self.bgp_plugin.get_advertised_routes(self.context,
+                                                           bgp_speaker_id)
+            self.assertEqual([route_1, route_2], routes['advertised_routes'])
+            stats = self.bgp_plugin.get_bgp_route_cache_stats()
+            self.assertEqual(2, stats['misses'])
+
+    def test_report_bgp_stats(self):
+        with mock.patch.object(bgp_plugin.LOG, 'info') as log_info:
+            self.bgp_plugin._report_stats()
+            stats = log_info.call_args[0][1]
+        self.assertEqual(self.bgp_plugin.get_bgp_stats(), stats)
+        self.assertEqual({'route_cache', 'router_vrf_index', 'callback_pool'},
+                         set(stats))
+
+    def test_get_bgp_speaker_with_route_delta(self):
+        with self.bgp_speaker(4, 1234) as speaker:
+            bgp_speaker_id = speaker['id']
+            route_1 = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+            route_2 = {'destination': '20.0.0.0/24', 'next_hop': '1.1.1.1'}
+            self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                     bgp_speaker_id,
+                                                     [route_1, route_2])
+            full = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                               self.context,
+                                                               bgp_speaker_id,
+                                                               None)
+            self.assertTrue(full['full_sync'])
+            self.assertItemsEqual([route_1, route_2],
+                                  full['advertised_routes'])
+
+            route_3 = {'destination': '30.0.0.0/24', 'next_hop': '1.1.1.1'}
+            self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                     bgp_speaker_id,
+                                                     [route_3])
+            self.bgp_plugin._remove_bgp_speaker_routes(self.context,
+                                                       bgp_speaker_id,
+                                                       [route_1])
+            delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                        self.context,
+                                                        bgp_speaker_id,
+                                                        full['generation'])
+            self.assertFalse(delta['full_sync'])
+            self.assertEqual(full['generation'] + 2, delta['generation'])
+            self.assertEqual([route_3], delta['advertised_routes'])
+            self.assertEqual([{'destination': route_1['destination']}],
+                             delta['withdrawn_routes'])
+
+            delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                        self.context,
+                                                        bgp_speaker_id,
+                                                        delta['generation'])
+            self.assertFalse(delta['full_sync'])
+            self.assertEqual([], delta['advertised_routes'])
+            self.assertEqual([], delta['withdrawn_routes'])
+
+    def test_get_bgp_speaker_with_route_delta_vrfs(self):
+        with self.bgp_speaker(4, 1234) as speaker:
+            bgp_speaker_id = speaker['id']
+            full = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                               self.context,
+                                                               bgp_speaker_id,
+                                                               None)
+            self.assertEqual([], full['vrfs'])
+            delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                        self.context,
+                                                        bgp_speaker_id,
+                                                        full['generation'])
+            self.assertNotIn('vrfs', delta)
+
+            vrf = self._create_vrf(['100:1'], ['100:2'])
+            self.bgp_plugin.add_vrf_speaker_assoc(
+                self.context, vrf['id'], {'speaker_id': bgp_speaker_id})
+            delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                        self.context,
+                                                        bgp_speaker_id,
+                                                        full['generation'])
+            self.assertFalse(delta['full_sync'])
+            self.assertEqual([vrf['id']],
+                             [vrf['id'] for vrf in delta['vrfs']])
+
+            self.bgp_plugin.update_vrf(
+                self.context, vrf['id'],
+                {'vrf': {'import_targets': ['100:3']}})
+            delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                        self.context,
+                                                        bgp_speaker_id,
+                                                        delta['generation'])
+            self.assertEqual(['100:3'], delta['vrfs'][0]['import_targets'])
+            delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                        self.context,
+                                                        bgp_speaker_id,
+                                                        delta['generation'])
+            self.assertNotIn('vrfs', delta)
+
+    def test_get_bgp_speaker_with_route_delta_after_rebuild(self):
+        with self.bgp_speaker(4, 1234) as speaker:
+            bgp_speaker_id = speaker['id']
+            route = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+            self.bgp_plugin._save_bgp_speaker_routes(self.context,
+                                                     bgp_speaker_id,
+                                                     [route])
+            speaker = self.bgp_plugin.get_bgp_speaker_with_advertised_routes(
+                                                               self.context,
+                                                               bgp_speaker_id)
+            generation = speaker['generation']
+            self.bgp_plugin.rebuild_bgp_speaker_routes(self.context,
+                                                       bgp_speaker_id)
+            delta = self.bgp_plugin.get_bgp_speaker_with_route_delta(
+                                                               self.context,
+                                                               bgp_speaker_id,
+                                                               generation)
+            self.assertTrue(delta['full_sync'])
+            self.assertEqual([], delta['advertised_routes'])
+
     def test_get_routes_by_bgp_speaker_id_with_fip_dvr(self):
         gw_prefix = '172.16.10.0/24'
         tenant_prefix = '10.10.10.0/24'
@@ -949,7 +1398,7 @@ class BgpTests(test_plugin.Ml2PluginV2TestCase,
                 self.assertEqual(dvr_gw_ip, routes[0]['next_hop'])
                 self.assertEqual(fip_prefix, routes[0]['destination'])
 
-    def test__get_dvr_fip_host_routes_by_router(self):
+    def test__get_dvr_fip_host_routes_by_bgp_speakers_for_router(self):
         gw_prefix = '172.16.10.0/24'
         tenant_prefix = '10.10.10.0/24'
         tenant_id = _uuid()
@@ -993,13 +1442,27 @@ class BgpTests(test_plugin.Ml2PluginV2TestCase,
                                        'port_id': fixed_port['id']}}
             fip = self.l3plugin.create_floatingip(self.context, fip_data)
             fip_prefix = fip['floating_ip_address'] + '/32'
-            with self.bgp_speaker(4, 1234, networks=[gw_net_id]) as speaker:
+            with self.bgp_speaker(4, 1234, networks=[gw_net_id]) as speaker,\
+                    self.bgp_speaker(4, 4321, name='other-speaker',
+                                     advertise_fip_host_routes=False,
+                                     networks=[gw_net_id]) as other:
                 bgp_speaker_id = speaker['id']
-                routes = self.bgp_plugin._get_dvr_fip_host_routes_by_router(
+                # The BgpSpeaker not advertising floating IP host routes
+                # gets none, whether computed or stored
+                routes = self.bgp_plugin.get_routes_by_bgp_speaker_id(
                                                                self.context,
-                                                               bgp_speaker_id,
-                                                               router['id'])
-                routes = list(routes)
+                                                               other['id'])
+                self.assertNotIn(fip_prefix,
+                                 [route['destination'] for route in routes])
+                routes = list(
+                    self.bgp_plugin._get_dvr_fip_host_routes_by_bgp_speakers(
+                                                            self.context,
+                                                            [bgp_speaker_id,
+                                                             other['id']],
+                                                            router['id']))
+                self.assertEqual([bgp_speaker_id],
+                                 [route[0] for route in routes])
+                routes = [route for speaker_id, route in routes]
                 dvr_gw_ip = fip_gw['fixed_ips'][0]['ip_address']
                 self.assertEqual(1, len(routes))
                 self.assertEqual(dvr_gw_ip, routes[0]['next_hop'])
@@ -1178,3 +1641,148 @@ class BgpTests(test_plugin.Ml2PluginV2TestCase,
 
     def test_ha_router_fips_has_no_next_hop_to_fip_agent_gateway(self):
         self._test_legacy_router_fips_next_hop(router_ha=True)
+
+    def _create_vrf(self, import_targets, export_targets):
+        data = {'tenant_id': _uuid(), 'name': 'my-vrf', 'type': 'evpn',
+                'import_targets': import_targets,
+                'export_targets': export_targets,
+                'segmentation_id': '100'}
+        return self.bgp_plugin.create_vrf(self.context, {'vrf': data})
+
+    def test_update_vrf_route_targets(self):
+        vrf = self._create_vrf(['100:1', '100:2'], ['100:3'])
+        self.assertEqual(['100:1', '100:2'], vrf['import_targets'])
+        self.assertEqual(['100:3'], vrf['export_targets'])
+
+        vrf = self.bgp_plugin.update_vrf(
+            self.context, vrf['id'],
+            {'vrf': {'import_targets': ['100:2', '100:4']}})
+        self.assertEqual(['100:2', '100:4'], vrf['import_targets'])
+        self.assertEqual(['100:3'], vrf['export_targets'])
+
+    def test_vrf_route_targets_written_by_old_servers(self):
+        vrf = self._create_vrf(['100:1'], ['100:2'])
+        vrf_id = vrf['id']
+        with self.context.session.begin(subtransactions=True):
+            # A VRF created by a server not upgraded yet has no route
+            # target rows, and one updated by it has stale rows.
+            query = self.context.session.query(bgp_vrf_db.BGPVRFRouteTarget)
+            query.filter_by(vrf_id=vrf_id, type='export').delete()
+            query = self.context.session.query(bgp_vrf_db.BGPVRF)
+            query.filter_by(id=vrf_id).update(
+                {'import_targets': '100:3', 'export_targets': '100:4'})
+        self.context.session.expire_all()
+        vrf = self.bgp_plugin.get_vrf(self.context, vrf_id)
+        self.assertEqual(['100:3'], vrf['import_targets'])
+        self.assertEqual(['100:4'], vrf['export_targets'])
+
+        # The rows catch up on the next update of the VRF
+        self.bgp_plugin.update_vrf(self.context, vrf_id,
+                                   {'vrf': {'name': 'new-name'}})
+        vrf_ids = self.bgp_plugin.get_vrf_ids_by_route_targets(
+            self.context, ['100:1', '100:3'])
+        self.assertEqual({'100:1': set(), '100:3': set([vrf_id])}, vrf_ids)
+        vrf_ids = self.bgp_plugin.get_vrf_ids_by_route_targets(
+            self.context, ['100:4'], rt_type='export')
+        self.assertEqual({'100:4': set([vrf_id])}, vrf_ids)
+
+    def test_get_vrfs_by_route_targets(self):
+        vrf1 = self._create_vrf(['100:1', '100:2'], ['100:3'])
+        vrf2 = self._create_vrf(['100:2'], ['100:1'])
+        self._create_vrf(['100:3'], [])
+
+        vrfs = self.bgp_plugin.get_vrfs_by_route_targets(
+            self.context, ['100:1', '100:2'], fields=['id'])
+        self.assertItemsEqual([{'id': vrf1['id']}, {'id': vrf2['id']}], vrfs)
+        vrf_ids = self.bgp_plugin.get_vrf_ids_by_route_targets(
+            self.context, ['100:1', '100:5'], rt_type='export')
+        self.assertEqual({'100:1': set([vrf2['id']]), '100:5': set()},
+                         vrf_ids)
+
+    def test_get_vrfs_paginated(self):
+        vrf_ids = sorted(self._create_vrf(['100:1'], [])['id']
+                         for i in range(3))
+        vrfs = self.bgp_plugin.get_vrfs(self.context, fields=['id'],
+                                        sorts=[('id', True)], limit=2)
+        self.assertEqual([{'id': vrf_id} for vrf_id in vrf_ids[:2]], vrfs)
+        vrfs = self.bgp_plugin.get_vrfs(self.context, fields=['id'],
+                                        sorts=[('id', True)], limit=2,
+                                        marker=vrf_ids[1])
+        self.assertEqual([{'id': vrf_ids[2]}], vrfs)
+
+    def test_get_bgp_speaker_ids_by_router_vrfs(self):
+        with self.router() as router, self.bgp_speaker(4, 1234) as speaker:
+            router_id = router['id']
+            plugin = self.bgp_plugin
+            vrf = self._create_vrf(['100:1'], ['100:2'])
+            plugin.add_vrf_speaker_assoc(self.context, vrf['id'],
+                                         {'speaker_id': speaker['id']})
+            # Load the router index of this worker before the router is
+            # associated through another worker
+            self.assertEqual([], plugin.get_router_vrfs(self.context,
+                                                        router_id))
+            with self.context.session.begin(subtransactions=True):
+                self.context.session.add(bgp_vrf_db.BGPVRFRouterAssociation(
+                    id=_uuid(), tenant_id=vrf['tenant_id'],
+                    vrf_id=vrf['id'], router_id=router_id))
+            self.assertEqual([speaker['id']],
+                             plugin._get_bgp_speaker_ids_by_router_vrfs(
+                                                                self.context,
+                                                                router_id))
+
+    def test_get_router_vrfs_follows_changes(self):
+        with self.router() as router:
+            router_id = router['id']
+            plugin = self.bgp_plugin
+            vrf1 = self._create_vrf(['100:1'], ['100:2'])
+            vrf2 = self._create_vrf(['200:1'], [])
+            self.assertEqual([], plugin.get_router_vrfs(self.context,
+                                                        router_id))
+            plugin.add_vrf_router_assoc(self.context, vrf1['id'],
+                                        {'router_id': router_id})
+            plugin.add_vrf_router_assoc(self.context, vrf2['id'],
+                                        {'router_id': router_id})
+            plugin.update_vrf(self.context, vrf1['id'],
+                              {'vrf': {'import_targets': ['100:3']}})
+            plugin.remove_vrf_router_assoc(self.context, vrf2['id'],
+                                           {'router_id': router_id})
+            vrfs = plugin.get_router_vrfs(self.context, router_id)
+            self.assertEqual([{'id': vrf1['id'],
+                               'import_targets': ['100:3'],
+                               'export_targets': ['100:2'],
+                               'segmentation_id': '100'}], vrfs)
+            self.assertEqual([vrf1['id']],
+                             [vrf['id'] for vrf in
+                              plugin.find_vrfs_for_router(self.context,
+                                                          router_id)])
+            plugin.delete_vrf(self.context, vrf1['id'])
+            self.assertEqual([], plugin.get_router_vrfs(self.context,
+                                                        router_id))
+            # The index was loaded once and then kept up to date
+            stats = plugin.get_router_vrf_index_stats()
+            self.assertEqual(1, stats['loads'])
+            self.assertEqual(1, stats['misses'])
+
+    def test_get_vrfs_by_bgp_speaker_ids(self):
+        with self.router_with_external_and_tenant_networks(
+                tenant_prefix='10.10.0.0/24') as res:
+            router = res[0]
+            with self.bgp_speaker(4, 1234) as speaker:
+                vrf = self._create_vrf(['100:1'], ['100:2'])
+                self.bgp_plugin.add_vrf_router_assoc(
+                    self.context, vrf['id'], {'router_id': router['id']})
+                self.bgp_plugin.add_vrf_speaker_assoc(
+                    self.context, vrf['id'], {'speaker_id': speaker['id']})
+                vrfs = self.bgp_plugin.get_vrfs_by_bgp_speaker_ids(
+                    self.context, [speaker['id']])
+                self.assertEqual(
+                    {speaker['id']: [{'id': vrf['id'],
+                                      'route_distinguisher': '1234:100',
+                                      'import_targets': ['100:1'],
+                                      'export_targets': ['100:2'],
+                                      'vni': 100,
+                                      'routes': [{'destination':
+                                                  '10.10.0.0/24',
+                                                  'gateway_ip':
+                                                  '10.10.0.1'}]}]},
+                    vrfs)
@@ -12,6 +12,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import mock
 from oslo_config import cfg
 from oslo_utils import importutils
 
@@ -175,6 +176,118 @@ class BgpDrSchedulingTestCase(test_agent.AgentDBTestMixIn,
             res = req.get_response(self.ext_api)
             self.assertEqual(exc.HTTPConflict.code, res.status_int)
 
+    def test_schedule_multi_bgp_speaker_on_dragent_with_capacity(self):
+        """Test a dragent hosts up to max_bgp_speakers BGP speakers."""
+        with self.bgp_speaker(4, 1) as ri1, self.bgp_speaker(4, 2) as ri2:
+            with self.bgp_speaker(4, 3) as ri3:
+                helpers.register_bgp_dragent(
+                    host='host1', configurations={'max_bgp_speakers': 2})
+
+                agent = self._list('agents')['agents'][0]
+                for ri, status in ((ri1, exc.HTTPCreated.code),
+                                   (ri2, exc.HTTPCreated.code),
+                                   (ri3, exc.HTTPConflict.code)):
+                    data = {'bgp_speaker_id': ri['id']}
+                    req = self.new_create_request(
+                        'agents', data, self.fmt,
+                        agent['id'], 'bgp-drinstances')
+                    res = req.get_response(self.ext_api)
+                    self.assertEqual(status, res.status_int)
+
+                plugin = self.bgp_plugin
+                bgp_speakers = plugin.get_bgp_speakers_for_agent_host(
+                                                        self.context, 'host1')
+                self.assertEqual(set([ri1['id'], ri2['id']]),
+                                 set(s['id'] for s in bgp_speakers))
+
+    def _test_reschedule_bgp_speaker_from_down_dragent(self, spare_agent):
+        with self.bgp_speaker(4, 1234) as ri:
+            down_agent = helpers.register_bgp_dragent(host='host1',
+                                                      alive=False)
+            self.bgp_plugin.add_bgp_speaker_to_dragent(
+                self.context, down_agent.id, ri['id'])
+            if spare_agent:
+                expected_agent = helpers.register_bgp_dragent(host='host2')
+            else:
+                expected_agent = down_agent
+            mock.patch.object(self.bgp_plugin, 'wait_down_agents').start()
+
+            self.bgp_plugin.reschedule_bgp_speakers_from_down_dragents()
+            dragents = self.bgp_plugin.get_dragents_hosting_bgp_speakers(
+                                                    self.context, [ri['id']])
+            self.assertEqual([expected_agent.id],
+                             [dragent.id for dragent in dragents])
+
+    def test_reschedule_bgp_speaker_from_down_dragent(self):
+        self._test_reschedule_bgp_speaker_from_down_dragent(True)
+
+    def test_reschedule_bgp_speaker_without_spare_dragent(self):
+        self._test_reschedule_bgp_speaker_from_down_dragent(False)
+
+    def test_get_dragents_by_bgp_speaker(self):
+        with self.bgp_speaker(4, 1) as ri1, self.bgp_speaker(4, 2) as ri2:
+            with self.bgp_speaker(4, 3) as ri3:
+                agent1 = helpers.register_bgp_dragent(host='host1')
+                agent2 = helpers.register_bgp_dragent(
+                    host='host2', configurations={'max_bgp_speakers': 2})
+                for agent, ri in ((agent1, ri1), (agent2, ri1),
+                                  (agent2, ri2)):
+                    self.bgp_plugin.add_bgp_speaker_to_dragent(
+                        self.context, agent.id, ri['id'])
+                # Look the BGP speakers up in several chunks
+                mock.patch.object(bgp_dras_db, 'BGP_SPEAKER_ID_CHUNK_SIZE',
+                                  2).start()
+
+                dragents = self.bgp_plugin.get_dragents_by_bgp_speaker(
+                    self.context, [ri1['id'], ri2['id'], ri3['id']])
+                self.assertEqual(
+                    {ri1['id']: set([agent1.id, agent2.id]),
+                     ri2['id']: set([agent2.id]),
+                     ri3['id']: set()},
+                    {bgp_speaker_id: set(agent.id for agent in agents)
+                     for bgp_speaker_id, agents in dragents.items()})
+
+    def test_get_dragent_hosts_by_bgp_speaker_cached(self):
+        with self.bgp_speaker(4, 1234) as ri:
+            agent = helpers.register_bgp_dragent(host='host1')
+            plugin = self.bgp_plugin
+            self.assertEqual({ri['id']: []},
+                             plugin.get_dragent_hosts_by_bgp_speaker(
+                                 self.context, [ri['id']]))
+            plugin.add_bgp_speaker_to_dragent(self.context, agent.id,
+                                              ri['id'])
+            self.assertEqual({ri['id']: ['host1']},
+                             plugin.get_dragent_hosts_by_bgp_speaker(
+                                 self.context, [ri['id']]))
+
+            lookup = mock.patch.object(
+                plugin, '_get_dragent_hosts_by_agent_ids',
+                wraps=plugin._get_dragent_hosts_by_agent_ids).start()
+            plugin.get_dragent_hosts_by_bgp_speaker(self.context, [ri['id']])
+            self.assertFalse(lookup.called)
+
+            # Bindings changed through another worker are seen at once
+            with self.context.session.begin(subtransactions=True):
+                query = self.context.session.query(
+                    bgp_dras_db.BgpSpeakerDrAgentBinding)
+                query.filter_by(bgp_speaker_id=ri['id']).delete()
+            self.assertEqual({ri['id']: []},
+                             plugin.get_dragent_hosts_by_bgp_speaker(
+                                 self.context, [ri['id']]))
+            with self.context.session.begin(subtransactions=True):
+                self.context.session.add(bgp_dras_db.BgpSpeakerDrAgentBinding(
+                    agent_id=agent.id, bgp_speaker_id=ri['id']))
+            self.assertEqual({ri['id']: ['host1']},
+                             plugin.get_dragent_hosts_by_bgp_speaker(
+                                 self.context, [ri['id']]))
+            self.assertFalse(lookup.called)
+
+            plugin.invalidate_dragent_hosts(host='host1')
+            self.assertEqual({ri['id']: ['host1']},
+                             plugin.get_dragent_hosts_by_bgp_speaker(
+                                 self.context, [ri['id']]))
+            self.assertEqual(1, lookup.call_count)
+
     def test_non_scheduled_bgp_speaker_binding_removal(self):
         """Test exception while removing an invalid binding."""
         with self.bgp_speaker(4, 1234) as ri1:
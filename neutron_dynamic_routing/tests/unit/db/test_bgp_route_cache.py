@@ -0,0 +1,74 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+
+from neutron.tests import base
+
+from neutron_dynamic_routing.db import bgp_route_cache
+
+ROUTE_1 = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+ROUTE_2 = {'destination': '20.0.0.0/24', 'next_hop': '1.1.1.1'}
+
+
+class TestBgpSpeakerRouteCache(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestBgpSpeakerRouteCache, self).setUp()
+        self.now = 1000.0
+        utcnow_ts_p = mock.patch.object(bgp_route_cache.timeutils,
+                                        'utcnow_ts',
+                                        side_effect=lambda **kw: self.now)
+        utcnow_ts_p.start()
+        self.cache = bgp_route_cache.BgpSpeakerRouteCache(size=2, ttl=10)
+
+    def test_get_cached_routes(self):
+        self.assertIsNone(self.cache.get('foo-id', 1))
+        self.cache.put('foo-id', 1, [ROUTE_1])
+        routes = self.cache.get('foo-id', 1)
+        self.assertEqual((ROUTE_1,), routes)
+        # The cached routes are served without being copied
+        self.assertIs(routes, self.cache.get('foo-id', 1))
+        self.assertEqual({'size': 1, 'max_size': 2, 'hits': 2,
+                          'misses': 1, 'evictions': 0},
+                         self.cache.get_stats())
+
+    def test_get_other_generation(self):
+        self.cache.put('foo-id', 1, [ROUTE_1])
+        self.assertIsNone(self.cache.get('foo-id', 2))
+        self.assertIsNone(self.cache.get('foo-id', 1))
+
+    def test_get_expired(self):
+        self.cache.put('foo-id', 1, [ROUTE_1])
+        self.now += 10
+        self.assertIsNone(self.cache.get('foo-id', 1))
+
+    def test_put_evicts_least_recently_used(self):
+        self.cache.put('foo-id', 1, [ROUTE_1])
+        self.cache.put('bar-id', 1, [ROUTE_2])
+        self.cache.get('foo-id', 1)
+        self.cache.put('baz-id', 1, [ROUTE_2])
+        self.assertIsNone(self.cache.get('bar-id', 1))
+        self.assertEqual((ROUTE_1,), self.cache.get('foo-id', 1))
+        self.assertEqual(1, self.cache.get_stats()['evictions'])
+
+    def test_invalidate(self):
+        self.cache.put('foo-id', 1, [ROUTE_1])
+        self.cache.invalidate('foo-id')
+        self.assertIsNone(self.cache.get('foo-id', 1))
+
+    def test_disabled(self):
+        cache = bgp_route_cache.BgpSpeakerRouteCache(size=0)
+        cache.put('foo-id', 1, [ROUTE_1])
+        self.assertIsNone(cache.get('foo-id', 1))
@@ -0,0 +1,84 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+
+from neutron.tests import base
+
+from neutron_dynamic_routing.db import bgp_vrf_cache
+
+VRF_1 = {'id': 'vrf-1', 'import_targets': ['100:1'],
+         'export_targets': ['100:2'], 'segmentation_id': '100'}
+VRF_2 = {'id': 'vrf-2', 'import_targets': ['200:1'],
+         'export_targets': [], 'segmentation_id': '200'}
+
+
+class TestRouterVrfIndex(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRouterVrfIndex, self).setUp()
+        self.now = 1000.0
+        utcnow_ts_p = mock.patch.object(bgp_vrf_cache.timeutils,
+                                        'utcnow_ts',
+                                        side_effect=lambda **kw: self.now)
+        utcnow_ts_p.start()
+        self.index = bgp_vrf_cache.RouterVrfIndex(ttl=10)
+
+    def test_get_loaded_vrfs(self):
+        self.assertIsNone(self.index.get('router-1'))
+        self.index.load([('router-1', VRF_2), ('router-1', VRF_1),
+                         ('router-2', VRF_1)])
+        vrfs = self.index.get('router-1')
+        self.assertEqual([VRF_1, VRF_2], vrfs)
+        # The indexed BGPVRFs are not shared with the caller
+        vrfs[0]['import_targets'].append('100:3')
+        self.assertEqual([VRF_1], self.index.get('router-2'))
+        self.assertEqual([], self.index.get('router-3'))
+        self.assertEqual({'routers': 2, 'hits': 3, 'misses': 1, 'loads': 1},
+                         self.index.get_stats())
+
+    def test_get_expired(self):
+        self.index.load([('router-1', VRF_1)])
+        self.now += 10
+        self.assertIsNone(self.index.get('router-1'))
+        # Changes are not applied to an index which is not loaded
+        self.index.add_router('router-1', VRF_2)
+        self.assertIsNone(self.index.get('router-1'))
+
+    def test_add_remove_router(self):
+        self.index.load([('router-1', VRF_1)])
+        self.index.add_router('router-1', VRF_2)
+        self.index.add_router('router-2', VRF_2)
+        self.assertEqual([VRF_1, VRF_2], self.index.get('router-1'))
+        self.index.remove_router('router-1', 'vrf-1')
+        self.index.remove_router('router-2', 'vrf-2')
+        self.assertEqual([VRF_2], self.index.get('router-1'))
+        self.assertEqual([], self.index.get('router-2'))
+        self.assertEqual(1, self.index.get_stats()['routers'])
+
+    def test_update_remove_vrf(self):
+        self.index.load([('router-1', VRF_1), ('router-1', VRF_2),
+                         ('router-2', VRF_1)])
+        vrf = dict(VRF_1, import_targets=['100:3'])
+        self.index.update_vrf(vrf)
+        self.assertEqual([vrf, VRF_2], self.index.get('router-1'))
+        self.assertEqual([vrf], self.index.get('router-2'))
+        self.index.remove_vrf('vrf-1')
+        self.assertEqual([VRF_2], self.index.get('router-1'))
+        self.assertEqual([], self.index.get('router-2'))
+
+    def test_disabled(self):
+        index = bgp_vrf_cache.RouterVrfIndex(ttl=0)
+        index.load([('router-1', VRF_1)])
+        self.assertIsNone(index.get('router-1'))
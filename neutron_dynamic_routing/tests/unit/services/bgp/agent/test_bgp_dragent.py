@@ -29,6 +29,7 @@ from neutron.tests import base
 
 from neutron_dynamic_routing.services.bgp.agent import bgp_dragent
 from neutron_dynamic_routing.services.bgp.agent import config as bgp_config
+from neutron_dynamic_routing.services.bgp.agent.driver import exceptions as driver_exc  # noqa
 
 HOSTNAME = 'hostname'
 rpc_api = bgp_dragent.BgpDrPluginApi
@@ -66,6 +67,7 @@ class TestBgpDrAgent(base.BaseTestCase):
         super(TestBgpDrAgent, self).setUp()
         cfg.CONF.register_opts(bgp_config.BGP_DRIVER_OPTS, 'BGP')
         cfg.CONF.register_opts(bgp_config.BGP_PROTO_CONFIG_OPTS, 'BGP')
+        cfg.CONF.register_opts(bgp_config.BGP_AGENT_OPTS, 'BGP')
         mock_log_p = mock.patch.object(bgp_dragent, 'LOG')
         self.mock_log = mock_log_p.start()
         self.driver_cls_p = mock.patch(
@@ -135,7 +137,8 @@ class TestBgpDrAgent(base.BaseTestCase):
             if not synced_bgp_speakers:
                 synced_bgp_speakers = []
 
-            bgp_dr.plugin_rpc.get_bgp_speakers.return_value = bgp_speaker_list
+            bgp_dr.plugin_rpc.get_bgp_speakers_delta.return_value = (
+                bgp_speaker_list)
             bgp_dr.cache.cache = cached_info
             bgp_dr.cache.clear_cache = mock.Mock()
             bgp_dr.sync_state(mock.ANY)
@@ -283,7 +286,7 @@ class TestBgpDrAgent(base.BaseTestCase):
              for a in ['remove_bgp_peer_from_bgp_speaker',
                        'add_bgp_peers_to_bgp_speaker',
                        'advertise_routes_via_bgp_speaker',
-                       'withdraw_route_via_bgp_speaker']])
+                       '_withdraw_routes']])
 
         with mock.patch.multiple(bgp_dr, **attrs_to_mock):
             bgp_dr.cache.cache = cached_info
@@ -306,15 +309,12 @@ class TestBgpDrAgent(base.BaseTestCase):
                 bgp_dr.add_bgp_peers_to_bgp_speaker.assert_called_with(
                     bgp_speaker)
 
-            self.assertEqual(
-                withdraw_route_call_count,
-                bgp_dr.withdraw_route_via_bgp_speaker.call_count)
+            self.assertEqual(withdraw_route_call_count,
+                             bgp_dr._withdraw_routes.call_count)
 
             if withdraw_route_call_count:
-                expected_calls = [mock.call(bgp_speaker['id'], 12345, route)
-                                  for route in withdraw_routes_list]
-                bgp_dr.withdraw_route_via_bgp_speaker.assert_has_calls(
-                    expected_calls)
+                bgp_dr._withdraw_routes.assert_called_once_with(
+                    bgp_speaker['id'], 12345, withdraw_routes_list)
 
             self.assertEqual(advertise_routes_called,
                              bgp_dr.advertise_routes_via_bgp_speaker.called)
@@ -336,7 +336,8 @@ class TestBgpDrAgent(base.BaseTestCase):
 
         cached_bgp_speaker = {'foo-id': {'bgp_speaker': {'local_as': 12345},
                                          'peers': cached_peers,
-                                         'advertised_routes': []}}
+                                         'advertised_routes': {},
+                                         'next_hops': {}}}
         self._test_sync_bgp_speaker_helper(
             bgp_speaker, cached_info=cached_bgp_speaker,
             remove_bgp_peer_call_count=1,
@@ -360,7 +361,9 @@ class TestBgpDrAgent(base.BaseTestCase):
         cached_bgp_speaker = {
             'foo-id': {'bgp_speaker': {'local_as': 12345},
                        'peers': {},
-                       'advertised_routes': cached_adv_routes}}
+                       'advertised_routes': dict(
+                           (r['destination'], r) for r in cached_adv_routes),
+                       'next_hops': {}}}
 
         self._test_sync_bgp_speaker_helper(
             bgp_speaker, cached_info=cached_bgp_speaker,
@@ -384,17 +387,85 @@ class TestBgpDrAgent(base.BaseTestCase):
         cached_bgp_speaker = {
             'foo-id': {'bgp_speaker': {'local_as': 12345},
                        'peers': {},
-                       'advertised_routes': []}}
+                       'advertised_routes': {},
+                       'next_hops': {}}}
 
         self._test_sync_bgp_speaker_helper(
             bgp_speaker, cached_info=cached_bgp_speaker,
             add_bgp_peers_called=True,
             advertise_routes_called=True)
 
+    def test_sync_bgp_speaker_routes_delta(self):
+        cached_adv_routes = [{'destination': '10.0.0.0/24',
+                              'next_hop': '1.1.1.1'},
+                             {'destination': '20.0.0.0/24',
+                              'next_hop': '2.2.2.2'}]
+        adv_routes = [{'destination': '20.0.0.0/24', 'next_hop': '9.9.9.9'},
+                      {'destination': '30.0.0.0/24', 'next_hop': '3.3.3.3'}]
+        bgp_speaker = {'id': 'foo-id',
+                       'local_as': 12345,
+                       'generation': 7,
+                       'full_sync': False,
+                       'peers': [],
+                       'advertised_routes': adv_routes,
+                       'withdrawn_routes': [{'destination': '10.0.0.0/24'},
+                                            {'destination': '40.0.0.0/24'}]}
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345,
+                                      'generation': 5})
+        for route in cached_adv_routes:
+            bgp_dr.cache.put_adv_route('foo-id', route)
+
+        attrs_to_mock = dict(
+            [(a, mock.MagicMock())
+             for a in ['advertise_routes_via_bgp_speaker',
+                       '_withdraw_routes']])
+        with mock.patch.multiple(bgp_dr, **attrs_to_mock):
+            bgp_dr.sync_bgp_speaker(bgp_speaker)
+
+            bgp_dr._withdraw_routes.assert_called_once_with(
+                'foo-id', 12345, cached_adv_routes)
+            bgp_dr.advertise_routes_via_bgp_speaker.assert_called_with(
+                bgp_speaker)
+        self.assertEqual({'foo-id': 7}, bgp_dr.cache.get_generations())
+
+    def test_sync_bgp_speaker_driver_failure_invalidates_generation(self):
+        bgp_speaker = {'id': 'foo-id',
+                       'local_as': 12345,
+                       'generation': 7,
+                       'peers': [],
+                       'advertised_routes': [FAKE_ROUTE]}
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345,
+                                      'generation': 5})
+        with mock.patch.object(bgp_dr.dr_driver_cls,
+                               'advertise_routes') as advertise_routes:
+            advertise_routes.side_effect = RuntimeError
+            bgp_dr.sync_bgp_speaker(bgp_speaker)
+        self.assertEqual({}, bgp_dr.cache.get_generations())
+        self.assertTrue(bgp_dr.is_resync_scheduled('foo-id'))
+
+    def test_sync_bgp_speaker_lost_by_driver(self):
+        bgp_peer = {'peer_ip': '1.1.1.1', 'remote_as': 34567,
+                    'auth_type': 'none', 'password': None}
+        bgp_speaker = {'id': 'foo-id', 'local_as': 12345,
+                       'peers': [bgp_peer],
+                       'advertised_routes': [FAKE_ROUTE]}
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345})
+        driver = bgp_dr.dr_driver_cls
+        driver.add_bgp_peer.side_effect = (
+            driver_exc.BgpSpeakerNotAdded(local_as=12345, rtid='1.1.1.1'))
+        bgp_dr.sync_bgp_speaker(bgp_speaker)
+        # The resync adds the BGP speaker again from scratch
+        self.assertFalse(bgp_dr.cache.is_bgp_speaker_added('foo-id'))
+        self.assertTrue(bgp_dr.is_resync_scheduled('foo-id'))
+        self.assertFalse(driver.advertise_routes.called)
+
     def test_sync_state_plugin_error(self):
         with mock.patch(BGP_PLUGIN) as plug:
             mock_plugin = mock.Mock()
-            mock_plugin.get_bgp_speakers.side_effect = Exception
+            mock_plugin.get_bgp_speakers_delta.side_effect = Exception
             plug.return_value = mock_plugin
 
             with mock.patch.object(bgp_dragent.LOG, 'error') as log:
@@ -406,6 +477,138 @@ class TestBgpDrAgent(base.BaseTestCase):
                     self.assertTrue(log.called)
                     self.assertTrue(schedule_full_resync.called)
 
+    def test_sync_state_bounded_by_sync_workers(self):
+        cfg.CONF.set_override('bgp_sync_workers', 2, 'BGP')
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_speaker_list = [{'id': 'foo-id', 'peers': [],
+                             'advertised_routes': []}]
+        with mock.patch.object(bgp_dr, 'plugin_rpc') as plugin_rpc,\
+                mock.patch.object(bgp_dr,
+                    'safe_configure_dragent_for_bgp_speaker') as configure,\
+                mock.patch.object(bgp_dragent.eventlet,
+                                  'GreenPool',
+                                  wraps=eventlet.GreenPool) as pool:
+            plugin_rpc.get_bgp_speakers_delta.return_value = bgp_speaker_list
+            bgp_dr.sync_state(mock.ANY)
+            pool.assert_called_once_with(2)
+            configure.assert_called_once_with(bgp_speaker_list[0])
+
+    def test_sync_state_bgp_speaker_error(self):
+        bgp_speaker_list = [{'id': 'foo-id', 'peers': [],
+                             'advertised_routes': []},
+                            {'id': 'bar-id', 'peers': [],
+                             'advertised_routes': []}]
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345,
+                                      'generation': 5})
+        bgp_dr.cache.put_bgp_speaker({'id': 'bar-id', 'local_as': 12345,
+                                      'generation': 5})
+        with mock.patch.object(bgp_dr, 'plugin_rpc') as plugin_rpc,\
+                mock.patch.object(bgp_dr, 'sync_bgp_speaker') as sync,\
+                mock.patch.object(bgp_dr,
+                    'schedule_full_resync') as schedule_full_resync:
+            plugin_rpc.get_bgp_speakers_delta.return_value = bgp_speaker_list
+            sync.side_effect = [RuntimeError, None]
+            bgp_dr.sync_state(mock.ANY)
+            self.assertEqual(2, sync.call_count)
+            self.assertFalse(schedule_full_resync.called)
+            self.assertIsInstance(
+                bgp_dr.resync_queue.is_scheduled(
+                    'foo-id', bgp_dragent.RESYNC_PRIORITY_ERROR)[0],
+                RuntimeError)
+            self.assertFalse(bgp_dr.is_resync_scheduled('bar-id'))
+            self.assertEqual(["Periodic route cache refresh"],
+                             bgp_dr.resync_queue.is_scheduled('bar-id'))
+            # The failed BGP speaker requests a full snapshot next
+            self.assertEqual({'bar-id': 5}, bgp_dr.cache.get_generations())
+
+    def test_sync_state_concurrent(self):
+        bgp_speaker_list = [{'id': 'foo-id', 'peers': [],
+                             'advertised_routes': []},
+                            {'id': 'bar-id', 'peers': [],
+                             'advertised_routes': []}]
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345})
+        bgp_dr.cache.put_bgp_speaker({'id': 'bar-id', 'local_as': 12345})
+        synced = []
+
+        def sync(bgp_speaker):
+            if bgp_speaker['id'] == 'foo-id':
+                # Another BGP speaker is resynced meanwhile
+                bgp_dr.sync_state(mock.ANY, bgp_speakers=['bar-id'])
+            synced.append(bgp_speaker['id'])
+
+        with mock.patch.object(bgp_dr, 'plugin_rpc') as plugin_rpc,\
+                mock.patch.object(bgp_dr, 'sync_bgp_speaker',
+                                  side_effect=sync):
+            plugin_rpc.get_bgp_speakers_delta.return_value = bgp_speaker_list
+            bgp_dr.sync_state(mock.ANY, bgp_speakers=['foo-id'])
+        self.assertEqual(['bar-id', 'foo-id'], synced)
+
+    def test_sync_state_bgp_speakers_order(self):
+        bgp_speaker_list = [{'id': 'foo-id', 'peers': [],
+                             'advertised_routes': []},
+                            {'id': 'bar-id', 'peers': [],
+                             'advertised_routes': []}]
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        with mock.patch.object(bgp_dr, 'plugin_rpc') as plugin_rpc,\
+                mock.patch.object(bgp_dr,
+                    'safe_configure_dragent_for_bgp_speaker') as configure:
+            plugin_rpc.get_bgp_speakers_delta.return_value = bgp_speaker_list
+            bgp_dr.sync_state(mock.ANY,
+                              bgp_speakers=['bar-id', 'baz-id', 'foo-id'])
+            self.assertEqual([mock.call(bgp_speaker_list[1]),
+                              mock.call(bgp_speaker_list[0])],
+                             configure.call_args_list)
+
+    def test_save_and_restore_state(self):
+        cfg.CONF.set_override('bgp_state_file',
+                              self.get_temp_file_path('bgp-dragent.state'),
+                              'BGP')
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker(dict(FAKE_BGP_SPEAKER, generation=7))
+        bgp_dr.cache.put_bgp_peer(FAKE_BGP_SPEAKER['id'], FAKE_BGP_PEER)
+        bgp_dr.cache.put_adv_route(FAKE_BGP_SPEAKER['id'], FAKE_ROUTE)
+        bgp_dr.save_state()
+
+        restored_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        restored_dr.restore_state()
+        self.assertEqual({FAKE_BGP_SPEAKER['id']: 7},
+                         restored_dr.cache.get_generations())
+        self.assertEqual(FAKE_BGP_PEER,
+                         restored_dr.cache.get_bgp_peer_by_ip(
+                             FAKE_BGP_SPEAKER['id'],
+                             FAKE_BGP_PEER['peer_ip']))
+        self.assertEqual([FAKE_ROUTE], restored_dr.cache.get_adv_routes(
+                                                    FAKE_BGP_SPEAKER['id']))
+        restored_dr.dr_driver_cls.add_bgp_speaker.assert_called_once_with(
+                                                FAKE_BGP_SPEAKER['local_as'])
+
+    def test_save_state_unchanged(self):
+        cfg.CONF.set_override('bgp_state_file',
+                              self.get_temp_file_path('bgp-dragent.state'),
+                              'BGP')
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker(FAKE_BGP_SPEAKER)
+        bgp_dr.save_state()
+        with mock.patch.object(bgp_dragent.jsonutils, 'dumps') as dumps:
+            bgp_dr.save_state()
+            self.assertFalse(dumps.called)
+        bgp_dr.cache.put_adv_route(FAKE_BGP_SPEAKER['id'], FAKE_ROUTE)
+        with mock.patch.object(bgp_dragent.os, 'rename') as rename:
+            bgp_dr.save_state()
+            self.assertTrue(rename.called)
+
+    def test_restore_state_without_state_file(self):
+        cfg.CONF.set_override('bgp_state_file',
+                              self.get_temp_file_path('bgp-dragent.state'),
+                              'BGP')
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        with mock.patch.object(bgp_dr, 'safe_configure_dragent_for_'
+                                       'bgp_speaker') as configure:
+            bgp_dr.restore_state()
+            self.assertFalse(configure.called)
+
     def test_periodic_resync(self):
         bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
         with mock.patch.object(bgp_dr,
@@ -421,7 +624,23 @@ class TestBgpDrAgent(base.BaseTestCase):
             with testtools.ExpectedException(RuntimeError):
                 bgp_dr._periodic_resync_helper(self.context)
             self.assertTrue(sync_state.called)
-            self.assertEqual(len(bgp_dr.needs_resync_reasons), 0)
+            self.assertEqual(len(bgp_dr.resync_queue), 0)
+
+    def test_periodic_resync_helper_not_due(self):
+        cfg.CONF.set_override('bgp_route_refresh_interval', 300, 'BGP')
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.schedule_route_refresh('foo-id')
+        with mock.patch.object(bgp_dr, 'sync_state') as sync_state:
+            bgp_dr._periodic_resync_helper(self.context)
+            self.assertFalse(sync_state.called)
+            self.assertEqual(len(bgp_dr.resync_queue), 1)
+
+    def test_schedule_route_refresh_after_error(self):
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.schedule_resync('foo reason', 'foo-id')
+        bgp_dr.schedule_route_refresh('foo-id')
+        self.assertEqual(['foo reason'],
+                         bgp_dr.resync_queue.is_scheduled('foo-id'))
 
     def _test_add_bgp_peer_helper(self, bgp_speaker_id,
                                   bgp_peer, cached_bgp_speaker,
@@ -478,7 +697,8 @@ class TestBgpDrAgent(base.BaseTestCase):
         route = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
         cached_bgp_speaker = {'foo-id': {'bgp_speaker': {'local_as': 12345},
                                          'peers': {},
-                                         'advertised_routes': []}}
+                                         'advertised_routes': {},
+                                         'next_hops': {}}}
 
         self._test_advertise_route_helper('foo-id', route, cached_bgp_speaker,
                                           put_adv_route_called=True)
@@ -487,11 +707,157 @@ class TestBgpDrAgent(base.BaseTestCase):
         route = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
         cached_bgp_speaker = {'foo-id': {'bgp_speaker': {'local_as': 12345},
                                          'peers': {},
-                                         'advertised_routes': [route]}}
+                                         'advertised_routes': {
+                                             route['destination']: route},
+                                         'next_hops': {
+                                             route['next_hop']: set(
+                                                 [route['destination']])}}}
 
         self._test_advertise_route_helper('foo-id', route, cached_bgp_speaker,
                                           put_adv_route_called=False)
 
+    def test_advertise_routes_via_bgp_speaker(self):
+        cached_route = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+        new_route = {'destination': '20.0.0.0/24', 'next_hop': '1.1.1.1'}
+        bgp_speaker = {'id': 'foo-id', 'local_as': 12345,
+                       'advertised_routes': [cached_route, new_route]}
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker(bgp_speaker)
+        bgp_dr.cache.put_adv_route('foo-id', cached_route)
+        with mock.patch.object(bgp_dr.dr_driver_cls,
+                               'advertise_routes') as advertise_routes:
+            bgp_dr.advertise_routes_via_bgp_speaker(bgp_speaker)
+            advertise_routes.assert_called_once_with(12345, [new_route])
+        self.assertItemsEqual([cached_route, new_route],
+                              bgp_dr.cache.get_adv_routes('foo-id'))
+
+    def test_advertise_and_withdraw_routes_aggregated(self):
+        routes = [{'destination': '10.0.0.%d/32' % i, 'next_hop': '1.1.1.1'}
+                  for i in range(4)]
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345,
+                                      'aggregate_routes': True})
+        with mock.patch.multiple(bgp_dr.dr_driver_cls,
+                                 advertise_routes=mock.DEFAULT,
+                                 withdraw_routes=mock.DEFAULT) as driver:
+            bgp_dr.add_routes_helper('foo-id', routes)
+            driver['advertise_routes'].assert_called_once_with(
+                12345, [{'destination': '10.0.0.0/30',
+                         'next_hop': '1.1.1.1'}])
+            self.assertFalse(driver['withdraw_routes'].called)
+
+            driver['advertise_routes'].reset_mock()
+            bgp_dr.withdraw_routes_helper('foo-id', [routes[3]])
+            driver['advertise_routes'].assert_called_once_with(
+                12345, [{'destination': '10.0.0.0/31', 'next_hop': '1.1.1.1'},
+                        {'destination': '10.0.0.2/32', 'next_hop': '1.1.1.1'}])
+            driver['withdraw_routes'].assert_called_once_with(
+                12345, ['10.0.0.0/30'])
+        self.assertItemsEqual(routes[:3],
+                              bgp_dr.cache.get_adv_routes('foo-id'))
+
+    def test_sync_bgp_speaker_enables_route_aggregation(self):
+        routes = [{'destination': '10.0.0.%d/32' % i, 'next_hop': '1.1.1.1'}
+                  for i in range(2)]
+        bgp_speaker = {'id': 'foo-id', 'local_as': 12345, 'peers': [],
+                       'aggregate_routes': True,
+                       'advertised_routes': routes}
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345})
+        for route in routes:
+            bgp_dr.cache.put_adv_route('foo-id', route)
+        with mock.patch.multiple(bgp_dr.dr_driver_cls,
+                                 advertise_routes=mock.DEFAULT,
+                                 withdraw_routes=mock.DEFAULT) as driver:
+            bgp_dr.sync_bgp_speaker(bgp_speaker)
+            driver['advertise_routes'].assert_called_once_with(
+                12345, [{'destination': '10.0.0.0/31',
+                         'next_hop': '1.1.1.1'}])
+            driver['withdraw_routes'].assert_called_once_with(
+                12345, mock.ANY)
+            self.assertItemsEqual(
+                [route['destination'] for route in routes],
+                driver['withdraw_routes'].call_args[0][1])
+        self.assertIsNotNone(bgp_dr.cache.get_route_aggregator('foo-id'))
+        self.assertTrue(bgp_dr.cache.get_bgp_speaker_by_id(
+                                            'foo-id')['aggregate_routes'])
+
+    def test_sync_vrfs(self):
+        routes = [{'destination': '10.0.%d.0/24' % i, 'gateway_ip':
+                   '10.0.%d.1' % i} for i in range(3)]
+        vrf = {'id': 'vrf-1', 'route_distinguisher': '12345:100',
+               'import_targets': ['100:1'], 'export_targets': ['100:1'],
+               'vni': 100, 'routes': routes[:2]}
+        old_vrf = dict(vrf, id='vrf-2', route_distinguisher='12345:200')
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345})
+        bgp_dr.sync_vrfs({'id': 'foo-id', 'local_as': 12345,
+                          'vrfs': [vrf, old_vrf]})
+        driver = bgp_dr.dr_driver_cls
+        driver.add_vrf.assert_has_calls(
+            [mock.call(12345, '12345:100', ['100:1'], ['100:1']),
+             mock.call(12345, '12345:200', ['100:1'], ['100:1'])],
+            any_order=True)
+        driver.advertise_vrf_routes.assert_has_calls(
+            [mock.call(12345, '12345:100', routes[:2], 100),
+             mock.call(12345, '12345:200', routes[:2], 100)],
+            any_order=True)
+
+        driver.reset_mock()
+        bgp_dr.sync_vrfs({'id': 'foo-id', 'local_as': 12345,
+                          'vrfs': [dict(vrf, routes=routes[1:])]})
+        driver.delete_vrf.assert_called_once_with(12345, '12345:200')
+        self.assertFalse(driver.add_vrf.called)
+        driver.advertise_vrf_routes.assert_called_once_with(
+            12345, '12345:100', routes[2:], 100)
+        driver.withdraw_vrf_routes.assert_called_once_with(
+            12345, '12345:100', ['10.0.0.0/24'])
+        self.assertEqual([dict(vrf, routes=routes[1:])],
+                         bgp_dr.cache.get_bgp_speakers_state()[0]['vrfs'])
+
+        # A delta leaves the VRFs out when they did not change
+        driver.reset_mock()
+        bgp_dr.sync_vrfs({'id': 'foo-id', 'local_as': 12345})
+        self.assertFalse(driver.method_calls)
+        self.assertEqual(1, len(bgp_dr.cache.get_vrfs('foo-id')))
+
+    def test_sync_bgp_speaker_enables_evpn(self):
+        bgp_peer = {'peer_ip': '1.1.1.1', 'remote_as': 34567,
+                    'auth_type': 'none', 'password': None}
+        bgp_speaker = {'id': 'foo-id', 'local_as': 12345, 'peers': [bgp_peer],
+                       'advertised_routes': [], 'vrfs': []}
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.add_bgp_speaker_on_dragent(bgp_speaker)
+        driver = bgp_dr.dr_driver_cls
+        driver.add_bgp_peer.assert_called_once_with(12345, '1.1.1.1', 34567,
+                                                    'none', None,
+                                                    enable_evpn=False)
+
+        driver.reset_mock()
+        vrf = {'id': 'vrf-1', 'route_distinguisher': '12345:100',
+               'import_targets': ['100:1'], 'export_targets': ['100:1'],
+               'vni': 100, 'routes': []}
+        bgp_dr.sync_bgp_speaker(dict(bgp_speaker, vrfs=[vrf]))
+        # The peer is added again to negotiate EVPN
+        driver.delete_bgp_peer.assert_called_once_with(12345, '1.1.1.1')
+        driver.add_bgp_peer.assert_called_once_with(12345, '1.1.1.1', 34567,
+                                                    'none', None,
+                                                    enable_evpn=True)
+
+    def test_withdraw_route_by_destination(self):
+        route = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+        bgp_dr = bgp_dragent.BgpDrAgent(HOSTNAME)
+        bgp_dr.cache.put_bgp_speaker({'id': 'foo-id', 'local_as': 12345})
+        bgp_dr.cache.put_adv_route('foo-id', route)
+        with mock.patch.object(bgp_dr.dr_driver_cls,
+                               'withdraw_routes') as withdraw_routes:
+            bgp_dr.withdraw_route_via_bgp_speaker(
+                'foo-id', 12345, {'destination': route['destination']})
+            withdraw_routes.assert_called_once_with(12345,
+                                                    [route['destination']])
+        self.assertEqual([], bgp_dr.cache.get_adv_routes('foo-id'))
+        self.assertFalse(bgp_dr.is_resync_scheduled('foo-id'))
+
 
 class TestBgpDrAgentEventHandler(base.BaseTestCase):
 
@@ -502,6 +868,7 @@ class TestBgpDrAgentEventHandler(base.BaseTestCase):
         super(TestBgpDrAgentEventHandler, self).setUp()
         cfg.CONF.register_opts(bgp_config.BGP_DRIVER_OPTS, 'BGP')
         cfg.CONF.register_opts(bgp_config.BGP_PROTO_CONFIG_OPTS, 'BGP')
+        cfg.CONF.register_opts(bgp_config.BGP_AGENT_OPTS, 'BGP')
 
         mock_log_p = mock.patch.object(bgp_dragent, 'LOG')
         self.mock_log = mock_log_p.start()
@@ -540,10 +907,23 @@ class TestBgpDrAgentEventHandler(base.BaseTestCase):
                                 'peer_id': FAKE_BGPPEER_UUID}}
 
         with mock.patch.object(self.bgp_dr,
-                               'add_bgp_peer_helper') as enable:
+                               'add_bgp_peers_helper') as enable:
             self.bgp_dr.bgp_peer_association_end(None, payload)
             enable.assert_called_once_with(FAKE_BGP_SPEAKER['id'],
-                                           FAKE_BGP_PEER['id'])
+                                           [FAKE_BGP_PEER['id']])
+
+    def test_bgp_peer_association_end_pending_peers(self):
+        payload = {'bgp_peer': {'speaker_id': FAKE_BGPSPEAKER_UUID,
+                                'peer_id': FAKE_BGPPEER_UUID}}
+        self.bgp_dr.pending_bgp_peer_ids[FAKE_BGPSPEAKER_UUID].add('peer-2')
+
+        with mock.patch.object(self.bgp_dr,
+                               'add_bgp_peers_helper') as enable:
+            self.bgp_dr.bgp_peer_association_end(None, payload)
+            enable.assert_called_once_with(
+                FAKE_BGP_SPEAKER['id'],
+                sorted([FAKE_BGP_PEER['id'], 'peer-2']))
+            self.assertFalse(self.bgp_dr.pending_bgp_peer_ids)
 
     def test_route_advertisement_end(self):
         routes = [{'destination': '2.2.2.2/32', 'next_hop': '3.3.3.3'},
@@ -558,6 +938,26 @@ class TestBgpDrAgentEventHandler(base.BaseTestCase):
             self.bgp_dr.bgp_routes_advertisement_end(None, payload)
             enable.assert_has_calls(expected_calls)
 
+    def test_bgp_speaker_vrfs_update_end(self):
+        payload = {'bgp_speaker': {'id': FAKE_BGPSPEAKER_UUID}}
+        with mock.patch.object(bgp_dragent.eventlet, 'spawn_n') as spawn_n:
+            self.bgp_dr.bgp_speaker_vrfs_update_end(None, payload)
+            self.bgp_dr.bgp_speaker_vrfs_update_end(None, payload)
+        self.assertTrue(self.bgp_dr.resync_queue.is_scheduled(
+                                                        FAKE_BGPSPEAKER_UUID))
+        self.assertFalse(self.bgp_dr.resync_queue.is_scheduled(
+                                        FAKE_BGPSPEAKER_UUID,
+                                        bgp_dragent.RESYNC_PRIORITY_ERROR))
+
+        # The resync is served at once, for both notifications
+        spawn_n.assert_called_once_with(self.bgp_dr._woken_resync)
+        with mock.patch.object(self.bgp_dr, 'sync_state') as sync_state:
+            self.bgp_dr._woken_resync()
+        sync_state.assert_called_once_with(
+            mock.ANY, full_sync=None, bgp_speakers=[FAKE_BGPSPEAKER_UUID])
+        self.assertFalse(self.bgp_dr.resync_queue.is_scheduled(
+                                                        FAKE_BGPSPEAKER_UUID))
+
     def test_add_bgp_speaker_helper(self):
         self.plugin.get_bgp_speaker_info.return_value = FAKE_BGP_SPEAKER
         add_bs_p = mock.patch.object(self.bgp_dr,
@@ -581,12 +981,27 @@ class TestBgpDrAgentEventHandler(base.BaseTestCase):
                                         FAKE_BGP_PEER['id'])])
         self.assertEqual(1, add_bp.call_count)
 
+    def test_add_bgp_peers_helper(self):
+        bgp_peer_2 = dict(FAKE_BGP_PEER, id='peer-2', peer_ip='2.2.2.3')
+        self.plugin.get_bgp_peers_info.return_value = [FAKE_BGP_PEER,
+                                                       bgp_peer_2]
+        add_bp_p = mock.patch.object(self.bgp_dr,
+                                     'add_bgp_peer_to_bgp_speaker')
+        add_bp = add_bp_p.start()
+        self.bgp_dr.add_bgp_peers_helper(FAKE_BGP_SPEAKER['id'],
+                                         [FAKE_BGP_PEER['id'], 'peer-2'])
+        self.plugin.assert_has_calls([
+            mock.call.get_bgp_peers_info(mock.ANY,
+                                         [FAKE_BGP_PEER['id'], 'peer-2'])])
+        self.assertFalse(self.plugin.get_bgp_peer_info.called)
+        self.assertEqual(2, add_bp.call_count)
+
     def test_add_routes_helper(self):
-        add_rt_p = mock.patch.object(self.bgp_dr,
-                                     'advertise_route_via_bgp_speaker')
+        add_rt_p = mock.patch.object(self.bgp_dr, '_advertise_routes')
         add_bp = add_rt_p.start()
         self.bgp_dr.add_routes_helper(FAKE_BGP_SPEAKER['id'], FAKE_ROUTES)
-        self.assertEqual(1, add_bp.call_count)
+        add_bp.assert_called_once_with(FAKE_BGP_SPEAKER['id'], mock.ANY,
+                                       FAKE_ROUTES)
 
     def test_bgp_speaker_remove_end(self):
         payload = {'bgp_speaker': {'id': FAKE_BGPSPEAKER_UUID}}
@@ -620,6 +1035,86 @@ class TestBgpDrAgentEventHandler(base.BaseTestCase):
             disable.assert_has_calls(expected_calls)
 
 
+class TestBgpSpeakerResyncQueue(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestBgpSpeakerResyncQueue, self).setUp()
+        self.queue = bgp_dragent.BgpSpeakerResyncQueue(max_backoff=4)
+        self.now = 1000.0
+        utcnow_ts_p = mock.patch.object(bgp_dragent.timeutils, 'utcnow_ts',
+                                        side_effect=lambda **kw: self.now)
+        utcnow_ts_p.start()
+
+    def test_schedule_coalesces_reasons(self):
+        self.queue.schedule('foo-id', 'Periodic route cache refresh',
+                            bgp_dragent.RESYNC_PRIORITY_REFRESH, delay=300)
+        self.queue.schedule('foo-id', RuntimeError('foo'),
+                            bgp_dragent.RESYNC_PRIORITY_ERROR)
+        self.queue.schedule('foo-id', RuntimeError('foo'),
+                            bgp_dragent.RESYNC_PRIORITY_ERROR)
+        self.assertEqual(1, len(self.queue))
+        reasons = self.queue.is_scheduled('foo-id',
+                                          bgp_dragent.RESYNC_PRIORITY_ERROR)
+        self.assertEqual(2, len(reasons))
+        self.assertEqual([('foo-id', reasons)], self.queue.pop_due())
+        self.assertEqual([], self.queue.pop_due())
+
+    def test_pop_due_by_priority(self):
+        self.queue.schedule('foo-id', 'Periodic route cache refresh',
+                            bgp_dragent.RESYNC_PRIORITY_REFRESH, delay=10)
+        self.queue.schedule('bar-id', 'BGP Speaker Out-of-sync',
+                            bgp_dragent.RESYNC_PRIORITY_ERROR, delay=20)
+        self.queue.schedule('baz-id', 'Periodic route cache refresh',
+                            bgp_dragent.RESYNC_PRIORITY_REFRESH, delay=300)
+        self.now += 10
+        self.assertEqual(['foo-id'],
+                         [bgp_speaker_id for bgp_speaker_id, reasons
+                          in self.queue.pop_due()])
+        self.queue.schedule('foo-id', 'Periodic route cache refresh',
+                            bgp_dragent.RESYNC_PRIORITY_REFRESH)
+        self.now += 10
+        self.assertEqual(['bar-id', 'foo-id'],
+                         [bgp_speaker_id for bgp_speaker_id, reasons
+                          in self.queue.pop_due()])
+        self.assertEqual(1, len(self.queue))
+
+    def test_schedule_backoff(self):
+        delays = []
+        for failure in range(5):
+            self.queue.schedule('foo-id', 'foo reason',
+                                bgp_dragent.RESYNC_PRIORITY_ERROR)
+            delays.append(self.queue.resyncs['foo-id']['due'] - self.now)
+            self.now += delays[-1]
+            self.assertEqual(1, len(self.queue.pop_due()))
+        self.assertEqual([0, 1, 2, 4, 4], delays)
+        self.queue.reset_backoff('foo-id')
+        self.queue.schedule('foo-id', 'foo reason',
+                            bgp_dragent.RESYNC_PRIORITY_ERROR)
+        self.assertEqual(1, len(self.queue.pop_due()))
+
+    def test_schedule_refresh_within_backoff(self):
+        self.queue.schedule('foo-id', 'foo reason',
+                            bgp_dragent.RESYNC_PRIORITY_ERROR)
+        self.assertEqual(1, len(self.queue.pop_due()))
+        self.queue.schedule('foo-id', 'foo reason',
+                            bgp_dragent.RESYNC_PRIORITY_ERROR)
+        self.queue.schedule('foo-id', 'BGP Speaker VRFs updated',
+                            bgp_dragent.RESYNC_PRIORITY_REFRESH)
+        # The refresh is served at once, without counting a failure
+        self.assertEqual(1, len(self.queue.pop_due()))
+        self.assertEqual(1, self.queue.failures['foo-id'])
+        self.queue.schedule('foo-id', 'foo reason',
+                            bgp_dragent.RESYNC_PRIORITY_ERROR)
+        self.assertEqual(1, self.queue.resyncs['foo-id']['due'] - self.now)
+
+    def test_cancel(self):
+        self.queue.schedule('foo-id', 'foo reason',
+                            bgp_dragent.RESYNC_PRIORITY_ERROR)
+        self.queue.cancel('foo-id')
+        self.assertIsNone(self.queue.is_scheduled('foo-id'))
+        self.assertEqual([], self.queue.pop_due())
+
+
 class TestBGPSpeakerCache(base.BaseTestCase):
 
     def setUp(self):
@@ -627,7 +1122,8 @@ class TestBGPSpeakerCache(base.BaseTestCase):
         self.expected_cache = {FAKE_BGP_SPEAKER['id']:
                                {'bgp_speaker': FAKE_BGP_SPEAKER,
                                 'peers': {},
-                                'advertised_routes': []}}
+                                'advertised_routes': {},
+                                'next_hops': {}}}
         self.bs_cache = bgp_dragent.BgpSpeakerCache()
 
     def test_put_bgp_speaker(self):
@@ -640,7 +1136,7 @@ class TestBGPSpeakerCache(base.BaseTestCase):
                                'remove_bgp_speaker_by_id') as remove:
             self.bs_cache.cache[FAKE_BGP_SPEAKER['id']] = prev_bs_info
             self.bs_cache.put_bgp_speaker(FAKE_BGP_SPEAKER)
-            remove.assert_called_once_with(prev_bs_info)
+            remove.assert_called_once_with(FAKE_BGP_SPEAKER['id'])
         self.assertEqual(self.expected_cache, self.bs_cache.cache)
 
     def remove_bgp_speaker_by_id(self):
@@ -689,28 +1185,37 @@ class TestBGPSpeakerCache(base.BaseTestCase):
         self.bs_cache.put_bgp_speaker(FAKE_BGP_SPEAKER)
         self.bs_cache.put_adv_route(FAKE_BGP_SPEAKER['id'], FAKE_ROUTE)
         expected_cache = copy.deepcopy(self.expected_cache)
-        expected_cache[FAKE_BGP_SPEAKER['id']]['advertised_routes'].append(
+        speaker_cache = expected_cache[FAKE_BGP_SPEAKER['id']]
+        speaker_cache['advertised_routes'][FAKE_ROUTE['destination']] = (
             FAKE_ROUTE)
+        speaker_cache['next_hops'][FAKE_ROUTE['next_hop']] = set(
+            [FAKE_ROUTE['destination']])
         self.assertEqual(expected_cache, self.bs_cache.cache)
 
         fake_route_2 = copy.deepcopy(FAKE_ROUTE)
         fake_route_2['destination'] = '4.4.4.4/32'
         self.bs_cache.put_adv_route(FAKE_BGP_SPEAKER['id'], fake_route_2)
 
-        expected_cache[FAKE_BGP_SPEAKER['id']]['advertised_routes'].append(
+        speaker_cache['advertised_routes'][fake_route_2['destination']] = (
             fake_route_2)
+        speaker_cache['next_hops'][FAKE_ROUTE['next_hop']].add(
+            fake_route_2['destination'])
         self.assertEqual(expected_cache, self.bs_cache.cache)
+        self.assertEqual(2, self.bs_cache.get_state()['advertise_routes'])
 
         if remove:
             self.bs_cache.remove_adv_route(FAKE_BGP_SPEAKER['id'],
                                            fake_route_2)
-            expected_cache[FAKE_BGP_SPEAKER['id']]['advertised_routes'] = (
-                [FAKE_ROUTE])
+            del speaker_cache['advertised_routes'][
+                fake_route_2['destination']]
+            speaker_cache['next_hops'][FAKE_ROUTE['next_hop']].discard(
+                fake_route_2['destination'])
             self.assertEqual(expected_cache, self.bs_cache.cache)
 
             self.bs_cache.remove_adv_route(FAKE_BGP_SPEAKER['id'],
                                            FAKE_ROUTE)
             self.assertEqual(self.expected_cache, self.bs_cache.cache)
+            self.assertEqual(0, self.bs_cache.get_state()['advertise_routes'])
 
     def test_put_bgp_speaker_adv_route(self):
         self._test_bgp_speaker_adv_route_helper()
@@ -725,3 +1230,61 @@ class TestBGPSpeakerCache(base.BaseTestCase):
         self.assertFalse(self.bs_cache.is_route_advertised(
             FAKE_BGP_SPEAKER['id'], {'destination': 'foo-destination',
                                      'next_hop': 'foo-next-hop'}))
+
+    def test_put_bgp_speaker_adv_route_new_next_hop(self):
+        self.bs_cache.put_bgp_speaker(FAKE_BGP_SPEAKER)
+        self.bs_cache.put_adv_route(FAKE_BGP_SPEAKER['id'], FAKE_ROUTE)
+        new_route = copy.deepcopy(FAKE_ROUTE)
+        new_route['next_hop'] = '5.5.5.5'
+        self.bs_cache.put_adv_route(FAKE_BGP_SPEAKER['id'], new_route)
+        self.assertEqual([new_route], self.bs_cache.get_adv_routes(
+            FAKE_BGP_SPEAKER['id']))
+        self.assertEqual([], self.bs_cache.get_adv_routes_by_next_hop(
+            FAKE_BGP_SPEAKER['id'], FAKE_ROUTE['next_hop']))
+        self.assertEqual([new_route],
+                         self.bs_cache.get_adv_routes_by_next_hop(
+                             FAKE_BGP_SPEAKER['id'], '5.5.5.5'))
+        self.assertEqual(1, self.bs_cache.get_state()['advertise_routes'])
+
+    def test_get_adv_routes_diff(self):
+        self.bs_cache.put_bgp_speaker(FAKE_BGP_SPEAKER)
+        kept_route = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+        moved_route = {'destination': '20.0.0.0/24', 'next_hop': '1.1.1.1'}
+        gone_route = {'destination': '30.0.0.0/24', 'next_hop': '1.1.1.1'}
+        for route in (kept_route, moved_route, gone_route):
+            self.bs_cache.put_adv_route(FAKE_BGP_SPEAKER['id'], route)
+        new_route = {'destination': '40.0.0.0/24', 'next_hop': '1.1.1.1'}
+        moved_route_2 = {'destination': '20.0.0.0/24', 'next_hop': '2.2.2.2'}
+
+        stale, new = self.bs_cache.get_adv_routes_diff(
+            FAKE_BGP_SPEAKER['id'], [kept_route, moved_route_2, new_route])
+        self.assertItemsEqual([moved_route, gone_route], stale)
+        self.assertItemsEqual([moved_route_2, new_route], new)
+
+    def test_generations(self):
+        bgp_speaker = dict(FAKE_BGP_SPEAKER, generation=5)
+        self.bs_cache.put_bgp_speaker(bgp_speaker)
+        self.assertEqual({bgp_speaker['id']: 5},
+                         self.bs_cache.get_generations())
+        self.bs_cache.invalidate_generation(bgp_speaker['id'])
+        self.assertEqual({}, self.bs_cache.get_generations())
+        self.bs_cache.set_generation(bgp_speaker['id'], 6)
+        self.assertEqual({bgp_speaker['id']: 6},
+                         self.bs_cache.get_generations())
+        self.bs_cache.remove_bgp_speaker_by_id(bgp_speaker['id'])
+        self.assertEqual({}, self.bs_cache.get_generations())
+
+    def test_get_state(self):
+        self.bs_cache.put_bgp_speaker(FAKE_BGP_SPEAKER)
+        self.bs_cache.put_bgp_peer(FAKE_BGP_SPEAKER['id'], FAKE_BGP_PEER)
+        self.bs_cache.put_bgp_peer(FAKE_BGP_SPEAKER['id'], FAKE_BGP_PEER)
+        self.bs_cache.put_adv_route(FAKE_BGP_SPEAKER['id'], FAKE_ROUTE)
+        self.assertEqual({'bgp_speakers': 1,
+                          'bgp_peers': 1,
+                          'advertise_routes': 1},
+                         self.bs_cache.get_state())
+        self.bs_cache.remove_bgp_speaker_by_id(FAKE_BGP_SPEAKER['id'])
+        self.assertEqual({'bgp_speakers': 0,
+                          'bgp_peers': 0,
+                          'advertise_routes': 0},
+                         self.bs_cache.get_state())
@@ -0,0 +1,106 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from neutron.tests import base
+
+from neutron_dynamic_routing.services.bgp.agent import route_aggregator
+
+
+def _routes(next_hop, *destinations):
+    return [{'destination': destination, 'next_hop': next_hop}
+            for destination in destinations]
+
+
+class TestRouteAggregator(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRouteAggregator, self).setUp()
+        self.aggregator = route_aggregator.RouteAggregator()
+
+    def test_merge_host_routes(self):
+        withdrawn, advertised = self.aggregator.update(
+            routes=_routes('1.1.1.1', '10.0.0.0/32', '10.0.0.1/32',
+                           '10.0.0.2/32'))
+        self.assertEqual([], withdrawn)
+        self.assertEqual(_routes('1.1.1.1', '10.0.0.0/31', '10.0.0.2/32'),
+                         advertised)
+
+        withdrawn, advertised = self.aggregator.update(
+            routes=_routes('1.1.1.1', '10.0.0.3/32'))
+        self.assertEqual(['10.0.0.0/31', '10.0.0.2/32'], withdrawn)
+        self.assertEqual(_routes('1.1.1.1', '10.0.0.0/30'), advertised)
+
+    def test_withdraw_splits_summary(self):
+        self.aggregator.update(
+            routes=_routes('1.1.1.1', '10.0.0.0/32', '10.0.0.1/32',
+                           '10.0.0.2/32', '10.0.0.3/32'))
+        withdrawn, advertised = self.aggregator.update(
+            withdrawn=['10.0.0.1/32'])
+        self.assertEqual(['10.0.0.0/30'], withdrawn)
+        self.assertEqual(_routes('1.1.1.1', '10.0.0.0/32', '10.0.0.2/31'),
+                         advertised)
+
+    def test_withdraw_route_covered_by_other_route(self):
+        self.aggregator.update(
+            routes=_routes('1.1.1.1', '10.0.0.0/24', '10.0.0.1/32'))
+        self.assertEqual(_routes('1.1.1.1', '10.0.0.0/24'),
+                         self.aggregator.get_routes())
+        self.assertEqual(([], []),
+                         self.aggregator.update(withdrawn=['10.0.0.1/32']))
+        self.assertEqual(([], []),
+                         self.aggregator.update(withdrawn=['unknown/32']))
+
+    def test_next_hops_not_merged(self):
+        self.aggregator.update(
+            routes=(_routes('1.1.1.1', '10.0.0.0/32') +
+                    _routes('2.2.2.2', '10.0.0.1/32')))
+        self.assertEqual(_routes('1.1.1.1', '10.0.0.0/32') +
+                         _routes('2.2.2.2', '10.0.0.1/32'),
+                         self.aggregator.get_routes())
+
+    def test_overlapping_next_hops_advertised_as_is(self):
+        self.aggregator.update(
+            routes=_routes('1.1.1.1', '10.0.0.0/32', '10.0.0.1/32',
+                           '10.0.0.2/32', '10.0.0.3/32'))
+        withdrawn, advertised = self.aggregator.update(
+            routes=_routes('2.2.2.2', '10.0.0.0/30'))
+        self.assertEqual([], withdrawn)
+        self.assertEqual(_routes('1.1.1.1', '10.0.0.0/32', '10.0.0.1/32',
+                                 '10.0.0.2/32', '10.0.0.3/32') +
+                         _routes('2.2.2.2', '10.0.0.0/30'),
+                         sorted(advertised,
+                                key=lambda route: route['next_hop']))
+
+        withdrawn, advertised = self.aggregator.update(
+            withdrawn=['10.0.0.0/30'])
+        self.assertEqual(['10.0.0.0/32', '10.0.0.1/32', '10.0.0.2/32',
+                          '10.0.0.3/32'], withdrawn)
+        self.assertEqual(_routes('1.1.1.1', '10.0.0.0/30'), advertised)
+
+    def test_next_hop_change(self):
+        self.aggregator.update(
+            routes=_routes('1.1.1.1', '10.0.0.0/32', '10.0.0.1/32'))
+        withdrawn, advertised = self.aggregator.update(
+            routes=_routes('2.2.2.2', '10.0.0.1/32'))
+        self.assertEqual(['10.0.0.0/31'], withdrawn)
+        self.assertEqual(_routes('1.1.1.1', '10.0.0.0/32') +
+                         _routes('2.2.2.2', '10.0.0.1/32'), advertised)
+
+    def test_merge_ipv6_routes(self):
+        withdrawn, advertised = self.aggregator.update(
+            routes=_routes('2001:db8::1', '2001:db8:1::/65',
+                           '2001:db8:1::8000:0:0:0/65'))
+        self.assertEqual([], withdrawn)
+        self.assertEqual(_routes('2001:db8::1', '2001:db8:1::/64'),
+                         advertised)
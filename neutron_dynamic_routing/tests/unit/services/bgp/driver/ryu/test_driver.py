@@ -26,10 +26,12 @@ from neutron.tests import base
 from neutron_dynamic_routing.services.bgp.agent import config as bgp_config
 from neutron_dynamic_routing.services.bgp.agent.driver import exceptions as bgp_driver_exc  # noqa
 from neutron_dynamic_routing.services.bgp.agent.driver.ryu import driver as ryu_driver  # noqa
+from neutron_dynamic_routing.services.bgp.agent.driver.ryu import speaker_process  # noqa
 
 # Test variables for BGP Speaker
 FAKE_LOCAL_AS1 = 12345
 FAKE_LOCAL_AS2 = 23456
+FAKE_LOCAL_AS3 = 34567
 FAKE_ROUTER_ID = '1.1.1.1'
 
 # Test variables for BGP Peer
@@ -40,8 +42,12 @@ FAKE_PEER_PASSWORD = 'awesome'
 
 # Test variables for Route
 FAKE_ROUTE = '2.2.2.0/24'
+FAKE_ROUTE_2 = '3.3.3.0/24'
 FAKE_NEXTHOP = '5.5.5.5'
 
+# Test variables for VRF
+FAKE_RD = '65000:100'
+
 
 class TestRyuBgpDriver(base.BaseTestCase):
 
@@ -86,7 +92,22 @@ class TestRyuBgpDriver(base.BaseTestCase):
                                             address=FAKE_PEER_IP,
                                             remote_as=FAKE_PEER_AS,
                                             password=None,
-                                            connect_mode=CONNECT_MODE_ACTIVE)
+                                            connect_mode=CONNECT_MODE_ACTIVE,
+                                            enable_evpn=False)
+
+    def test_add_bgp_peer_with_evpn(self):
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        self.ryu_bgp_driver.add_bgp_peer(FAKE_LOCAL_AS1,
+                                         FAKE_PEER_IP,
+                                         FAKE_PEER_AS,
+                                         enable_evpn=True)
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS1)
+        speaker.neighbor_add.assert_called_once_with(
+                                            address=FAKE_PEER_IP,
+                                            remote_as=FAKE_PEER_AS,
+                                            password=None,
+                                            connect_mode=CONNECT_MODE_ACTIVE,
+                                            enable_evpn=True)
 
     def test_add_bgp_peer_with_password(self):
         self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
@@ -102,7 +123,8 @@ class TestRyuBgpDriver(base.BaseTestCase):
             address=FAKE_PEER_IP,
             remote_as=FAKE_PEER_AS,
             password=encodeutils.to_utf8(FAKE_PEER_PASSWORD),
-            connect_mode=CONNECT_MODE_ACTIVE)
+            connect_mode=CONNECT_MODE_ACTIVE,
+            enable_evpn=False)
 
     def test_add_bgp_peer_with_unicode_password(self):
         self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
@@ -120,7 +142,8 @@ class TestRyuBgpDriver(base.BaseTestCase):
             address=FAKE_PEER_IP,
             remote_as=FAKE_PEER_AS,
             password=encodeutils.to_utf8(NEW_FAKE_PEER_PASSWORD),
-            connect_mode=CONNECT_MODE_ACTIVE)
+            connect_mode=CONNECT_MODE_ACTIVE,
+            enable_evpn=False)
 
     def test_remove_bgp_peer(self):
         self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
@@ -149,6 +172,101 @@ class TestRyuBgpDriver(base.BaseTestCase):
         speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS1)
         speaker.prefix_del.assert_called_once_with(prefix=FAKE_ROUTE)
 
+    def test_advertise_routes(self):
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        routes = [{'destination': FAKE_ROUTE, 'next_hop': FAKE_NEXTHOP},
+                  {'destination': FAKE_ROUTE_2, 'next_hop': FAKE_NEXTHOP}]
+        self.ryu_bgp_driver.advertise_routes(FAKE_LOCAL_AS1, routes)
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS1)
+        speaker.prefix_add.assert_has_calls(
+            [mock.call(prefix=FAKE_ROUTE, next_hop=FAKE_NEXTHOP),
+             mock.call(prefix=FAKE_ROUTE_2, next_hop=FAKE_NEXTHOP)])
+
+    def test_withdraw_routes(self):
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        self.ryu_bgp_driver.withdraw_routes(FAKE_LOCAL_AS1,
+                                            [FAKE_ROUTE, FAKE_ROUTE_2])
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS1)
+        speaker.prefix_del.assert_has_calls(
+            [mock.call(prefix=FAKE_ROUTE), mock.call(prefix=FAKE_ROUTE_2)])
+
+    def test_add_vrf(self):
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        self.ryu_bgp_driver.add_vrf(FAKE_LOCAL_AS1, FAKE_RD, ['100:1'],
+                                    ['100:2'])
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS1)
+        speaker.vrf_add.assert_called_once_with(
+            route_dist=FAKE_RD, import_rts=['100:1'], export_rts=['100:2'],
+            route_family=bgpspeaker.RF_L2_EVPN)
+        self.ryu_bgp_driver.delete_vrf(FAKE_LOCAL_AS1, FAKE_RD)
+        speaker.vrf_del.assert_called_once_with(route_dist=FAKE_RD)
+
+    def test_advertise_vrf_routes(self):
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        routes = [{'destination': FAKE_ROUTE, 'gateway_ip': FAKE_NEXTHOP}]
+        self.ryu_bgp_driver.advertise_vrf_routes(FAKE_LOCAL_AS1, FAKE_RD,
+                                                 routes, vni=100)
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS1)
+        speaker.evpn_prefix_add.assert_called_once_with(
+            route_type=bgpspeaker.EVPN_IP_PREFIX_ROUTE, route_dist=FAKE_RD,
+            ethernet_tag_id=0, ip_prefix=FAKE_ROUTE, gw_ip_addr=FAKE_NEXTHOP,
+            vni=100, tunnel_type=bgpspeaker.TUNNEL_TYPE_VXLAN)
+
+    def test_withdraw_vrf_routes(self):
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        self.ryu_bgp_driver.withdraw_vrf_routes(FAKE_LOCAL_AS1, FAKE_RD,
+                                                [FAKE_ROUTE, FAKE_ROUTE_2])
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS1)
+        speaker.evpn_prefix_del.assert_has_calls(
+            [mock.call(route_type=bgpspeaker.EVPN_IP_PREFIX_ROUTE,
+                       route_dist=FAKE_RD, ethernet_tag_id=0,
+                       ip_prefix=FAKE_ROUTE),
+             mock.call(route_type=bgpspeaker.EVPN_IP_PREFIX_ROUTE,
+                       route_dist=FAKE_RD, ethernet_tag_id=0,
+                       ip_prefix=FAKE_ROUTE_2)])
+
+    def test_advertise_vrf_routes_in_process(self):
+        cfg.CONF.set_override('max_bgp_speakers', 2, 'BGP')
+        self.ryu_bgp_driver = ryu_driver.RyuBgpDriver(cfg.CONF.BGP)
+        mock.patch.object(speaker_process, 'BgpSpeakerProcess').start()
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS2)
+        routes = [{'destination': FAKE_ROUTE, 'gateway_ip': FAKE_NEXTHOP},
+                  {'destination': FAKE_ROUTE_2, 'gateway_ip': FAKE_NEXTHOP}]
+        self.ryu_bgp_driver.advertise_vrf_routes(FAKE_LOCAL_AS2, FAKE_RD,
+                                                 routes)
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS2)
+        speaker.call_many.assert_called_once_with(
+            'evpn_prefix_add',
+            [{'route_type': bgpspeaker.EVPN_IP_PREFIX_ROUTE,
+              'route_dist': FAKE_RD, 'ethernet_tag_id': 0,
+              'ip_prefix': route['destination'],
+              'gw_ip_addr': route['gateway_ip']} for route in routes])
+        self.assertFalse(speaker.evpn_prefix_add.called)
+
+    def test_bgp_speaker_process_exited(self):
+        cfg.CONF.set_override('max_bgp_speakers', 2, 'BGP')
+        self.ryu_bgp_driver = ryu_driver.RyuBgpDriver(cfg.CONF.BGP)
+        mock_process = mock.patch.object(speaker_process,
+                                         'BgpSpeakerProcess').start()
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS2)
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS2)
+        on_exit = mock_process.call_args[1]['on_exit']
+        # The exit of a process already replaced is ignored
+        on_exit(mock.Mock())
+        self.assertEqual(2,
+                self.ryu_bgp_driver.cache.get_hosted_bgp_speakers_count())
+        on_exit(speaker)
+        self.assertIsNone(
+                self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS2))
+        self.assertRaises(bgp_driver_exc.BgpSpeakerNotAdded,
+                          self.ryu_bgp_driver.advertise_routes,
+                          FAKE_LOCAL_AS2, [])
+        # The resync adds it again in a new process
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS2)
+        self.assertEqual(2, mock_process.call_count)
+
     def test_add_same_bgp_speakers_twice(self):
         self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
         self.assertRaises(bgp_driver_exc.BgpSpeakerAlreadyScheduled,
@@ -236,6 +354,23 @@ class TestRyuBgpDriver(base.BaseTestCase):
                           self.ryu_bgp_driver.advertise_route,
                           FAKE_LOCAL_AS1, FAKE_ROUTE, 12345)
 
+    def test_advertise_routes_with_invalid_paramtype(self):
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        routes = [{'destination': FAKE_ROUTE, 'next_hop': FAKE_NEXTHOP},
+                  {'destination': 12345, 'next_hop': FAKE_NEXTHOP}]
+        self.assertRaises(bgp_driver_exc.InvalidParamType,
+                          self.ryu_bgp_driver.advertise_routes,
+                          FAKE_LOCAL_AS1, routes)
+        speaker = self.ryu_bgp_driver.cache.get_bgp_speaker(FAKE_LOCAL_AS1)
+        self.assertFalse(speaker.prefix_add.called)
+
+    def test_advertise_routes_without_adding_speaker(self):
+        self.assertRaises(bgp_driver_exc.BgpSpeakerNotAdded,
+                          self.ryu_bgp_driver.advertise_routes,
+                          FAKE_LOCAL_AS1,
+                          [{'destination': FAKE_ROUTE,
+                            'next_hop': FAKE_NEXTHOP}])
+
     def test_advertise_route_without_adding_speaker(self):
         self.assertRaises(bgp_driver_exc.BgpSpeakerNotAdded,
                           self.ryu_bgp_driver.advertise_route,
@@ -270,3 +405,27 @@ class TestRyuBgpDriver(base.BaseTestCase):
         self.ryu_bgp_driver.delete_bgp_speaker(FAKE_LOCAL_AS1)
         self.assertEqual(0,
                 self.ryu_bgp_driver.cache.get_hosted_bgp_speakers_count())
+
+    def test_add_multiple_bgp_speakers_in_processes(self):
+        cfg.CONF.set_override('max_bgp_speakers', 2, 'BGP')
+        self.ryu_bgp_driver = ryu_driver.RyuBgpDriver(cfg.CONF.BGP)
+        mock_process = mock.patch.object(speaker_process,
+                                         'BgpSpeakerProcess').start()
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS1)
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS2)
+        self.assertEqual(2,
+                self.ryu_bgp_driver.cache.get_hosted_bgp_speakers_count())
+        self.assertEqual(1, self.mock_ryu_speaker.call_count)
+        mock_process.assert_called_once_with(as_number=FAKE_LOCAL_AS2,
+                                             router_id=FAKE_ROUTER_ID,
+                                             on_exit=mock.ANY)
+        self.assertRaises(bgp_driver_exc.BgpSpeakerMaxScheduled,
+                          self.ryu_bgp_driver.add_bgp_speaker,
+                          FAKE_LOCAL_AS3)
+
+        # Once the first BGP speaker is deleted, the next one runs in the
+        # BGP DrAgent again.
+        self.ryu_bgp_driver.delete_bgp_speaker(FAKE_LOCAL_AS1)
+        self.ryu_bgp_driver.add_bgp_speaker(FAKE_LOCAL_AS3)
+        self.assertEqual(2, self.mock_ryu_speaker.call_count)
+        self.assertEqual(1, mock_process.call_count)
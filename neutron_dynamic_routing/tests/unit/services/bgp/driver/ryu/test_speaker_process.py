@@ -0,0 +1,82 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+import fixtures
+
+from neutron.tests import base
+
+from neutron_dynamic_routing.services.bgp.agent.driver.ryu import speaker_process  # noqa
+
+FAKE_LOCAL_AS = 12345
+FAKE_ROUTER_ID = '1.1.1.1'
+FAKE_PEER_IP = '2.2.2.2'
+
+# Child process serving the calls with a fake Ryu BGP speaker which writes
+# to the standard output and logs while serving them.
+CHILD_SCRIPT = """
+from oslo_log import log as logging
+
+from neutron_dynamic_routing.services.bgp.agent.driver.ryu import speaker_process  # noqa
+
+LOG = logging.getLogger(__name__)
+
+
+class FakeBgpSpeaker(object):
+    def __init__(self, as_number, router_id):
+        pass
+
+    def neighbor_state_get(self, address=None, format='json'):
+        print('Not a reply')
+        LOG.warning('Getting the state of neighbor %s', address)
+        return {address: 'Established'}
+
+    def shutdown(self):
+        LOG.warning('Shutting down')
+
+
+speaker_process._start_speaker = FakeBgpSpeaker
+speaker_process.main()
+"""
+
+
+class ScriptedBgpSpeakerProcess(speaker_process.BgpSpeakerProcess):
+
+    def __init__(self, command, *args, **kwargs):
+        self._command = command
+        super(ScriptedBgpSpeakerProcess, self).__init__(*args, **kwargs)
+
+    def _get_command(self):
+        return self._command
+
+
+class TestBgpSpeakerProcess(base.BaseTestCase):
+
+    def test_call_with_child_output(self):
+        # Without a log file nor use_stderr, the child logs to its standard
+        # output, which must not be mistaken for the replies.
+        temp_dir = self.useFixture(fixtures.TempDir()).path
+        config_file = os.path.join(temp_dir, 'bgp_dragent.ini')
+        with open(config_file, 'w') as f:
+            f.write('[DEFAULT]\nuse_stderr = False\n')
+        process = ScriptedBgpSpeakerProcess(
+            [sys.executable, '-c', CHILD_SCRIPT, '--config-file', config_file],
+            FAKE_LOCAL_AS, FAKE_ROUTER_ID)
+        for i in range(2):
+            self.assertEqual({FAKE_PEER_IP: 'Established'},
+                             process.neighbor_state_get(address=FAKE_PEER_IP))
+        process.shutdown()
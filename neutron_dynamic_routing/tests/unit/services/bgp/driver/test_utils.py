@@ -47,3 +47,10 @@ class TestBgpMultiSpeakerCache(base.BaseTestCase):
     def test_get_hosted_bgp_speakers_count(self):
         self.bs_cache.put_bgp_speaker(FAKE_LOCAL_AS, FAKE_RYU_SPEAKER)
         self.assertEqual(1, self.bs_cache.get_hosted_bgp_speakers_count())
+
+    def test_is_full(self):
+        self.bs_cache = bgp_driver_utils.BgpMultiSpeakerCache(max_speakers=2)
+        self.bs_cache.put_bgp_speaker(FAKE_LOCAL_AS, FAKE_RYU_SPEAKER)
+        self.assertFalse(self.bs_cache.is_full())
+        self.bs_cache.put_bgp_speaker(FAKE_LOCAL_AS + 1, FAKE_RYU_SPEAKER)
+        self.assertTrue(self.bs_cache.is_full())
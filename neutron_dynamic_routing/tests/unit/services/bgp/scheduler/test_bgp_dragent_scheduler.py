@@ -15,6 +15,7 @@
 
 import testscenarios
 
+from oslo_config import cfg
 from oslo_utils import importutils
 
 from neutron import context
@@ -150,6 +151,65 @@ class TestBgpAgentFilter(TestBgpDrAgentSchedulerBaseTestCase,
             bgp_speaker,
             expected_filtered_dragent_ids=expected_filtered_dragent_ids)
 
+    def test_filter_agents_dragents_per_bgp_speaker(self):
+        cfg.CONF.set_override('dragents_per_bgp_speaker', 2)
+        agents = self._create_and_set_agents_down(
+            ['host-a', 'host-b', 'host-c'])
+        self._test_schedule_bind_bgp_speaker([agents[0]], self.bgp_speaker_id)
+        expected_filtered_dragent_ids = [agents[1].id, agents[2].id]
+        self._test_filter_agents_helper(
+            self.bgp_speaker,
+            expected_filtered_dragent_ids=expected_filtered_dragent_ids)
+
+    def test_filter_agents_agent_with_capacity(self):
+        agent = helpers.register_bgp_dragent(
+            'host-a', configurations={'max_bgp_speakers': 2})
+        self._test_schedule_bind_bgp_speaker([agent], self.bgp_speaker_id)
+        bgp_speaker = {'id': 'bar-speaker-id'}
+        self._save_bgp_speaker(bgp_speaker['id'])
+        self._test_filter_agents_helper(
+            bgp_speaker, expected_filtered_dragent_ids=[agent.id])
+
+        self._test_schedule_bind_bgp_speaker([agent], bgp_speaker['id'])
+        bgp_speaker = {'id': 'baz-speaker-id'}
+        self._save_bgp_speaker(bgp_speaker['id'])
+        self._test_filter_agents_helper(bgp_speaker, expected_num_agents=0)
+
+
+class TestLoadScheduler(TestBgpDrAgentSchedulerBaseTestCase,
+                        bgp_db.BgpDbMixin,
+                        bgp_dras_db.BgpDrAgentSchedulerDbMixin):
+
+    def setUp(self):
+        super(TestLoadScheduler, self).setUp()
+        self.scheduler = bgp_dras.LoadScheduler()
+
+    def _test_select(self, agents, expected_agent):
+        chosen_agents = self.scheduler.select(self, self.ctx, agents, 0, 1)
+        self.assertEqual([expected_agent.id],
+                         [agent.id for agent in chosen_agents])
+
+    def test_select_agent_with_fewer_bound_routes(self):
+        agents = self._create_and_set_agents_down(['host-a', 'host-b'])
+        self._test_schedule_bind_bgp_speaker([agents[0]], self.bgp_speaker_id)
+        self._save_bgp_speaker_routes(self.ctx, self.bgp_speaker_id,
+                                      [{'destination': '10.0.0.0/24',
+                                        'next_hop': '1.1.1.1'}])
+        self._test_select(agents, agents[1])
+
+    def test_select_agent_with_fewer_reported_routes(self):
+        agents = [helpers.register_bgp_dragent(
+                      'host-a',
+                      configurations={'bgp_speakers': 1,
+                                      'bgp_peers': 0,
+                                      'advertise_routes': 1000}),
+                  helpers.register_bgp_dragent(
+                      'host-b',
+                      configurations={'bgp_speakers': 2,
+                                      'bgp_peers': 4,
+                                      'advertise_routes': 10})]
+        self._test_select(agents, agents[1])
+
 
 class TestAutoScheduleBgpSpeakers(TestBgpDrAgentSchedulerBaseTestCase):
     """Unit test scenarios for schedule_unscheduled_bgp_speakers.
@@ -223,3 +283,38 @@ class TestAutoScheduleBgpSpeakers(TestBgpDrAgentSchedulerBaseTestCase):
         hosted_agents = self.ctx.session.query(
             bgp_dras_db.BgpSpeakerDrAgentBinding).all()
         self.assertEqual(expected_hosted_agents, len(hosted_agents))
+
+
+class TestAutoScheduleBgpSpeakersCapacity(
+                                    TestBgpDrAgentSchedulerBaseTestCase):
+
+    def test_auto_schedule_bgp_speakers_up_to_capacity(self):
+        scheduler = bgp_dras.ChanceScheduler()
+        helpers.register_bgp_dragent(
+            'host-a', configurations={'max_bgp_speakers': 2})
+        for bgp_speaker_id in ('bar-speaker-id', 'baz-speaker-id'):
+            self._save_bgp_speaker(bgp_speaker_id)
+
+        self.assertTrue(scheduler.schedule_unscheduled_bgp_speakers(
+            self.ctx, 'host-a'))
+        hosted_agents = self.ctx.session.query(
+            bgp_dras_db.BgpSpeakerDrAgentBinding).all()
+        self.assertEqual(2, len(hosted_agents))
+        self.assertFalse(scheduler.schedule_unscheduled_bgp_speakers(
+            self.ctx, 'host-a'))
+
+    def test_auto_schedule_bgp_speaker_dragents_per_bgp_speaker(self):
+        cfg.CONF.set_override('dragents_per_bgp_speaker', 2)
+        scheduler = bgp_dras.ChanceScheduler()
+        agents = self._create_and_set_agents_down(['host-a', 'host-b'])
+        self._test_schedule_bind_bgp_speaker([agents[0]], self.bgp_speaker_id)
+
+        self.assertFalse(scheduler.schedule_unscheduled_bgp_speakers(
+            self.ctx, 'host-a'))
+        self.assertTrue(scheduler.schedule_unscheduled_bgp_speakers(
+            self.ctx, 'host-b'))
+        hosted_agents = self.ctx.session.query(
+            bgp_dras_db.BgpSpeakerDrAgentBinding).filter_by(
+            bgp_speaker_id=self.bgp_speaker_id).all()
+        self.assertEqual(set(agent.id for agent in agents),
+                         set(binding.agent_id for binding in hosted_agents))
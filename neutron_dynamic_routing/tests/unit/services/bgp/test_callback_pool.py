@@ -0,0 +1,70 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+import mock
+
+from neutron.tests import base
+
+from neutron_dynamic_routing.services.bgp import callback_pool
+
+
+class TestCallbackWorkerPool(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestCallbackWorkerPool, self).setUp()
+        self.calls = []
+
+    def _work(self, item):
+        self.calls.append(item)
+
+    def test_no_workers_processes_synchronously(self):
+        pool = callback_pool.CallbackWorkerPool(workers=0)
+        pool.submit('foo', self._work, 1)
+        self.assertEqual([1], self.calls)
+        self.assertEqual(1, pool.get_stats()['processed'])
+
+    def test_items_of_a_key_processed_in_order(self):
+        pool = callback_pool.CallbackWorkerPool(workers=4, queue_size=10)
+        for item in range(5):
+            pool.submit('foo', self._work, item)
+        self.assertEqual([], self.calls)
+        self.assertEqual(5, pool.get_stats()['queued'])
+
+        eventlet.sleep(0)
+        self.assertEqual(list(range(5)), self.calls)
+        stats = pool.get_stats()
+        self.assertEqual(0, stats['queued'])
+        self.assertEqual(5, stats['max_queued'])
+        self.assertEqual(5, stats['processed'])
+
+    def test_full_queue_throttles_submit(self):
+        pool = callback_pool.CallbackWorkerPool(workers=1, queue_size=1)
+        pool.submit('foo', self._work, 1)
+        pool.submit('foo', self._work, 2)
+        eventlet.sleep(0)
+        self.assertEqual([1, 2], self.calls)
+        self.assertEqual(1, pool.get_stats()['throttled'])
+
+    def test_failure_is_logged(self):
+        pool = callback_pool.CallbackWorkerPool(workers=1)
+        with mock.patch.object(callback_pool.LOG, 'exception') as log:
+            pool.submit('foo', mock.Mock(side_effect=RuntimeError))
+            pool.submit('foo', self._work, 1)
+            eventlet.sleep(0)
+            self.assertTrue(log.called)
+        self.assertEqual([1], self.calls)
+        stats = pool.get_stats()
+        self.assertEqual(1, stats['failed'])
+        self.assertEqual(1, stats['processed'])
@@ -0,0 +1,124 @@
+# Copyright 2016 Huawei Technologies India Pvt. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+
+from neutron.tests import base
+
+from neutron_dynamic_routing.services.bgp import route_batcher
+
+ROUTE_1 = {'destination': '10.0.0.0/24', 'next_hop': '1.1.1.1'}
+ROUTE_2 = {'destination': '20.0.0.0/24', 'next_hop': '1.1.1.1'}
+ROUTE_3 = {'destination': '30.0.0.0/24', 'next_hop': '1.1.1.1'}
+
+
+class TestRouteNotificationBatcher(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRouteNotificationBatcher, self).setUp()
+        self.notify = mock.Mock()
+        self.ctx = mock.Mock()
+        self.bgp_rpc = mock.Mock()
+        spawn_after_p = mock.patch.object(route_batcher.eventlet,
+                                          'spawn_after')
+        self.spawn_after = spawn_after_p.start()
+
+    def test_no_interval_notifies_immediately(self):
+        batcher = route_batcher.RouteNotificationBatcher(self.notify,
+                                                         interval=0)
+        batcher.advertise_routes(self.ctx, self.bgp_rpc, 'foo-id', [ROUTE_1])
+        self.notify.assert_called_once_with(self.ctx, self.bgp_rpc,
+                                            'foo-id', [ROUTE_1], [])
+        self.assertFalse(self.spawn_after.called)
+
+    def test_withdraw_by_destination(self):
+        batcher = route_batcher.RouteNotificationBatcher(self.notify,
+                                                         interval=0)
+        batcher.withdraw_routes(self.ctx, self.bgp_rpc, 'foo-id',
+                                [ROUTE_1['destination']])
+        self.notify.assert_called_once_with(
+            self.ctx, self.bgp_rpc, 'foo-id', [],
+            [{'destination': ROUTE_1['destination']}])
+
+    def test_routes_coalesced_within_interval(self):
+        batcher = route_batcher.RouteNotificationBatcher(self.notify,
+                                                         interval=1)
+        batcher.advertise_routes(self.ctx, self.bgp_rpc, 'foo-id', [ROUTE_1])
+        batcher.advertise_routes(self.ctx, self.bgp_rpc, 'foo-id', [ROUTE_2])
+        batcher.withdraw_routes(self.ctx, self.bgp_rpc, 'foo-id', [ROUTE_3])
+        batcher.advertise_routes(self.ctx, self.bgp_rpc, 'bar-id', [ROUTE_1])
+        self.assertFalse(self.notify.called)
+        self.spawn_after.assert_has_calls(
+            [mock.call(1, batcher.flush, 'foo-id'),
+             mock.call(1, batcher.flush, 'bar-id')])
+        self.assertEqual(2, self.spawn_after.call_count)
+
+        batcher.flush('foo-id')
+        self.notify.assert_called_once_with(self.ctx, self.bgp_rpc,
+                                            'foo-id', [ROUTE_1, ROUTE_2],
+                                            [ROUTE_3])
+
+    def test_advertise_and_withdraw_new_route_cancel_out(self):
+        batcher = route_batcher.RouteNotificationBatcher(self.notify,
+                                                         interval=1)
+        batcher.advertise_routes(self.ctx, self.bgp_rpc, 'foo-id',
+                                 [ROUTE_1, ROUTE_2],
+                                 new_destinations={ROUTE_1['destination'],
+                                                   ROUTE_2['destination']})
+        batcher.withdraw_routes(self.ctx, self.bgp_rpc, 'foo-id',
+                                [ROUTE_1['destination']])
+        batcher.flush('foo-id')
+        self.notify.assert_called_once_with(self.ctx, self.bgp_rpc,
+                                            'foo-id', [ROUTE_2], [])
+
+        self.notify.reset_mock()
+        batcher.advertise_routes(self.ctx, self.bgp_rpc, 'foo-id', [ROUTE_3],
+                                 new_destinations={ROUTE_3['destination']})
+        batcher.withdraw_routes(self.ctx, self.bgp_rpc, 'foo-id', [ROUTE_3])
+        batcher.flush('foo-id')
+        self.assertFalse(self.notify.called)
+
+    def test_advertise_and_withdraw_known_route_keeps_withdrawal(self):
+        batcher = route_batcher.RouteNotificationBatcher(self.notify,
+                                                         interval=1)
+        # ROUTE_1 was advertised before the window with another next hop
+        batcher.advertise_routes(self.ctx, self.bgp_rpc, 'foo-id',
+                                 [ROUTE_1, ROUTE_2],
+                                 new_destinations={ROUTE_2['destination']})
+        batcher.withdraw_routes(self.ctx, self.bgp_rpc, 'foo-id',
+                                [ROUTE_1, ROUTE_2])
+        batcher.flush('foo-id')
+        self.notify.assert_called_once_with(self.ctx, self.bgp_rpc,
+                                            'foo-id', [], [ROUTE_1])
+
+    def test_withdraw_then_advertise_keeps_both(self):
+        batcher = route_batcher.RouteNotificationBatcher(self.notify,
+                                                         interval=1)
+        new_route = {'destination': ROUTE_1['destination'],
+                     'next_hop': '2.2.2.2'}
+        batcher.withdraw_routes(self.ctx, self.bgp_rpc, 'foo-id', [ROUTE_1])
+        batcher.advertise_routes(self.ctx, self.bgp_rpc, 'foo-id',
+                                 [new_route])
+        batcher.flush('foo-id')
+        self.notify.assert_called_once_with(self.ctx, self.bgp_rpc,
+                                            'foo-id', [new_route], [ROUTE_1])
+
+    def test_flush_failure_is_logged(self):
+        self.notify.side_effect = RuntimeError
+        batcher = route_batcher.RouteNotificationBatcher(self.notify,
+                                                         interval=0)
+        with mock.patch.object(route_batcher.LOG, 'exception') as log:
+            batcher.advertise_routes(self.ctx, self.bgp_rpc, 'foo-id',
+                                     [ROUTE_1])
+            self.assertTrue(log.called)